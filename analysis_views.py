@@ -0,0 +1,347 @@
+# analysis_views.py
+"""
+Response bodies of the analysis read endpoints, shared by the Flask
+routes and the ASGI service so both return identical documents.
+"""
+import os
+import json
+import time
+import logging
+from typing import Callable, Dict, Iterable, List, Optional
+
+from scan_status import FINAL_PHASES, scan_status
+
+logger = logging.getLogger(__name__)
+
+# Server-sent scan events: poll interval, keep-alive and stream lifetime
+EVENTS_POLL_SECONDS = 1.0
+EVENTS_HEARTBEAT_SECONDS = 15
+EVENTS_MAX_SECONDS = int(os.getenv('SCAN_EVENTS_MAX_SECONDS', '600'))
+
+
+def summary_payload(repo_name: str, owner: str, repo: str, result,
+                    document: Optional[Dict]) -> Dict:
+    """Body of GET /api/v1/analysis/<owner>/<repo>/summary"""
+    document = document or {}
+    summary = document.get('summary', {})
+    return {
+        'success': True,
+        'data': {
+            'repository': {
+                'name': repo_name,
+                'owner': owner,
+                'repo': repo
+            },
+            'metadata': {
+                'timestamp': result.timestamp.isoformat(),
+                'status': result.status,
+                'semgrep_version': summary.get('semgrep_version', 'unknown')
+            },
+            'summary': {
+                'total_findings': summary.get('total_findings', 0),
+                'files_scanned': summary.get('files_scanned', 0),
+                'scan_status': summary.get('scan_status', 'failed')
+            },
+            'severity_breakdown': summary.get('severity_counts', {}),
+            'category_breakdown': summary.get('category_counts', {}),
+            'error_count': len(document.get('errors', []))
+        }
+    }
+
+
+def findings_payload(repo_name: str, owner: str, repo: str, result, document: Dict,
+                     page: int, per_page: int, severity: str = '', category: str = '') -> Dict:
+    """Body of GET /api/v1/analysis/<owner>/<repo>/findings"""
+    summary = document['summary']
+    findings = document['findings']
+
+    # Apply filters
+    if severity:
+        findings = [f for f in findings if f['severity'] == severity]
+    if category:
+        findings = [f for f in findings if f['category'] == category]
+
+    # Manual pagination
+    total_findings = len(findings)
+    start_idx = (page - 1) * per_page
+    end_idx = start_idx + per_page
+    paginated_findings = findings[start_idx:end_idx]
+
+    return {
+        'success': True,
+        'data': {
+            'repository': {
+                'name': repo_name,
+                'owner': owner,
+                'repo': repo
+            },
+            'metadata': {
+                'timestamp': result.timestamp.isoformat(),
+                'status': result.status,
+                'semgrep_version': summary['semgrep_version']
+            },
+            'summary': {
+                'files_scanned': summary['files_scanned'],
+                'scan_status': summary['scan_status'],
+                'total_findings': summary['total_findings']
+            },
+            'findings': paginated_findings,
+            'pagination': {
+                'current_page': page,
+                'total_pages': (total_findings + per_page - 1) // per_page,
+                'total_items': total_findings,
+                'per_page': per_page
+            },
+            'filters': {
+                'available_severities': list(summary['severity_counts'].keys()),
+                'available_categories': list(summary['category_counts'].keys())
+            }
+        }
+    }
+
+
+def result_payload(repo_name: str, owner: str, repo: str, result, document: Dict,
+                   page: int, per_page: int, severity: str = '', category: str = '',
+                   file_path: str = '') -> Dict:
+    """
+    Body of GET /api/v1/analysis/<owner>/<repo>/result: findings of the
+    latest analysis filtered by severity, category and file substring,
+    with the filter values available in the filtered set
+    """
+    summary = document['summary']
+    findings = document['findings']
+
+    if severity:
+        findings = [f for f in findings if f['severity'] == severity]
+    if category:
+        findings = [f for f in findings if f['category'].lower() == category.lower()]
+    if file_path:
+        findings = [f for f in findings if file_path in f['file']]
+
+    total_findings = len(findings)
+    start_idx = (page - 1) * per_page
+    paginated_findings = findings[start_idx:start_idx + per_page]
+
+    return {
+        'success': True,
+        'data': {
+            'repository': {
+                'name': repo_name,
+                'owner': owner,
+                'repo': repo
+            },
+            'metadata': {
+                'analysis_id': result.id,
+                'timestamp': result.timestamp.isoformat(),
+                'status': result.status,
+                'duration_seconds': document['metadata'].get('scan_duration_seconds')
+            },
+            'summary': {
+                'files_scanned': summary['files_scanned'],
+                'total_findings': total_findings,
+                'severity_counts': summary['severity_counts'],
+                'category_counts': summary['category_counts']
+            },
+            'findings': paginated_findings,
+            'pagination': {
+                'current_page': page,
+                'total_pages': (total_findings + per_page - 1) // per_page,
+                'total_items': total_findings,
+                'per_page': per_page
+            },
+            'filters': {
+                'available_severities': sorted({f['severity'] for f in findings}),
+                'available_categories': sorted({f['category'].lower() for f in findings})
+            }
+        }
+    }
+
+
+def analysis_list_item(analysis) -> Dict:
+    """Header fields of an analysis in list endpoints"""
+    return {
+        'id': analysis.id,
+        'repository_name': analysis.repository_name,
+        'user_id': analysis.user_id,
+        'timestamp': analysis.timestamp.isoformat(),
+        'status': analysis.status
+    }
+
+
+# Most severe first when sorted in reverse
+USER_VULNERABILITY_SEVERITY_ORDER = {
+    'ERROR': 0,
+    'HIGH': 1,
+    'MEDIUM': 2,
+    'LOW': 3,
+    'WARNING': 4,
+    'INFO': 5
+}
+
+
+def load_documents(analyses: Iterable, load: Callable) -> Dict[int, Dict]:
+    """Documents by analysis id; analyses whose document fails to load are left out"""
+    documents = {}
+    for analysis in analyses:
+        try:
+            documents[analysis.id] = load(analysis)
+        except Exception as e:
+            logger.error(f"Error processing analysis for {analysis.repository_name}: {str(e)}")
+    return documents
+
+
+def user_vulnerabilities_payload(user_id: str, repository: Optional[str],
+                                 analyses: List, documents: Dict[int, Dict]) -> Dict:
+    """
+    Body of GET /api/v1/users/top-vulnerabilities for analyses ordered
+    newest first. A finding reported by several analyses of a repository
+    is listed once, from the newest.
+    """
+    all_vulnerabilities: List[Dict] = []
+    seen_vulns = set()
+
+    for analysis in analyses:
+        document = documents.get(analysis.id)
+        if document is None:
+            continue
+        try:
+            repo_name = analysis.repository_name
+
+            for finding in document['findings']:
+                vuln_id = (repo_name, finding['fingerprint'])
+
+                if vuln_id in seen_vulns:
+                    continue
+
+                seen_vulns.add(vuln_id)
+
+                all_vulnerabilities.append({
+                    'category': finding.get('category', 'security'),
+                    'code_snippet': finding.get('code_snippet', ''),
+                    'file': finding.get('file'),
+                    'fix_recommendations': {
+                        'description': finding.get('fix_recommendations', {}).get('description', ''),
+                        'references': finding.get('fix_recommendations', {}).get('references', [])
+                    },
+                    'line_range': {
+                        'start': finding.get('line_start'),
+                        'end': finding.get('line_end')
+                    },
+                    'message': finding.get('message'),
+                    'repository': {
+                        'analyzed_at': analysis.timestamp.isoformat(),
+                        'full_name': repo_name,
+                        'name': repo_name.split('/')[-1]
+                    },
+                    'security_references': {
+                        'cwe': finding.get('cwe', []),
+                        'owasp': finding.get('owasp', [])
+                    },
+                    'severity': finding.get('severity'),
+                    'vulnerability_id': finding.get('id'),
+                    'fingerprint': finding['fingerprint']
+                })
+
+        except Exception as e:
+            logger.error(f"Error processing analysis for {analysis.repository_name}: {str(e)}")
+            continue
+
+    all_vulnerabilities.sort(
+        key=lambda x: (
+            USER_VULNERABILITY_SEVERITY_ORDER.get(x['severity'], 999),
+            x['repository']['analyzed_at']
+        ),
+        reverse=True
+    )
+
+    # Calculate statistics
+    severity_counts = {}
+    category_counts = {}
+    repository_counts = {}
+
+    for vuln in all_vulnerabilities:
+        severity = vuln['severity']
+        severity_counts[severity] = severity_counts.get(severity, 0) + 1
+
+        category = vuln['category']
+        category_counts[category] = category_counts.get(category, 0) + 1
+
+        repo = vuln['repository']['full_name']
+        repository_counts[repo] = repository_counts.get(repo, 0) + 1
+
+    unique_repos = {vuln['repository']['full_name'] for vuln in all_vulnerabilities}
+
+    return {
+        'success': True,
+        'data': {
+            'metadata': {
+                'user_id': user_id,
+                'repository': repository if repository else None,  # Include repository filter in metadata
+                'total_vulnerabilities': len(all_vulnerabilities),
+                'total_repositories': len(unique_repos),
+                'severity_breakdown': severity_counts,
+                'category_breakdown': category_counts,
+                'repository_breakdown': repository_counts,
+                'last_scan': max(
+                    analysis.timestamp for analysis in analyses
+                ).isoformat() if analyses else None
+            },
+            'vulnerabilities': all_vulnerabilities
+        }
+    }
+
+
+def status_payload(analysis, snapshot: Optional[Dict] = None) -> Dict:
+    """
+    Stored status of an analysis merged with its live progress snapshot;
+    async callers pass the snapshot from ``scan_status.get_async``
+    """
+    if snapshot is None:
+        snapshot = scan_status.get(analysis.id)
+    snapshot = snapshot or {}
+    phase = snapshot.get('phase')
+    # The database is authoritative once the scan has finished
+    if analysis.status in FINAL_PHASES or phase is None:
+        phase = analysis.status
+    return {
+        'analysis_id': analysis.id,
+        'repository': analysis.repository_name,
+        'status': analysis.status,
+        'commit_sha': analysis.commit_sha,
+        'phase': phase,
+        'progress': snapshot.get('progress', {}),
+        'sequence': snapshot.get('sequence', 0),
+        'updated_at': snapshot.get('updated_at'),
+        'error': analysis.error if analysis.status == 'failed' else None
+    }
+
+
+class StatusEvents:
+    """
+    Server-sent events of one analysis, from its status polled every
+    ``EVENTS_POLL_SECONDS``: a ``progress`` event whenever its snapshot
+    changes, keep-alives in between and a final ``done`` event
+    """
+
+    def __init__(self):
+        self.started = self.last_sent = time.monotonic()
+        self.sequence = None
+        self.finished = False
+
+    @property
+    def open(self) -> bool:
+        return not self.finished and time.monotonic() - self.started < EVENTS_MAX_SECONDS
+
+    def poll(self, analysis, snapshot: Optional[Dict] = None) -> Optional[str]:
+        """Event text for the current state of ``analysis``, if any is due"""
+        payload = status_payload(analysis, snapshot)
+        self.finished = payload['phase'] in FINAL_PHASES
+        if self.finished or payload['sequence'] != self.sequence:
+            self.sequence = payload['sequence']
+            self.last_sent = time.monotonic()
+            event = 'done' if self.finished else 'progress'
+            return f"id: {self.sequence}\nevent: {event}\ndata: {json.dumps(payload, default=str)}\n\n"
+        if time.monotonic() - self.last_sent >= EVENTS_HEARTBEAT_SECONDS:
+            self.last_sent = time.monotonic()
+            return ": keep-alive\n\n"
+        return None
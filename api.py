@@ -1,8 +1,14 @@
-from flask import Blueprint, jsonify, request
-from sqlalchemy import func, desc
-from models import db, AnalysisResult
+from flask import Blueprint, Response, jsonify, request, stream_with_context
+from sqlalchemy import func
+from models import db, AnalysisResult, FindingFingerprint, QueuedScan
+from cache import response_cache
+from http_cache import make_etag, not_modified, with_validators
+from scan_status import FINAL_PHASES, scan_status
+from analysis_views import EVENTS_POLL_SECONDS, StatusEvents, status_payload
+from cancellation import scan_cancellations
 from collections import defaultdict
 import os
+import time
 import logging
 from pathlib import Path
 from github import Github
@@ -99,11 +105,7 @@ def get_repo_results(owner, repo):
     repository = f"{owner}/{repo}"
     
     # Get latest analysis result
-    result = AnalysisResult.query.filter_by(
-        repository_name=repository
-    ).order_by(
-        desc(AnalysisResult.timestamp)
-    ).first()
+    result = AnalysisResult.latest_for(repository)
 
     if not result:
         return jsonify({
@@ -117,30 +119,27 @@ def get_repo_results(owner, repo):
     page = int(request.args.get('page', 1))
     per_page = min(100, int(request.args.get('limit', 10)))
 
-    # Get the stored analysis data which already has the correct counts
-    stored_summary = result.results.get('summary', {})
-    findings = result.results.get('findings', [])
+    filters = {
+        'severity': severity,
+        'category': category,
+        'page': page,
+        'limit': per_page
+    }
+    etag = make_etag('repo_results', result.id, result.status, params=filters)
+    unchanged = not_modified(etag, result.timestamp, result.status)
+    if unchanged:
+        return unchanged
 
-    # Process each finding to add the file_name field
-    for finding in findings:
-        if 'file' in finding:
-            # Split the path and get everything after '/repo_YYYYMMDD_HHMMSS/'
-            full_path = finding['file']
-            path_parts = full_path.split('/')
-            
-            # Find the index of the part that starts with 'repo_'
-            repo_index = -1
-            for i, part in enumerate(path_parts):
-                if part.startswith('repo_'):
-                    repo_index = i
-                    break
-            
-            # If we found the repo_ part, take everything after it
-            if repo_index != -1 and repo_index + 1 < len(path_parts):
-                finding['file_name'] = '/'.join(path_parts[repo_index + 1:])
-            else:
-                # Fallback: just use the last part of the path
-                finding['file_name'] = path_parts[-1]
+    cache_key = response_cache.key('repo_results', repository, result.id, filters)
+    cached = response_cache.get(repository, cache_key)
+    if cached is not None:
+        return with_validators(jsonify(cached), etag, result.timestamp)
+
+    # Stored in the canonical findings schema, paths already repository-relative
+    document = result.document or {}
+    stored_summary = document.get('summary', {})
+    stored_metadata = document.get('metadata', {})
+    findings = document.get('findings', [])
 
     # Apply filters
     if severity:
@@ -152,7 +151,7 @@ def get_repo_results(owner, repo):
     total_findings = len(findings)
     paginated_findings = findings[(page-1)*per_page:page*per_page]
 
-    return jsonify({
+    payload = {
         'success': True,
         'data': {
             'repository': repository,
@@ -165,8 +164,8 @@ def get_repo_results(owner, repo):
                 'category_counts': stored_summary.get('category_counts', {})
             },
             'metadata': {
-                'scan_duration': result.results.get('metadata', {}).get('duration_seconds', 0),
-                'memory_usage_mb': result.results.get('stats', {}).get('memory_usage_mb', 0),
+                'scan_duration': stored_metadata.get('scan_duration_seconds', 0),
+                'memory_usage_mb': stored_metadata.get('memory_usage_mb', 0),
                 'analysis_id': result.id,
                 'status': result.status
             },
@@ -177,15 +176,211 @@ def get_repo_results(owner, repo):
                 'pages': (total_findings + per_page - 1) // per_page
             }
         }
+    }
+    if result.status == 'completed':
+        response_cache.set(repository, cache_key, payload)
+    return with_validators(jsonify(payload), etag, result.timestamp)
+
+@api.route('/repos/<owner>/<repo>/diff', methods=['GET'])
+def get_repo_diff(owner, repo):
+    """
+    New, fixed and persisting findings between two completed analyses.
+    Query parameters:
+    - head: Optional - analysis id to compare (defaults to the latest)
+    - base: Optional - analysis id to compare against (defaults to the one before head)
+    """
+    repository = f"{owner}/{repo}"
+    head_id = request.args.get('head', type=int)
+    base_id = request.args.get('base', type=int)
+
+    completed = AnalysisResult.completed_for(repository)
+    if head_id:
+        head = completed.filter(AnalysisResult.id == head_id).first()
+    else:
+        head = completed.order_by(AnalysisResult.timestamp.desc()).first()
+    if not head:
+        return jsonify({
+            'success': False,
+            'error': {'message': 'No completed analysis found', 'code': 'ANALYSIS_NOT_FOUND'}
+        }), 404
+
+    if base_id:
+        base = completed.filter(AnalysisResult.id == base_id).first()
+    else:
+        base = completed.filter(
+            AnalysisResult.timestamp < head.timestamp
+        ).order_by(AnalysisResult.timestamp.desc()).first()
+    if not base:
+        return jsonify({
+            'success': False,
+            'error': {
+                'message': 'No earlier completed analysis to compare against',
+                'code': 'BASE_NOT_FOUND'
+            }
+        }), 404
+
+    # Both analyses are completed and never change, so the pair identifies the diff
+    last_modified = max(head.timestamp, base.timestamp)
+    etag = make_etag('repo_diff', base.id, head.id)
+    unchanged = not_modified(etag, last_modified, 'completed')
+    if unchanged:
+        return unchanged
+
+    cache_key = response_cache.key('repo_diff', repository, head.id, {'base': base.id})
+    cached = response_cache.get(repository, cache_key)
+    if cached is not None:
+        return with_validators(jsonify(cached), etag, last_modified)
+
+    changes = FindingFingerprint.diff(base.id, head.id)
+    payload = {
+        'success': True,
+        'data': {
+            'repository': repository,
+            'base': {'analysis_id': base.id, 'timestamp': base.timestamp.isoformat()},
+            'head': {'analysis_id': head.id, 'timestamp': head.timestamp.isoformat()},
+            'summary': {name: len(rows) for name, rows in changes.items()},
+            **{name: [row.to_dict() for row in rows] for name, rows in changes.items()}
+        }
+    }
+    response_cache.set(repository, cache_key, payload)
+    return with_validators(jsonify(payload), etag, last_modified)
+
+def _load_analysis_header(analysis_id):
+    return AnalysisResult.query.options(
+        AnalysisResult.header_only()
+    ).populate_existing().get(analysis_id)
+
+@api.route('/analyses/<int:analysis_id>/status', methods=['GET'])
+def get_analysis_status(analysis_id):
+    """Current phase and progress counters of an analysis"""
+    analysis = _load_analysis_header(analysis_id)
+    if analysis is None:
+        return jsonify({
+            'success': False,
+            'error': {'message': 'Analysis not found', 'code': 'ANALYSIS_NOT_FOUND'}
+        }), 404
+
+    response = jsonify({'success': True, 'data': status_payload(analysis)})
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@api.route('/analyses/<int:analysis_id>/cancel', methods=['POST'])
+def cancel_analysis(analysis_id):
+    """
+    Cancel a queued or running scan. The worker running it kills its clone
+    and semgrep processes, removes its workspace and frees its scan slot.
+    Optional JSON body: reason
+    """
+    analysis = _load_analysis_header(analysis_id)
+    if analysis is None:
+        return jsonify({
+            'success': False,
+            'error': {'message': 'Analysis not found', 'code': 'ANALYSIS_NOT_FOUND'}
+        }), 404
+    if analysis.status in FINAL_PHASES:
+        return jsonify({
+            'success': False,
+            'error': {
+                'message': f'Analysis already {analysis.status}',
+                'code': 'ANALYSIS_FINISHED'
+            }
+        }), 409
+
+    payload = request.get_json(silent=True) or {}
+    reason = str(payload.get('reason') or 'Cancelled by request')
+
+    # Not claimed by a scan worker yet: nothing is running, cancel it here
+    if QueuedScan.discard_queued(analysis_id):
+        analysis.status = 'cancelled'
+        analysis.error = reason
+        db.session.commit()
+        scan_status.update(analysis_id, 'cancelled')
+        logger.info(f"Cancelled queued analysis {analysis_id}")
+        return jsonify({
+            'success': True,
+            'data': {
+                'analysis_id': analysis_id,
+                'status': 'cancelled',
+                'message': 'Queued scan cancelled'
+            }
+        }), 200
+
+    local = scan_cancellations.cancel(analysis_id, reason)
+    if not local and not scan_cancellations.shared:
+        # The request was only recorded in this process; no scan will see it
+        logger.warning(f"Cannot forward cancel of analysis {analysis_id}: no shared cache backend")
+        return jsonify({
+            'success': False,
+            'error': {
+                'message': 'The scan is not running in this process and cancel requests '
+                           'cannot reach other scan processes',
+                'code': 'CANCEL_UNAVAILABLE',
+                'details': 'Set RESPONSE_CACHE_BACKEND=redis to cancel scans run by workers'
+            }
+        }), 503
+    scan_status.update(analysis_id, cancel_requested=True)
+    logger.info(f"Cancel requested for analysis {analysis_id} ({'local' if local else 'forwarded'})")
+
+    return jsonify({
+        'success': True,
+        'data': {
+            'analysis_id': analysis_id,
+            'status': analysis.status,
+            'message': 'Cancellation requested'
+        }
+    }), 202
+
+@api.route('/analyses/<int:analysis_id>/events', methods=['GET'])
+def stream_analysis_events(analysis_id):
+    """
+    Server-sent events for an analysis: a ``progress`` event whenever its
+    snapshot changes and a final ``done`` event once it has finished.
+    Served natively by main.py under the ASGI server.
+    """
+    if _load_analysis_header(analysis_id) is None:
+        return jsonify({
+            'success': False,
+            'error': {'message': 'Analysis not found', 'code': 'ANALYSIS_NOT_FOUND'}
+        }), 404
+
+    def events():
+        stream = StatusEvents()
+        while stream.open:
+            try:
+                analysis = _load_analysis_header(analysis_id)
+                if analysis is None:
+                    return
+                event = stream.poll(analysis)
+            finally:
+                # A new session per poll sees the scan's latest commit and
+                # holds no connection while sleeping
+                db.session.remove()
+            if event:
+                yield event
+            if stream.open:
+                time.sleep(EVENTS_POLL_SECONDS)
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no'
     })
+
 @api.route('/users/<user_id>/top-vulnerabilities', methods=['GET'])
 def get_top_vulnerabilities(user_id):
     try:
-        analyses = AnalysisResult.query.filter(
+        query = AnalysisResult.query.filter(
             AnalysisResult.user_id == user_id,
             AnalysisResult.status == 'completed',
-            AnalysisResult.results.isnot(None)
-        ).order_by(AnalysisResult.timestamp.desc()).all()
+            AnalysisResult.has_results()
+        )
+
+        history = AnalysisResult.history_version(query)
+        etag = make_etag('top_vulnerabilities', user_id, *history)
+        unchanged = not_modified(etag, history[2], 'completed')
+        if unchanged:
+            return unchanged
+
+        analyses = query.order_by(AnalysisResult.timestamp.desc()).all()
 
         if not analyses:
             return jsonify({
@@ -200,14 +395,15 @@ def get_top_vulnerabilities(user_id):
         unique_vulns = {}
 
         for analysis in analyses:
-            findings = analysis.results.get('findings', [])
+            findings = analysis.document['findings']
             repo_name = analysis.repository_name
             
             for finding in findings:
-                vuln_id = finding.get('id')
-                if vuln_id not in unique_vulns:
-                    unique_vulns[vuln_id] = {
-                        'vulnerability_id': vuln_id,
+                vuln_key = (repo_name, finding['fingerprint'])
+                if vuln_key not in unique_vulns:
+                    unique_vulns[vuln_key] = {
+                        'vulnerability_id': finding.get('id'),
+                        'fingerprint': finding['fingerprint'],
                         'severity': finding.get('severity'),
                         'category': finding.get('category'),
                         'message': finding.get('message'),
@@ -221,10 +417,7 @@ def get_top_vulnerabilities(user_id):
                             'cwe': finding.get('cwe', []),
                             'owasp': finding.get('owasp', [])
                         },
-                        'fix_recommendations': {
-                            'description': finding.get('fix_recommendations', ''),
-                            'references': finding.get('references', [])
-                        },
+                        'fix_recommendations': finding.get('fix_recommendations'),
                         'repository': {
                             'name': repo_name.split('/')[-1],
                             'full_name': repo_name,
@@ -236,7 +429,7 @@ def get_top_vulnerabilities(user_id):
                     category_counts[finding.get('category')] += 1
                     repo_counts[repo_name] += 1
 
-        return jsonify({
+        return with_validators(jsonify({
             'success': True,
             'data': {
                 'metadata': {
@@ -251,7 +444,7 @@ def get_top_vulnerabilities(user_id):
                 },
                 'vulnerabilities': list(unique_vulns.values())
             }
-        })
+        }), etag, history[2])
 
     except Exception as e:
         logger.error(f"Error: {str(e)}")
@@ -0,0 +1,164 @@
+# async_db.py
+"""
+Async database access for the ASGI service (main.py).
+
+Queries share their SELECT statements with the Flask-SQLAlchemy models so
+both stacks see the same rows; only execution differs. Sessions run on
+asyncpg and must only be used from the ASGI server's event loop. Writes
+that go through model helpers (rule registration, fingerprints) stay on
+the synchronous session, run in a worker thread.
+"""
+import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
+
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import undefer
+
+from models import RULE_CACHE_MAX_ENTRIES, AnalysisResult, RuleMetadata, get_database_url
+from normalize import canonicalize
+from storage import decode_payload, payload_rule_ids, restore_payload
+
+logger = logging.getLogger(__name__)
+
+ASYNC_DB_POOL_SIZE = int(os.getenv('ASYNC_DB_POOL_SIZE', '10'))
+ASYNC_DB_MAX_OVERFLOW = int(os.getenv('ASYNC_DB_MAX_OVERFLOW', '10'))
+
+engine = None
+session_factory: Optional[async_sessionmaker] = None
+
+
+def async_database_url():
+    """DATABASE_URL for the asyncpg driver"""
+    url = make_url(get_database_url()).set(drivername='postgresql+asyncpg')
+    query = dict(url.query)
+    # asyncpg spells libpq's sslmode as ssl
+    if 'sslmode' in query:
+        query['ssl'] = query.pop('sslmode')
+    return url.set(query=query)
+
+
+def init_engine():
+    """Create the async engine and session factory once per process"""
+    global engine, session_factory
+    if engine is None:
+        engine = create_async_engine(
+            async_database_url(),
+            pool_size=ASYNC_DB_POOL_SIZE,
+            max_overflow=ASYNC_DB_MAX_OVERFLOW,
+            pool_pre_ping=True
+        )
+        session_factory = async_sessionmaker(engine, expire_on_commit=False)
+    return engine
+
+
+async def dispose_engine() -> None:
+    global engine, session_factory
+    if engine is not None:
+        await engine.dispose()
+        engine, session_factory = None, None
+
+
+@asynccontextmanager
+async def session_scope():
+    init_engine()
+    async with session_factory() as session:
+        yield session
+
+
+async def latest_for(session: AsyncSession, repository_name: str) -> Optional[AnalysisResult]:
+    """Most recent analysis of a repository, header only plus its error"""
+    return (await session.scalars(
+        AnalysisResult.latest_statement(repository_name).options(undefer(AnalysisResult.error))
+    )).first()
+
+
+async def analysis_header(session: AsyncSession, analysis_id: int) -> Optional[AnalysisResult]:
+    """Header of one analysis, including its error"""
+    return (await session.scalars(
+        select(AnalysisResult).options(
+            AnalysisResult.header_only(), undefer(AnalysisResult.error)
+        ).where(AnalysisResult.id == analysis_id)
+    )).first()
+
+
+async def _latest_at_heads(session: AsyncSession, heads: Dict[str, str], ruleset_digest: str,
+                           *criteria) -> Dict[str, AnalysisResult]:
+    if not heads:
+        return {}
+    rows = await session.scalars(AnalysisResult.at_heads_statement(heads, ruleset_digest, *criteria))
+    return AnalysisResult.latest_per_repository(rows)
+
+
+async def completed_at(session: AsyncSession, heads: Dict[str, str],
+                       ruleset_digest: str) -> Dict[str, AnalysisResult]:
+    """See ``AnalysisResult.completed_at``"""
+    return await _latest_at_heads(session, heads, ruleset_digest, *AnalysisResult.completed_criteria())
+
+
+async def in_flight_at(session: AsyncSession, heads: Dict[str, str],
+                       ruleset_digest: str) -> Dict[str, AnalysisResult]:
+    """See ``AnalysisResult.in_flight_at``"""
+    return await _latest_at_heads(session, heads, ruleset_digest, *AnalysisResult.in_flight_criteria())
+
+
+async def rule_catalog(session: AsyncSession, rule_ids) -> Dict[str, Dict]:
+    """``RuleMetadata.lookup`` on the async session, sharing its cache"""
+    missing = RuleMetadata.uncached(rule_ids)
+    if missing:
+        RuleMetadata.remember(await session.scalars(
+            select(RuleMetadata).where(RuleMetadata.rule_id.in_(missing))
+        ))
+    return RuleMetadata.cached(rule_ids)
+
+
+async def document_of(session: AsyncSession, analysis_id: int) -> Optional[Dict]:
+    """
+    Canonical results document of an analysis. Decompression and
+    canonicalization run in a worker thread so large documents do not
+    stall the event loop.
+    """
+    row = (await session.execute(
+        select(AnalysisResult.results_blob, AnalysisResult.results_json).where(
+            AnalysisResult.id == analysis_id
+        )
+    )).first()
+    if row is None:
+        return None
+
+    blob, results = row
+    if blob is not None:
+        payload = await asyncio.to_thread(decode_payload, blob)
+        rule_ids = payload_rule_ids(payload)
+        catalog = await rule_catalog(session, rule_ids) if rule_ids else {}
+        results = restore_payload(payload, catalog)
+    return await asyncio.to_thread(canonicalize, results)
+
+
+async def history_version(session: AsyncSession, *criteria):
+    """``AnalysisResult.history_version`` of the analyses matching ``criteria``"""
+    row = (await session.execute(
+        select(*AnalysisResult.history_columns()).where(*criteria)
+    )).one()
+    return AnalysisResult.history_from_row(row)
+
+
+async def analysis_headers(session: AsyncSession, *criteria, limit: Optional[int] = None):
+    """Headers of the analyses matching ``criteria``, newest first"""
+    statement = select(AnalysisResult).options(AnalysisResult.header_only()).where(
+        *criteria
+    ).order_by(AnalysisResult.timestamp.desc())
+    if limit is not None:
+        statement = statement.limit(limit)
+    return list(await session.scalars(statement))
+
+
+async def warm_rule_catalog(session: AsyncSession) -> int:
+    """Load rule metadata into the catalog cache up front; returns the rows loaded"""
+    rows = list(await session.scalars(select(RuleMetadata).limit(RULE_CACHE_MAX_ENTRIES)))
+    RuleMetadata.remember(rows)
+    return len(rows)
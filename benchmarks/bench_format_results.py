@@ -0,0 +1,159 @@
+# benchmarks/bench_format_results.py
+"""
+Microbenchmark: formatting a synthetic semgrep output.
+
+Compares the previous multi-pass ``format_semgrep_results`` with the
+single-pass ``normalize`` module, both for the full response and for the
+counts-only path used by the summary endpoint.
+
+Usage:
+    python benchmarks/bench_format_results.py [--findings 50000] [--repeat 5]
+"""
+import gc
+import sys
+import time
+import random
+import argparse
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from normalize import normalize_semgrep_results  # noqa: E402
+
+SEVERITIES = ('ERROR', 'WARNING', 'INFO', 'HIGH', 'MEDIUM', 'LOW')
+CATEGORIES = ('security', 'correctness', 'best-practice', 'performance')
+
+
+def synthetic_semgrep_output(count: int, seed: int = 7) -> dict:
+    rng = random.Random(seed)
+    results = []
+    for i in range(count):
+        rule = rng.randrange(300)
+        line = rng.randrange(1, 2000)
+        results.append({
+            'check_id': f'python.lang.security.rule-{rule}',
+            'path': f'/tmp/scanner_x/repo_20240101_000000/src/module_{i % 997}.py',
+            'start': {'line': line, 'col': 1, 'offset': line * 40},
+            'end': {'line': line + 2, 'col': 10, 'offset': line * 40 + 90},
+            'extra': {
+                'lines': f'    result = eval(user_input_{i % 50})',
+                'message': f'Detected use of eval() with untrusted input (rule {rule})',
+                'severity': SEVERITIES[rule % len(SEVERITIES)],
+                'metadata': {
+                    'category': CATEGORIES[rule % len(CATEGORIES)],
+                    'cwe': ["CWE-95: Improper Neutralization of Directives in Dynamically Evaluated Code"],
+                    'owasp': ['A03:2021 - Injection'],
+                    'references': [f'https://owasp.org/rule/{rule}'],
+                    'message': 'Avoid eval on user input'
+                }
+            }
+        })
+    return {
+        'version': '1.96.0',
+        'results': results,
+        'errors': [],
+        'paths': {'scanned': [f'src/module_{i}.py' for i in range(997)]}
+    }
+
+
+def legacy_format_semgrep_results(results):
+    """The pre-normalization implementation, kept for comparison"""
+    formatted_response = {
+        'summary': {
+            'total_files_scanned': len(results.get('paths', {}).get('scanned', [])),
+            'total_findings': len(results.get('results', [])),
+            'files_scanned': results.get('paths', {}).get('scanned', []),
+            'semgrep_version': results.get('version', 'unknown'),
+            'scan_status': 'success' if not results.get('errors') else 'completed_with_errors'
+        },
+        'findings': [],
+        'findings_by_severity': {
+            'HIGH': [], 'MEDIUM': [], 'LOW': [], 'WARNING': [], 'INFO': []
+        },
+        'findings_by_category': {},
+        'errors': results.get('errors', [])
+    }
+
+    for finding in results.get('results', []):
+        severity = finding.get('extra', {}).get('severity', 'INFO')
+        category = finding.get('extra', {}).get('metadata', {}).get('category', 'uncategorized')
+
+        formatted_finding = {
+            'id': finding.get('check_id', 'unknown'),
+            'file': finding.get('path', 'unknown'),
+            'line_start': finding.get('start', {}).get('line', 0),
+            'line_end': finding.get('end', {}).get('line', 0),
+            'code_snippet': finding.get('extra', {}).get('lines', ''),
+            'message': finding.get('extra', {}).get('message', ''),
+            'severity': severity,
+            'category': category,
+            'cwe': finding.get('extra', {}).get('metadata', {}).get('cwe', []),
+            'owasp': finding.get('extra', {}).get('metadata', {}).get('owasp', []),
+            'fix_recommendations': {
+                'description': finding.get('extra', {}).get('metadata', {}).get('message', ''),
+                'references': finding.get('extra', {}).get('metadata', {}).get('references', [])
+            }
+        }
+
+        formatted_response['findings'].append(formatted_finding)
+
+        if severity not in formatted_response['findings_by_severity']:
+            formatted_response['findings_by_severity'][severity] = []
+        formatted_response['findings_by_severity'][severity].append(formatted_finding)
+
+        if category not in formatted_response['findings_by_category']:
+            formatted_response['findings_by_category'][category] = []
+        formatted_response['findings_by_category'][category].append(formatted_finding)
+
+    formatted_response['severity_counts'] = {
+        severity: len(findings)
+        for severity, findings in formatted_response['findings_by_severity'].items()
+    }
+    formatted_response['category_counts'] = {
+        category: len(findings)
+        for category, findings in formatted_response['findings_by_category'].items()
+    }
+    return formatted_response
+
+
+def best_of(repeat: int, func, *args) -> float:
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--findings', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    output = synthetic_semgrep_output(args.findings)
+
+    legacy = legacy_format_semgrep_results(output)
+    current = normalize_semgrep_results(output).to_response()
+    assert legacy == current, "normalized response differs from legacy output"
+
+    cases = [
+        ('legacy full response', lambda: legacy_format_semgrep_results(output)),
+        ('normalize full response', lambda: normalize_semgrep_results(output).to_response()),
+        ('normalize counts only (summary)', lambda: normalize_semgrep_results(output).severity_counts),
+        ('normalize one filtered page', lambda: [
+            f.to_dict() for f in normalize_semgrep_results(output).filter('ERROR')[:10]
+        ]),
+    ]
+
+    print(f"{args.findings} findings, best of {args.repeat}")
+    baseline = None
+    for name, func in cases:
+        elapsed = best_of(args.repeat, func)
+        baseline = baseline or elapsed
+        print(f"  {name:<34} {elapsed * 1000:9.1f} ms  ({baseline / elapsed:4.2f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# benchmarks/bench_parse_offload.py
+"""
+Benchmark: event loop latency while a large semgrep output is parsed.
+
+A ticker coroutine asks to wake up every ``--tick-ms`` while the output
+is parsed inline on the loop (the previous behaviour), in a thread pool
+and in the process pool used by ``semgrep_output.parse_output_async``.
+The worst and 99th percentile oversleep is how long every other scan,
+progress update and HTTP call on the loop would have been stalled.
+
+Usage:
+    python benchmarks/bench_parse_offload.py [--findings 50000] [--repeat 3] [--tick-ms 5]
+"""
+import gc
+import sys
+import json
+import time
+import asyncio
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+import semgrep_output  # noqa: E402
+from bench_format_results import synthetic_semgrep_output  # noqa: E402
+
+
+def parse_with_json(output: bytes):
+    """Previous implementation: stdlib decode and summarize"""
+    results = json.loads(output.decode())
+    return semgrep_output.summarize_findings(results.get('results', []))
+
+
+async def measure(parse, tick_ms: float):
+    """Run ``parse()`` while a ticker records how late each wake-up was"""
+    lags = []
+    done = asyncio.Event()
+    interval = tick_ms / 1000
+
+    async def ticker():
+        while not done.is_set():
+            expected = time.perf_counter() + interval
+            await asyncio.sleep(interval)
+            lags.append(max(0.0, time.perf_counter() - expected))
+
+    tick_task = asyncio.create_task(ticker())
+    await asyncio.sleep(interval * 2)
+    start = time.perf_counter()
+    await parse()
+    elapsed = time.perf_counter() - start
+    done.set()
+    await tick_task
+
+    lags.sort()
+    p99 = lags[min(len(lags) - 1, int(len(lags) * 0.99))] if lags else 0.0
+    return elapsed, (lags[-1] if lags else 0.0), p99
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--findings', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--tick-ms', type=float, default=5)
+    args = parser.parse_args()
+
+    output = json.dumps(synthetic_semgrep_output(args.findings)).encode()
+    expected = semgrep_output.parse_output(output)
+    assert expected['findings'] == parse_with_json(output)['findings']
+    # Keeping it alive would make every full GC in the runs below slower
+    del expected
+
+    threads = ThreadPoolExecutor(max_workers=1)
+    processes = ProcessPoolExecutor(max_workers=1)
+    # Start the worker process outside the measurement
+    processes.submit(semgrep_output.parse_output, b'{}').result()
+
+    # The pool used by the scanner, with findings handed back in chunks
+    semgrep_output.PARSE_INLINE_MAX_BYTES = 0
+    semgrep_output.executor().submit(semgrep_output.parse_output, b'{}').result()
+
+    async def inline_json():
+        parse_with_json(output)
+
+    async def inline_fast():
+        semgrep_output.parse_output(output)
+
+    async def in_pool(pool):
+        await asyncio.get_running_loop().run_in_executor(pool, semgrep_output.parse_output, output)
+
+    cases = [
+        ('inline json (previous)', inline_json),
+        (f"inline {'orjson' if semgrep_output.orjson else 'json'}", inline_fast),
+        ('thread pool', lambda: in_pool(threads)),
+        ('process pool, one result', lambda: in_pool(processes)),
+        ('parse_output_async', lambda: semgrep_output.parse_output_async(output)),
+    ]
+
+    print(f"{args.findings} findings, {len(output) / 1024 / 1024:.1f} MB of JSON, "
+          f"{args.tick_ms:g} ms ticks, best of {args.repeat}")
+    print(f"  {'case':<26} {'parse ms':>9} {'max lag ms':>11} {'p99 lag ms':>11}")
+    for name, parse in cases:
+        runs = []
+        for _ in range(args.repeat):
+            gc.collect()
+            runs.append(asyncio.run(measure(parse, args.tick_ms)))
+        elapsed, worst, p99 = min(runs, key=lambda run: run[1])
+        print(f"  {name:<26} {elapsed * 1000:9.1f} {worst * 1000:11.1f} {p99 * 1000:11.1f}")
+
+    threads.shutdown()
+    processes.shutdown()
+    semgrep_output.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+# benchmarks/bench_semgrep_startup.py
+"""
+Benchmark: semgrep startup cost with registry rules against cached rules.
+
+Scans a target of a few small files, where startup dominates, once with
+the registry ruleset and the previous flags, then with the local copy
+from ``semgrep_rules.ruleset_cache`` and the flags the scanner now uses.
+Needs semgrep installed and network access for the registry.
+
+Usage:
+    python benchmarks/bench_semgrep_startup.py [--ruleset p/python] [--repeat 3] [--target DIR]
+"""
+import sys
+import time
+import tempfile
+import argparse
+import subprocess
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from semgrep_rules import RulesetCache  # noqa: E402
+
+SAMPLE = '''import subprocess
+
+def run(command):
+    return subprocess.call(command, shell=True)
+'''
+
+
+def timed_scan(config: str, target: Path, flags) -> float:
+    start = time.perf_counter()
+    subprocess.run(
+        ['semgrep', 'scan', '--config', config, '--json', *flags, str(target)],
+        check=True, capture_output=True
+    )
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--ruleset', default='p/python')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--target', type=Path, default=None,
+                        help='directory to scan; defaults to a few generated files')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='bench_semgrep_') as workdir:
+        target = args.target
+        if target is None:
+            target = Path(workdir) / 'target'
+            target.mkdir()
+            for i in range(5):
+                (target / f"sample_{i}.py").write_text(SAMPLE)
+
+        start = time.perf_counter()
+        rules = RulesetCache(cache_dir=str(Path(workdir) / 'rules')).resolve(args.ruleset)
+        download = time.perf_counter() - start
+        if rules == args.ruleset:
+            sys.exit(f"{args.ruleset} could not be cached; see the log")
+
+        cases = [
+            ('registry, previous flags', args.ruleset, ['--metrics=on']),
+            ('cached rules', rules, ['--metrics=off', '--disable-version-check']),
+        ]
+        print(f"{args.ruleset} on {target}, best of {args.repeat} "
+              f"(one-off download {download:.2f}s)")
+        for name, config, flags in cases:
+            best = min(timed_scan(config, target, flags) for _ in range(args.repeat))
+            print(f"  {name:<26} {best:6.2f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,238 @@
+# cache.py
+"""
+Read-through cache for per-repository result responses.
+
+Completed analyses never change, so a response computed from one can be
+reused until a newer analysis of the repository completes. Entries are keyed
+by (endpoint, repository, analysis id, filter params) and held in an
+in-process LRU, optionally backed by a shared store so workers can reuse
+each other's responses.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlencode
+
+logger = logging.getLogger(__name__)
+
+
+class LocalBackend:
+    """
+    In-memory stand-in for a shared cache backend. Entries expire after
+    their ``ttl`` like Redis keys; expired entries are purged every
+    ``purge_interval`` seconds and the oldest are evicted beyond
+    ``max_entries``.
+    """
+
+    def __init__(self, max_entries: int = 10000, purge_interval: float = 60.0):
+        # key -> (value, monotonic expiry or None)
+        self._data: 'OrderedDict[str, Tuple[str, Optional[float]]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.max_entries = max_entries
+        self.purge_interval = purge_interval
+        self._next_purge = time.monotonic() + purge_interval
+
+    def _live(self, key: str, now: float) -> Optional[Tuple[str, Optional[float]]]:
+        entry = self._data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= now:
+            del self._data[key]
+            return None
+        return entry
+
+    def _store(self, key: str, value: str, expires: Optional[float], now: float) -> None:
+        self._data[key] = (value, expires)
+        self._data.move_to_end(key)
+        if now >= self._next_purge:
+            for stale in [k for k, (_, e) in self._data.items() if e is not None and e <= now]:
+                del self._data[stale]
+            self._next_purge = now + self.purge_interval
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._live(key, time.monotonic())
+            return entry[0] if entry is not None else None
+
+    def set(self, key: str, value: str, ttl: Optional[int] = None) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._store(key, value, now + ttl if ttl else None, now)
+
+    def incr(self, key: str) -> int:
+        now = time.monotonic()
+        with self._lock:
+            # Like INCR, keeps the key's expiry
+            entry = self._live(key, now)
+            value = int(entry[0]) + 1 if entry is not None else 1
+            self._store(key, str(value), entry[1] if entry is not None else None, now)
+            return value
+
+
+class RedisBackend:
+    """Shared backend on top of a Redis server"""
+
+    def __init__(self, url: str):
+        import redis
+
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._client.get(key)
+        return value.decode('utf-8') if value is not None else None
+
+    def set(self, key: str, value: str, ttl: Optional[int] = None) -> None:
+        self._client.set(key, value, ex=ttl)
+
+    def incr(self, key: str) -> int:
+        return int(self._client.incr(key))
+
+
+class ResponseCache:
+    """Two-level (LRU + optional shared backend) response cache"""
+
+    def __init__(self, max_entries: int = 256, backend=None, ttl: Optional[int] = 86400,
+                 prefix: str = 'resp'):
+        self.max_entries = max_entries
+        self.backend = backend
+        self.ttl = ttl
+        self.prefix = prefix
+        self._entries: 'OrderedDict[str, Any]' = OrderedDict()
+        self._keys_by_repo: Dict[str, set] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(endpoint: str, repository: str, analysis_id: int,
+            params: Optional[Dict[str, Any]] = None) -> str:
+        query = urlencode(sorted((params or {}).items()))
+        return f"{endpoint}:{repository}:{analysis_id}:{query}"
+
+    def _backend_key(self, repository: str, key: str) -> Optional[str]:
+        try:
+            generation = self.backend.get(f"{self.prefix}:gen:{repository}") or '0'
+        except Exception as e:
+            logger.warning(f"Cache backend unavailable: {str(e)}")
+            return None
+        return f"{self.prefix}:{generation}:{key}"
+
+    def get(self, repository: str, key: str) -> Optional[Any]:
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        if self.backend is not None:
+            backend_key = self._backend_key(repository, key)
+            if backend_key:
+                try:
+                    raw = self.backend.get(backend_key)
+                except Exception as e:
+                    logger.warning(f"Cache backend get failed: {str(e)}")
+                    raw = None
+                if raw is not None:
+                    value = json.loads(raw)
+                    self._store_local(repository, key, value)
+                    with self._lock:
+                        self.hits += 1
+                    return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    async def get_async(self, repository: str, key: str) -> Optional[Any]:
+        """``get`` for event loops; a shared backend is read in a thread"""
+        with self._lock:
+            local = key in self._entries
+        if local or not is_shared(self.backend):
+            return self.get(repository, key)
+        return await asyncio.to_thread(self.get, repository, key)
+
+    def set(self, repository: str, key: str, value: Any) -> None:
+        self._store_local(repository, key, value)
+        if self.backend is not None:
+            self._set_backend(repository, key, value)
+
+    async def set_async(self, repository: str, key: str, value: Any) -> None:
+        """``set`` for event loops; a shared backend is written in a thread"""
+        if not is_shared(self.backend):
+            self.set(repository, key, value)
+            return
+        self._store_local(repository, key, value)
+        await asyncio.to_thread(self._set_backend, repository, key, value)
+
+    def _set_backend(self, repository: str, key: str, value: Any) -> None:
+        backend_key = self._backend_key(repository, key)
+        if backend_key:
+            try:
+                self.backend.set(backend_key, json.dumps(value, default=str), self.ttl)
+            except Exception as e:
+                logger.warning(f"Cache backend set failed: {str(e)}")
+
+    def _store_local(self, repository: str, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._keys_by_repo.setdefault(repository, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+                evicted_repo = evicted.split(':', 2)[1]
+                repo_keys = self._keys_by_repo.get(evicted_repo)
+                if repo_keys is not None:
+                    repo_keys.discard(evicted)
+                    if not repo_keys:
+                        del self._keys_by_repo[evicted_repo]
+
+    def invalidate_repository(self, repository: str) -> None:
+        """Drop every cached response for a repository"""
+        with self._lock:
+            for key in self._keys_by_repo.pop(repository, set()):
+                self._entries.pop(key, None)
+
+        if self.backend is not None:
+            try:
+                self.backend.incr(f"{self.prefix}:gen:{repository}")
+            except Exception as e:
+                logger.warning(f"Cache backend invalidation failed: {str(e)}")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_repo.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+def is_shared(backend) -> bool:
+    """Whether ``backend`` is visible to other processes"""
+    return backend is not None and not isinstance(backend, LocalBackend)
+
+
+def create_backend():
+    """Shared backend selected by RESPONSE_CACHE_BACKEND, or None"""
+    backend = os.getenv('RESPONSE_CACHE_BACKEND', '').lower()
+    if backend == 'redis':
+        try:
+            return RedisBackend(os.getenv('REDIS_URL', 'redis://localhost:6379/0'))
+        except ImportError:
+            logger.warning("RESPONSE_CACHE_BACKEND=redis but redis is not installed")
+            return None
+    if backend == 'local':
+        return LocalBackend()
+    return None
+
+
+response_cache = ResponseCache(
+    max_entries=int(os.getenv('RESPONSE_CACHE_SIZE', '256')),
+    backend=create_backend()
+)
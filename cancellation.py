@@ -0,0 +1,208 @@
+# cancellation.py
+"""
+Cancellation of running scans.
+
+Each scan running on the scheduler loop registers a ``CancelToken`` for
+its analysis id. Cancelling the token cancels the scan's asyncio task;
+every subprocess a scan starts goes through ``run_process``, which runs
+it in its own process group and kills the whole group (semgrep-core and
+git helpers included) when the awaiting task is cancelled or times out.
+Temporary directories and admission slots are released by the context
+managers the cancellation unwinds through.
+
+A cancel request for a scan running in another worker process is left
+in the cache backend and picked up by that worker's ``watch`` loop.
+"""
+import os
+import re
+import signal
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional, Tuple
+
+from cache import LocalBackend, create_backend, is_shared
+
+logger = logging.getLogger(__name__)
+
+CANCEL_POLL_SECONDS = float(os.getenv('SCAN_CANCEL_POLL_SECONDS', '2'))
+CANCEL_REQUEST_TTL = int(os.getenv('SCAN_CANCEL_REQUEST_TTL', '3600'))
+
+_LINE_BREAK = re.compile(rb'[\r\n]')
+
+
+class ScanCancelled(Exception):
+    """A scan was cancelled on request"""
+
+
+def kill_process_group(pid: int) -> None:
+    """SIGKILL a process group started with ``start_new_session=True``"""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+    except PermissionError as e:
+        logger.warning(f"Could not kill process group {pid}: {str(e)}")
+
+
+async def _read_lines(stream: asyncio.StreamReader, on_line: Callable[[str], None]) -> bytes:
+    """Read a stream to the end, passing each \\r or \\n terminated line to ``on_line``"""
+    chunks, pending = [], b''
+    while True:
+        chunk = await stream.read(8192)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        *lines, pending = _LINE_BREAK.split(pending + chunk)
+        for line in lines:
+            if line:
+                on_line(line.decode('utf-8', errors='replace'))
+    if pending:
+        on_line(pending.decode('utf-8', errors='replace'))
+    return b''.join(chunks)
+
+
+async def run_process(*cmd: str, timeout: Optional[float] = None,
+                      on_stderr_line: Optional[Callable[[str], None]] = None,
+                      **kwargs) -> Tuple[int, bytes, bytes]:
+    """
+    Run a command in a new process group and return (returncode, stdout,
+    stderr). On timeout or cancellation the whole group is killed before
+    the exception propagates; any children left behind by a process that
+    exited normally are killed as well.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True,
+        **kwargs
+    )
+    if on_stderr_line is None:
+        communicate = process.communicate()
+    else:
+        async def communicate():
+            stdout, stderr, _ = await asyncio.gather(
+                process.stdout.read(),
+                _read_lines(process.stderr, on_stderr_line),
+                process.wait()
+            )
+            return stdout, stderr
+        communicate = communicate()
+
+    try:
+        stdout, stderr = await asyncio.wait_for(communicate, timeout=timeout)
+    except BaseException:
+        kill_process_group(process.pid)
+        try:
+            await asyncio.shield(process.wait())
+        except BaseException:
+            pass
+        raise
+    kill_process_group(process.pid)
+    return process.returncode, stdout, stderr
+
+
+class CancelToken:
+    """Cancellation handle of one scan task"""
+
+    def __init__(self, task: asyncio.Task, loop: asyncio.AbstractEventLoop):
+        self._task = task
+        self._loop = loop
+        self.reason: Optional[str] = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def cancel(self, reason: str = 'Cancelled by request') -> bool:
+        """Cancel the scan task; safe to call from any thread"""
+        if self.reason is not None:
+            return False
+        self.reason = reason
+        self._loop.call_soon_threadsafe(self._task.cancel)
+        return True
+
+    def consume(self) -> None:
+        """Mark the task's cancellation as handled once it has been caught"""
+        if hasattr(self._task, 'uncancel'):
+            self._task.uncancel()
+
+
+class ScanCancellations:
+    """Cancel tokens of the scans running in this process, by analysis id"""
+
+    def __init__(self, backend=None, ttl: int = CANCEL_REQUEST_TTL,
+                 poll_interval: float = CANCEL_POLL_SECONDS, prefix: str = 'scan-cancel'):
+        self.backend = backend or LocalBackend()
+        # Without a shared backend, requests only reach scans in this process
+        self.shared = is_shared(self.backend)
+        self.ttl = ttl
+        self.poll_interval = poll_interval
+        self.prefix = prefix
+        self._tokens: Dict[int, CancelToken] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, analysis_id: int) -> str:
+        return f"{self.prefix}:{analysis_id}"
+
+    def _requested(self, analysis_id: int) -> Optional[str]:
+        try:
+            reason = self.backend.get(self._key(analysis_id))
+        except Exception as e:
+            logger.warning(f"Cancel request lookup failed: {str(e)}")
+            return None
+        if isinstance(reason, bytes):
+            reason = reason.decode('utf-8')
+        return reason
+
+    @contextmanager
+    def active(self, analysis_id: int):
+        """Register the current task as the scan of ``analysis_id``; yields its token"""
+        token = CancelToken(asyncio.current_task(), asyncio.get_running_loop())
+        with self._lock:
+            self._tokens[analysis_id] = token
+        try:
+            reason = self._requested(analysis_id)
+            if reason:
+                token.cancel(reason)
+            yield token
+        finally:
+            with self._lock:
+                if self._tokens.get(analysis_id) is token:
+                    del self._tokens[analysis_id]
+
+    def cancel(self, analysis_id: int, reason: str = 'Cancelled by request') -> bool:
+        """
+        Cancel a scan. Returns True if it was running in this process;
+        otherwise a request is left for the worker running it.
+        """
+        with self._lock:
+            token = self._tokens.get(analysis_id)
+        if token is not None:
+            token.cancel(reason)
+            return True
+        try:
+            self.backend.set(self._key(analysis_id), reason, self.ttl)
+        except Exception as e:
+            logger.warning(f"Failed to store cancel request for {analysis_id}: {str(e)}")
+        return False
+
+    async def watch(self) -> None:
+        """Apply cancel requests left by other workers; runs on the scheduler loop"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            with self._lock:
+                running = dict(self._tokens)
+            for analysis_id, token in running.items():
+                if token.cancelled:
+                    continue
+                reason = await loop.run_in_executor(None, self._requested, analysis_id)
+                if reason:
+                    logger.info(f"Cancelling analysis {analysis_id}: {reason}")
+                    token.cancel(reason)
+
+
+scan_cancellations = ScanCancellations(create_backend())
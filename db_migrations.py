@@ -0,0 +1,460 @@
+# db_migrations.py
+"""
+Helpers for running Alembic schema and data migrations.
+
+Revisions must not import app modules (storage, normalize, models): those
+keep changing after a revision ships, and replaying an old revision would
+then write documents it never wrote. The stored formats revisions read
+and write are frozen here instead, one copy per version (``_v1``,
+``_v2``, ...), and tables are described with ``sa.table``. Never change a
+frozen version; add a new one for the revision that needs it.
+"""
+import os
+import re
+import gzip
+import json
+import hashlib
+import logging
+import posixpath
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = Path(__file__).resolve().parent
+ALEMBIC_INI = BASE_DIR / 'alembic.ini'
+
+DEFAULT_BATCH_SIZE = int(os.getenv('MIGRATION_BATCH_SIZE', '200'))
+
+# Lightweight tables for writing from migrations, independent of the
+# current model definitions
+rule_metadata_table = sa.table(
+    'rule_metadata',
+    sa.column('rule_id'),
+    sa.column('message'),
+    sa.column('cwe', postgresql.JSON()),
+    sa.column('owasp', postgresql.JSON()),
+    sa.column('references', postgresql.JSON()),
+    sa.column('fix_recommendations', postgresql.JSON()),
+)
+
+finding_fingerprints_table = sa.table(
+    'finding_fingerprints',
+    sa.column('analysis_id'),
+    sa.column('fingerprint'),
+    sa.column('rule_id'),
+    sa.column('file'),
+    sa.column('line_start'),
+    sa.column('line_end'),
+    sa.column('severity'),
+    sa.column('category'),
+)
+
+# Stored results payload, version 1 (revision 0003)
+RULE_FIELDS_V1 = ('message', 'cwe', 'owasp', 'references', 'fix_recommendations')
+STRIPPED_KEY_V1 = '_r'
+CODEC_ZSTD = b'Z'
+CODEC_GZIP = b'G'
+
+
+def _alembic_config():
+    from alembic.config import Config
+
+    config = Config(str(ALEMBIC_INI))
+    config.set_main_option('script_location', str(BASE_DIR / 'migrations'))
+    return config
+
+
+def run_migrations(revision: str = 'head') -> None:
+    """Upgrade the database schema to the given revision"""
+    from alembic import command
+
+    logger.info(f"Running database migrations to {revision}")
+    command.upgrade(_alembic_config(), revision)
+    logger.info("Database migrations completed")
+
+
+def current_revision() -> Optional[str]:
+    """Return the revision currently stamped in the database"""
+    from alembic.runtime.migration import MigrationContext
+    from sqlalchemy import create_engine
+    from models import get_database_url
+
+    engine = create_engine(get_database_url())
+    try:
+        with engine.connect() as connection:
+            return MigrationContext.configure(connection).get_current_revision()
+    finally:
+        engine.dispose()
+
+
+def batched_data_migration(
+    select_sql: str,
+    apply_batch: Callable[[object, Sequence], None],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    label: str = 'data migration'
+) -> int:
+    """
+    Run a resumable data migration from inside an Alembic revision.
+
+    ``select_sql`` must return rows ordered by ``id`` that still need migrating
+    and accept ``:last_id`` and ``:limit`` parameters. Each batch is handed to
+    ``apply_batch(connection, rows)`` on an autocommit connection, so work
+    is persisted as it goes and an interrupted run simply picks up the
+    remaining rows when the revision is retried.
+
+    Returns the number of rows processed.
+    """
+    from alembic import op
+
+    context = op.get_context()
+    if context.as_sql:
+        logger.info(f"Skipping {label} in offline mode")
+        return 0
+
+    processed = 0
+    last_id = 0
+    with context.autocommit_block():
+        connection = op.get_bind()
+        while True:
+            rows = connection.execute(
+                text(select_sql),
+                {'last_id': last_id, 'limit': batch_size}
+            ).fetchall()
+            if not rows:
+                break
+
+            apply_batch(connection, rows)
+
+            processed += len(rows)
+            last_id = rows[-1].id
+            logger.info(f"{label}: {processed} rows migrated (last id {last_id})")
+
+    return processed
+
+
+def load_rule_catalog(connection) -> Dict[str, Dict]:
+    """Read the whole rule metadata catalog"""
+    rows = connection.execute(text(
+        "SELECT rule_id, message, cwe, owasp, \"references\", fix_recommendations "
+        "FROM rule_metadata"
+    ))
+    return {
+        row.rule_id: {
+            name: getattr(row, name) for name in RULE_FIELDS_V1
+            if getattr(row, name) is not None
+        }
+        for row in rows
+    }
+
+
+def insert_rules(connection, rules: Dict[str, Dict]) -> None:
+    """Add catalog entries, leaving rules that already exist untouched"""
+    if not rules:
+        return
+    connection.execute(
+        postgresql.insert(rule_metadata_table).values([
+            {'rule_id': rule_id, **entry} for rule_id, entry in rules.items()
+        ]).on_conflict_do_nothing(index_elements=['rule_id'])
+    )
+
+
+def stored_results(row, catalog: Dict[str, Dict]):
+    """Decoded results of an ``analysis_results`` row selected with both columns"""
+    if row.results_blob is not None:
+        return restore_payload_v1(decode_payload_v1(row.results_blob), catalog)
+    if isinstance(row.results, str):
+        return json.loads(row.results)
+    return row.results
+
+
+def _findings_v1(results) -> list:
+    if isinstance(results, dict) and isinstance(results.get('findings'), list):
+        return results['findings']
+    return []
+
+
+def pack_results_v1(results, catalog: Dict[str, Dict]) -> Tuple[bytes, Dict[str, Dict]]:
+    """Payload version 1 of ``results``, plus the rules missing from ``catalog``"""
+    new_rules = {}
+    packed = results
+
+    findings = _findings_v1(results)
+    if findings:
+        packed_findings = []
+        for finding in findings:
+            rule_id = finding.get('id') if isinstance(finding, dict) else None
+            if not rule_id:
+                packed_findings.append(finding)
+                continue
+
+            rule = catalog.get(rule_id)
+            if rule is None:
+                rule = new_rules.get(rule_id)
+            if rule is None:
+                rule = {
+                    name: finding[name] for name in RULE_FIELDS_V1
+                    if finding.get(name) is not None
+                }
+                new_rules[rule_id] = rule
+
+            mask = 0
+            compact = {}
+            for key, value in finding.items():
+                if key in rule and rule[key] == value:
+                    mask |= 1 << RULE_FIELDS_V1.index(key)
+                else:
+                    compact[key] = value
+            if mask:
+                compact[STRIPPED_KEY_V1] = mask
+            packed_findings.append(compact)
+
+        packed = {**results, 'findings': packed_findings}
+
+    raw = json.dumps({'v': 1, 'results': packed}, separators=(',', ':'), default=str).encode('utf-8')
+    if zstandard is not None:
+        return CODEC_ZSTD + zstandard.ZstdCompressor(level=3).compress(raw), new_rules
+    return CODEC_GZIP + gzip.compress(raw, compresslevel=6), new_rules
+
+
+def decode_payload_v1(blob: bytes) -> Dict:
+    """Decompress a version 1 payload without restoring rule metadata"""
+    blob = bytes(blob)
+    codec, body = blob[:1], blob[1:]
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to decode these results")
+        raw = zstandard.ZstdDecompressor().decompress(body)
+    elif codec == CODEC_GZIP:
+        raw = gzip.decompress(body)
+    else:
+        raise ValueError(f"Unknown results codec: {codec!r}")
+    payload = json.loads(raw)
+    if not isinstance(payload, dict) or payload.get('v') != 1:
+        raise ValueError("Unsupported results payload")
+    return payload
+
+
+def restore_payload_v1(payload: Dict, catalog: Dict[str, Dict]):
+    """Re-attach stripped rule metadata to a decoded version 1 payload"""
+    results = payload['results']
+    findings = _findings_v1(results)
+    if not findings:
+        return results
+
+    restored = []
+    for finding in findings:
+        mask = finding.pop(STRIPPED_KEY_V1, 0) if isinstance(finding, dict) else 0
+        if mask:
+            rule = catalog.get(finding.get('id'), {})
+            for index, name in enumerate(RULE_FIELDS_V1):
+                if mask & (1 << index) and name in rule:
+                    finding[name] = rule[name]
+        restored.append(finding)
+    results['findings'] = restored
+    return results
+
+
+# Canonical results documents: version 2 (revision 0005) and version 3,
+# which adds finding fingerprints (revision 0006)
+_CLONE_DIR = re.compile(r'^repo_\d{8}_\d{6}$')
+_WHITESPACE = re.compile(r'\s+')
+_SEVERITIES = ('HIGH', 'MEDIUM', 'LOW', 'WARNING', 'INFO')
+
+
+def _relative_path(path: str) -> str:
+    if not path:
+        return path
+    parts = path.replace('\\', '/').split('/')
+    for index, part in enumerate(parts):
+        if _CLONE_DIR.match(part) and index + 1 < len(parts):
+            return '/'.join(parts[index + 1:])
+    return path[2:] if path.startswith('./') else path
+
+
+def _semgrep_finding(raw: Dict) -> Dict:
+    extra = raw.get('extra') or {}
+    metadata = extra.get('metadata') or {}
+    path = raw.get('path', 'unknown')
+    return {
+        'id': raw.get('check_id', 'unknown'),
+        'file': _relative_path(path),
+        'file_name': _relative_path(path),
+        'line_start': (raw.get('start') or {}).get('line', 0),
+        'line_end': (raw.get('end') or {}).get('line', 0),
+        'code_snippet': extra.get('lines', ''),
+        'message': extra.get('message', ''),
+        'severity': extra.get('severity', 'INFO'),
+        'category': metadata.get('category', 'uncategorized'),
+        'cwe': metadata.get('cwe', []),
+        'owasp': metadata.get('owasp', []),
+        'fix_recommendations': {
+            'description': metadata.get('message', ''),
+            'references': metadata.get('references', [])
+        }
+    }
+
+
+def _processed_finding(processed: Dict) -> Dict:
+    fix = processed.get('fix_recommendations')
+    if isinstance(fix, dict):
+        fix_description = fix.get('description', '')
+        references = fix.get('references', [])
+    else:
+        fix_description = fix or ''
+        references = processed.get('references', [])
+    path = processed.get('file') or 'unknown'
+    return {
+        'id': processed.get('id') or 'unknown',
+        'file': _relative_path(path),
+        'file_name': _relative_path(path),
+        'line_start': processed.get('line_start') or 0,
+        'line_end': processed.get('line_end') or 0,
+        'code_snippet': processed.get('code_snippet', ''),
+        'message': processed.get('message', ''),
+        'severity': (processed.get('severity') or 'INFO').upper(),
+        'category': processed.get('category') or 'security',
+        'cwe': processed.get('cwe', []),
+        'owasp': processed.get('owasp', []),
+        'fix_recommendations': {'description': fix_description, 'references': references}
+    }
+
+
+def _canonical_document(version: int, findings: List[Dict], errors: List, total_findings: int,
+                        files_scanned: int, semgrep_version: str, scan_status: str,
+                        metadata: Optional[Dict] = None) -> Dict:
+    severity_counts = dict.fromkeys(_SEVERITIES, 0)
+    category_counts = {}
+    for finding in findings:
+        severity_counts[finding['severity']] = severity_counts.get(finding['severity'], 0) + 1
+        category_counts[finding['category']] = category_counts.get(finding['category'], 0) + 1
+    return {
+        'schema_version': version,
+        'summary': {
+            'total_findings': total_findings,
+            'files_scanned': files_scanned,
+            'severity_counts': severity_counts,
+            'category_counts': category_counts,
+            'semgrep_version': semgrep_version,
+            'scan_status': scan_status
+        },
+        'findings': findings,
+        'errors': errors,
+        'metadata': metadata or {}
+    }
+
+
+def _canonicalize(results, version: int, metadata_keys: Sequence[str]) -> Optional[Dict]:
+    if results is None or (isinstance(results, dict) and results.get('schema_version') == version):
+        return results
+    if isinstance(results, str):
+        results = json.loads(results)
+    if not isinstance(results, dict):
+        raise ValueError(f"Invalid results format: expected dict, got {type(results)}")
+
+    if 'results' in results:
+        raw_findings = results.get('results', [])
+        errors = list(results.get('errors', []))
+        findings = []
+        for raw in raw_findings:
+            try:
+                findings.append(_semgrep_finding(raw))
+            except Exception as e:
+                errors.append(f"Error processing finding: {str(e)}")
+        return _canonical_document(
+            version, findings, errors, len(raw_findings),
+            len(results.get('paths', {}).get('scanned', [])),
+            results.get('version', 'unknown'),
+            'success' if not results.get('errors') else 'completed_with_errors'
+        )
+
+    metadata = dict(results.get('metadata') or {})
+    for key in metadata_keys:
+        if key in results:
+            metadata[key] = results[key]
+    errors = list(results.get('errors', []))
+    findings = []
+    for item in results.get('findings') or []:
+        try:
+            findings.append(_processed_finding(item))
+        except Exception as e:
+            errors.append(f"Error processing finding: {str(e)}")
+    summary = results.get('summary') or {}
+    files_scanned = summary.get('files_scanned', 0)
+    if isinstance(files_scanned, list):
+        files_scanned = len(files_scanned)
+    document = _canonical_document(
+        version, findings, errors, len(findings), files_scanned,
+        summary.get('semgrep_version', 'unknown'),
+        'success' if not errors else 'completed_with_errors',
+        metadata
+    )
+    if results.get('compacted'):
+        document['summary'].update({
+            key: value for key, value in summary.items() if key in document['summary']
+        })
+        document['compacted'] = True
+    return document
+
+
+def canonicalize_v2(results) -> Optional[Dict]:
+    """Canonical document version 2 of any stored results shape"""
+    return _canonicalize(results, 2, ('repository', 'user_id', 'timestamp', 'repository_info'))
+
+
+def _normalize_path_v3(path: str) -> str:
+    path = _relative_path(path or '').replace('\\', '/')
+    return posixpath.normpath(path).lstrip('/') if path else ''
+
+
+def _snippet_hash_v3(snippet: str) -> str:
+    return hashlib.sha1(_WHITESPACE.sub(' ', snippet or '').strip().encode('utf-8')).hexdigest()
+
+
+def canonicalize_v3(results) -> Optional[Dict]:
+    """Canonical document version 3 of any stored results shape: version 2 plus fingerprints"""
+    if isinstance(results, dict) and results.get('schema_version') == 3:
+        return results
+    document = _canonicalize(
+        results, 3,
+        ('repository', 'user_id', 'timestamp', 'commit_sha', 'ruleset_digest', 'repository_info')
+    )
+    if document is None:
+        return None
+    occurrences = {}
+    for finding in sorted(document['findings'], key=lambda f: (f['line_start'] or 0, f['line_end'] or 0)):
+        path = _normalize_path_v3(finding['file'])
+        snippet = _snippet_hash_v3(finding['code_snippet'])
+        ordinal = occurrences.get((finding['id'], path, snippet), 0)
+        occurrences[(finding['id'], path, snippet)] = ordinal + 1
+        key = '\0'.join((finding['id'] or '', path, snippet))
+        if ordinal:
+            key += f'\0{ordinal}'
+        finding['fingerprint'] = hashlib.sha256(key.encode('utf-8')).hexdigest()[:40]
+    return document
+
+
+def fingerprint_rows_v3(analysis_id: int, findings: Iterable[Dict]) -> List[Dict]:
+    """``finding_fingerprints`` rows for the findings of a version 3 document"""
+    return [
+        {
+            'analysis_id': analysis_id,
+            'fingerprint': finding['fingerprint'],
+            'rule_id': finding['id'],
+            'file': finding['file'],
+            'line_start': finding['line_start'],
+            'line_end': finding['line_end'],
+            'severity': finding['severity'],
+            'category': finding['category']
+        }
+        for finding in findings
+    ]
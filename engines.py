@@ -0,0 +1,243 @@
+# engines.py
+"""
+Scan engines: what runs rules against a checked-out repository.
+
+An engine prepares its rules once, scans a directory and streams its
+findings in batches, already in the processed shape of
+``semgrep_output.summarize_findings``. ``SecurityScanner`` runs the
+engines named in ``ScanConfig.engines`` (``SCAN_ENGINES``, comma
+separated) and merges their findings. Every engine times its preparation
+and scan and counts the files it looked at; the numbers are kept in the
+scan stats under ``engines``, so rules can be moved to whichever engine
+runs them cheapest. While scanning, an engine reports ``files_done`` of
+``files_total`` through its ``progress`` callback.
+
+``semgrep`` runs the configured ruleset in a semgrep process. ``regex``
+runs the built-in credential patterns of secrets_scan.py, without
+starting semgrep at all.
+"""
+import os
+import time
+import asyncio
+import fnmatch
+import logging
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from cancellation import run_process
+from secrets_scan import scan_tree_async
+from semgrep_output import parse_output_async
+from semgrep_rules import ruleset_cache
+from tarball_fetch import expand_patterns
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENGINES = ('semgrep',)
+
+# Above this many files semgrep runs on batches of explicit targets, so
+# the scan reports progress between runs instead of only at the end
+SEMGREP_TARGET_BATCH_FILES = int(os.getenv('SEMGREP_TARGET_BATCH_FILES', '1000'))
+
+
+@dataclass
+class EngineTiming:
+    """Cost of one engine in one scan"""
+    prepare_seconds: float = 0.0
+    scan_seconds: float = 0.0
+    files_scanned: int = 0
+    findings: int = 0
+
+    def to_dict(self) -> Dict:
+        return {
+            key: round(value, 3) if isinstance(value, float) else value
+            for key, value in asdict(self).items()
+        }
+
+
+class ScanEngine:
+    """Base class: subclasses implement ``prepare`` and ``scan``"""
+    name = ''
+    # Part of the ruleset digest; bump when the engine's rules change
+    version = '1'
+
+    def __init__(self, config, progress: Optional[Callable[..., None]] = None):
+        self.config = config
+        self.progress = progress or (lambda **counters: None)
+        self.timing = EngineTiming()
+        self._prepared = False
+        self._excluded = expand_patterns(config.exclude_patterns)
+
+    async def prepare(self) -> None:
+        """Load the rules; runs once, before the first scan"""
+
+    def _candidates(self, target: Path) -> List[Tuple[str, int]]:
+        """(path relative to ``target``, size) of the files to scan"""
+        max_bytes = self.config.max_file_size_mb * 1024 * 1024
+        candidates = []
+        for root, dirnames, files in os.walk(target):
+            dirnames[:] = [
+                name for name in dirnames
+                if not any(fnmatch.fnmatch(name, pattern) for pattern in self._excluded)
+            ]
+            for name in files:
+                if any(fnmatch.fnmatch(name, pattern) for pattern in self._excluded):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    if os.path.islink(path) or not os.path.isfile(path):
+                        continue
+                    size = os.path.getsize(path)
+                except OSError:
+                    continue
+                if size <= max_bytes:
+                    candidates.append((os.path.relpath(path, target), size))
+        return candidates
+
+    def scan(self, target: Path) -> AsyncIterator[List[Dict]]:
+        """Batches of processed findings for the files under ``target``"""
+        raise NotImplementedError
+
+    async def findings(self, target: Path) -> AsyncIterator[List[Dict]]:
+        """``scan``, preparing first if needed, with both steps timed"""
+        if not self._prepared:
+            start = time.perf_counter()
+            await self.prepare()
+            self.timing.prepare_seconds += time.perf_counter() - start
+            self._prepared = True
+
+        start = time.perf_counter()
+        try:
+            async for batch in self.scan(target):
+                self.timing.findings += len(batch)
+                yield batch
+        finally:
+            self.timing.scan_seconds += time.perf_counter() - start
+
+
+class SemgrepEngine(ScanEngine):
+    """The configured semgrep ruleset, run in a semgrep process"""
+    name = 'semgrep'
+
+    async def prepare(self) -> None:
+        # A local copy of registry rules saves the download on every run
+        self.rules = await ruleset_cache.resolve_async(self.config.ruleset)
+
+    def command(self, targets: List[str]) -> List[str]:
+        return [
+            "semgrep",
+            "scan",
+            "--config", self.rules,
+            "--json",
+            "--verbose",
+            # Only rules fetched from the registry need metrics on
+            f"--metrics={'on' if self.rules == self.config.ruleset else 'off'}",
+            "--disable-version-check",
+
+            # Resource limits
+            f"--max-memory={self.config.max_memory_mb}",
+            f"--jobs={self.config.concurrent_processes}",
+            f"--timeout={self.config.file_timeout_seconds}",
+            f"--timeout-threshold={self.config.max_retries}",
+
+            # Optimization flags
+            "--no-git-ignore",
+            "--skip-unknown-extensions",
+            "--optimizations=all",
+
+            *targets
+        ]
+
+    async def _run(self, target: Path, targets: List[str], deadline: float) -> Optional[Dict]:
+        """One semgrep process over ``targets``, run in ``target``"""
+        timeout = deadline - asyncio.get_running_loop().time()
+        try:
+            if timeout <= 0:
+                raise asyncio.TimeoutError
+            _, stdout, stderr = await run_process(
+                *self.command(targets),
+                timeout=timeout,
+                cwd=str(target)
+            )
+        except asyncio.TimeoutError:
+            logger.error(f"Scan timed out after {self.config.timeout_seconds}s")
+            raise RuntimeError("Scan timed out")
+
+        stderr_output = stderr.decode() if stderr else ""
+        if stderr_output and not stderr_output.lower().startswith('running'):
+            logger.warning(f"Semgrep stderr: {stderr_output}")
+
+        if not stdout or not stdout.strip():
+            return None
+
+        try:
+            # Decoding large outputs would stall the loop for seconds
+            return await parse_output_async(stdout)
+        except ValueError as e:
+            logger.error(f"Failed to parse Semgrep JSON output: {str(e)}")
+            raise RuntimeError("Invalid Semgrep output format") from e
+
+    async def scan(self, target: Path) -> AsyncIterator[List[Dict]]:
+        files = [str(target / relative) for relative, _ in await asyncio.to_thread(self._candidates, target)]
+        self.progress(files_done=0, files_total=len(files))
+        if len(files) > SEMGREP_TARGET_BATCH_FILES:
+            # Explicit targets skip .semgrepignore; _candidates already
+            # dropped the excluded files
+            runs = [
+                files[start:start + SEMGREP_TARGET_BATCH_FILES]
+                for start in range(0, len(files), SEMGREP_TARGET_BATCH_FILES)
+            ]
+        else:
+            runs = [[str(target)]]
+
+        deadline = asyncio.get_running_loop().time() + self.config.timeout_seconds
+        semgrepignore_path = target / '.semgrepignore'
+        try:
+            with open(semgrepignore_path, 'w') as f:
+                for pattern in self.config.exclude_patterns:
+                    f.write(f"{pattern}\n")
+
+            done = 0
+            for targets in runs:
+                parsed = await self._run(target, targets, deadline)
+                done += len(targets) if len(runs) > 1 else len(files)
+                self.progress(files_done=done, files_total=len(files))
+                if parsed is None:
+                    continue
+                self.timing.files_scanned += parsed['total_files']
+                if parsed['findings']:
+                    yield parsed['findings']
+        finally:
+            if semgrepignore_path.exists():
+                semgrepignore_path.unlink()
+
+
+class RegexEngine(ScanEngine):
+    """Built-in credential patterns, matched by secrets_scan outside the loop"""
+    name = 'regex'
+    version = '2'
+
+    async def scan(self, target: Path) -> AsyncIterator[List[Dict]]:
+        files = await asyncio.to_thread(self._candidates, target)
+        self.timing.files_scanned = len(files)
+        self.progress(files_done=0, files_total=len(files))
+        done = 0
+
+        def scanned(count: int) -> None:
+            nonlocal done
+            done += count
+            self.progress(files_done=done, files_total=len(files))
+
+        async for batch in scan_tree_async(str(target), files, on_files=scanned):
+            if batch:
+                yield batch
+
+
+ENGINES = {engine.name: engine for engine in (SemgrepEngine, RegexEngine)}
+
+
+def create_engine(name: str, config, progress: Optional[Callable[..., None]] = None) -> ScanEngine:
+    try:
+        return ENGINES[name](config, progress)
+    except KeyError:
+        raise ValueError(f"Unknown scan engine: {name}") from None
@@ -12,8 +12,9 @@ worker_class = 'sync'
 threads = 4
 worker_connections = 1000
 
-# Timeout configuration
-timeout = 120  # Increased timeout for long-running scans
+# Timeout configuration. Long scans belong in worker.py
+# (SCAN_EXECUTION=worker); web workers only wait for their outcome
+timeout = 120
 keepalive = 5
 
 # Logging
@@ -25,7 +26,8 @@ access_log_format = '%({x-forwarded-for}i)s %(l)s %(u)s %(t)s "%(r)s" %(s)s %(b)
 # Process naming
 proc_name = 'semgrep-analysis'
 
-# Limits for stability
+# Limits for stability. Recycling a web worker would abort any scan it runs
+# inline, so keep SCAN_EXECUTION=worker when these are enabled
 max_requests = 1000
 max_requests_jitter = 50
 
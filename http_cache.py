@@ -0,0 +1,71 @@
+# http_cache.py
+"""HTTP validators (ETag / Last-Modified) for analysis read endpoints"""
+import hashlib
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from flask import Response, request
+from werkzeug.http import http_date, parse_date, parse_etags, quote_etag
+
+# Analyses in these states no longer change, so their timestamp can be
+# trusted for If-Modified-Since
+FINAL_STATUSES = ('completed', 'failed', 'cancelled')
+
+
+def make_etag(endpoint: str, *parts: Any, params: Optional[Dict[str, Any]] = None) -> str:
+    """Strong ETag from an endpoint name, identifying parts and filter params"""
+    key = '|'.join([endpoint, *(str(part) for part in parts)])
+    if params:
+        key += '|' + '&'.join(f"{name}={params[name]}" for name in sorted(params))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def _http_date(value: Optional[datetime]) -> Optional[datetime]:
+    """Stored timestamps are naive UTC; HTTP dates have second resolution"""
+    if value is None:
+        return None
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.replace(microsecond=0)
+
+
+def not_modified(etag: str, last_modified: Optional[datetime] = None,
+                 status: Optional[str] = None) -> Optional[Response]:
+    """
+    Return a 304 response if the client's validators still match, before the
+    caller loads or formats any results. ``If-None-Match`` takes precedence
+    over ``If-Modified-Since`` as required by RFC 9110.
+    """
+    if not validators_match(request.headers, etag, last_modified, status):
+        return None
+    return with_validators(Response(status=304), etag, last_modified)
+
+
+def validators_match(headers, etag: str, last_modified: Optional[datetime] = None,
+                     status: Optional[str] = None) -> bool:
+    """``not_modified`` for any mapping of request headers"""
+    if_none_match = parse_etags(headers.get('If-None-Match'))
+    if if_none_match:
+        return if_none_match.contains(etag)
+    if_modified_since = parse_date(headers.get('If-Modified-Since'))
+    if if_modified_since and last_modified and status in FINAL_STATUSES:
+        return _http_date(last_modified) <= if_modified_since
+    return False
+
+
+def validator_headers(etag: str, last_modified: Optional[datetime] = None) -> Dict[str, str]:
+    """``with_validators`` as a dict of response headers"""
+    headers = {'ETag': quote_etag(etag), 'Cache-Control': 'private, no-cache'}
+    if last_modified is not None:
+        headers['Last-Modified'] = http_date(_http_date(last_modified))
+    return headers
+
+
+def with_validators(response: Response, etag: str,
+                    last_modified: Optional[datetime] = None) -> Response:
+    """Attach validators; clients must revalidate but may reuse the body"""
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = _http_date(last_modified)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
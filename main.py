@@ -1,11 +1,48 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.middleware.wsgi import WSGIMiddleware
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from contextlib import asynccontextmanager
 import logging
 import asyncio
-from scanner import SecurityScanner, scan_repository_handler
+import traceback
+from scanner import (
+    SecurityScanner, resolve_remote_head, ruleset_digest, scan_repository_handler, semgrep_version
+)
 from typing import Optional, Dict, Any
 from sqlalchemy.orm import Session
 
+import async_db
+import secrets_scan
+import semgrep_output
+from scan_jobs import scan_scheduler
+from semgrep_rules import ruleset_cache
+from workspace import workspaces
+from analysis_views import (
+    EVENTS_POLL_SECONDS,
+    StatusEvents,
+    analysis_list_item,
+    findings_payload,
+    result_payload,
+    status_payload,
+    summary_payload,
+    user_vulnerabilities_payload
+)
+from app import app as flask_app, git_integration
+from models import AnalysisResult
+from cache import response_cache
+from scan_status import scan_status
+from http_cache import make_etag, validator_headers, validators_match
+from scan_service import (
+    SCAN_WAIT_SECONDS,
+    async_scan_flights,
+    flight_key,
+    github_auth_error,
+    parse_scan_request,
+    run_scan_async,
+    scan_at_head_async,
+    unexpected_error
+)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -25,19 +62,32 @@ async def lifespan(app: FastAPI):
         # Startup
         logger.info("Starting application initialization")
         app_state['initialized'] = False
-        
-        # Initialize your resources here
-        # Note: Keep this minimal and move heavy initialization to background_init
-        
+
+        # The async engine connects lazily; creating it here only builds the pool
+        async_db.init_engine()
+
+        # Scans share this loop with the native routes that await them
+        await scan_scheduler.start()
+
         # Signal that basic initialization is complete
         app_state['initialized'] = True
-        
+
+        # Startup events are not run when a lifespan is set, so start it here
+        app_state['background_init'] = asyncio.create_task(background_init())
+
         yield
-        
+
     finally:
         # Shutdown
         logger.info("Shutting down application")
-        # Cleanup resources if needed
+        task = app_state.get('background_init')
+        if task is not None and not task.done():
+            task.cancel()
+        await scan_scheduler.stop()
+        await async_db.dispose_engine()
+        semgrep_output.shutdown()
+        secrets_scan.shutdown()
+        workspaces.shutdown()
         app_state.clear()
 
 app = FastAPI(
@@ -49,24 +99,388 @@ app = FastAPI(
 
 async def background_init() -> None:
     """
-    Handle heavy initialization tasks in background
-    Returns when initialization is complete
+    Handle heavy initialization tasks in background: open the first
+    database connection, load the rule catalog that decoding stored
+    results needs, look up the semgrep version that every scan
+    request's ruleset digest depends on and download the ruleset
     """
     try:
-        # Add your heavy initialization tasks here
-        # For example: database connections, cache warming, etc.
-        await asyncio.sleep(0.1)  # Prevent blocking
-        
+        async with async_db.session_scope() as session:
+            rules = await async_db.warm_rule_catalog(session)
+        version = await asyncio.to_thread(semgrep_version)
+        await ruleset_cache.resolve_async(scan_scheduler.scan_config.ruleset)
+        app_state['warmed'] = True
+        logger.info(f"Background initialization complete: {rules} rules cached, semgrep {version}")
+
     except Exception as e:
+        # Caches fill on first use instead
         logger.error(f"Background initialization error: {str(e)}")
-        raise
 
-@app.on_event("startup")
-async def startup_event() -> None:
+
+def json_response(body: Dict[str, Any], status: int = 200,
+                  headers: Optional[Dict[str, str]] = None) -> JSONResponse:
+    return JSONResponse(content=body, status_code=status, headers=headers)
+
+
+@app.post("/api/v1/analysis/scan")
+async def scan_repository_native(request: Request) -> JSONResponse:
+    """
+    Scan a specific repository with mandatory user ID. Same contract as the
+    Flask route, but the request waits for the scan without holding a thread.
+    """
+    try:
+        if request.headers.get('content-type', '').split(';')[0].strip() != 'application/json':
+            return json_response({
+                'success': False,
+                'error': {
+                    'message': 'Content-Type must be application/json',
+                    'code': 'INVALID_CONTENT_TYPE'
+                }
+            }, 400)
+
+        fields, error = parse_scan_request(await request.json())
+        if error:
+            return json_response(*error)
+        repo_name, repo_url = fields['repo_name'], fields['repo_url']
+        installation_id, user_id = fields['installation_id'], fields['user_id']
+
+        try:
+            access = await asyncio.to_thread(git_integration.get_access_token, int(installation_id))
+            installation_token = access.token
+        except Exception as e:
+            return json_response(*github_auth_error(e))
+
+        # May refresh and hash the rules file
+        digest = await asyncio.to_thread(
+            ruleset_digest, scan_scheduler.scan_config.ruleset, scan_scheduler.scan_config.engines
+        )
+
+        try:
+            head_sha = await resolve_remote_head(repo_url, installation_token)
+        except Exception as e:
+            logger.warning(f"Could not resolve head of {repo_name}: {str(e)}")
+            head_sha = None
+
+        if head_sha is None:
+            # Without a head commit there is nothing to reuse or coalesce on
+            return json_response(*await run_scan_async(
+                repo_name, repo_url, installation_token, installation_id, user_id
+            ))
+
+        key = flight_key(repo_name, head_sha, digest)
+        (body, status), shared = await async_scan_flights.do(
+            key,
+            lambda: scan_at_head_async(
+                repo_name, repo_url, installation_token, installation_id, user_id,
+                head_sha, digest, key
+            ),
+            timeout=SCAN_WAIT_SECONDS
+        )
+        if shared:
+            logger.info(f"Duplicate scan request for {repo_name}@{head_sha} joined the in-flight scan")
+        return json_response(body, status)
+
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        logger.error(traceback.format_exc())
+        return json_response(*unexpected_error(e))
+
+
+@app.get("/api/v1/analysis/{owner}/{repo}/summary")
+async def get_analysis_summary(owner: str, repo: str, request: Request):
+    """Get analysis summary"""
+    try:
+        repo_name = f"{owner}/{repo}"
+        async with async_db.session_scope() as session:
+            result = await async_db.latest_for(session, repo_name)
+
+            if not result:
+                return json_response({
+                    'success': False,
+                    'error': {
+                        'message': 'No analysis found',
+                        'code': 'ANALYSIS_NOT_FOUND'
+                    }
+                }, 404)
+
+            if result.status == 'failed':
+                return json_response({
+                    'success': False,
+                    'error': {
+                        'message': 'Analysis failed',
+                        'details': result.error,
+                        'code': 'ANALYSIS_FAILED'
+                    }
+                }, 400)
+
+            etag = make_etag('summary', result.id, result.status)
+            headers = validator_headers(etag, result.timestamp)
+            if validators_match(request.headers, etag, result.timestamp, result.status):
+                return Response(status_code=304, headers=headers)
+
+            cache_key = response_cache.key('summary', repo_name, result.id)
+            cached = await response_cache.get_async(repo_name, cache_key)
+            if cached is not None:
+                return json_response(cached, headers=headers)
+
+            document = await async_db.document_of(session, result.id)
+
+        payload = summary_payload(repo_name, owner, repo, result, document)
+        if result.status == 'completed':
+            await response_cache.set_async(repo_name, cache_key, payload)
+        return json_response(payload, headers=headers)
+    except Exception as e:
+        logger.error(f"Error getting summary: {str(e)}")
+        return json_response({
+            'success': False,
+            'error': {
+                'message': 'Failed to fetch summary',
+                'details': str(e)
+            }
+        }, 500)
+
+
+def _not_found(message: str = 'No analysis found', code: str = 'ANALYSIS_NOT_FOUND') -> JSONResponse:
+    return json_response({'success': False, 'error': {'message': message, 'code': code}}, 404)
+
+
+@app.get("/api/v1/analysis/{owner}/{repo}/findings")
+async def get_analysis_findings_native(owner: str, repo: str, request: Request):
+    """Get detailed findings with filtering and pagination"""
+    try:
+        page = int(request.query_params.get('page', 1))
+        per_page = int(request.query_params.get('limit', 10))
+        severity = request.query_params.get('severity', '').upper()
+        category = request.query_params.get('category', '')
+
+        repo_name = f"{owner}/{repo}"
+        filters = {
+            'page': page,
+            'limit': per_page,
+            'severity': severity,
+            'category': category
+        }
+        async with async_db.session_scope() as session:
+            result = await async_db.latest_for(session, repo_name)
+            if not result:
+                return _not_found()
+
+            etag = make_etag('findings', result.id, result.status, params=filters)
+            headers = validator_headers(etag, result.timestamp)
+            if validators_match(request.headers, etag, result.timestamp, result.status):
+                return Response(status_code=304, headers=headers)
+
+            cache_key = response_cache.key('findings', repo_name, result.id, filters)
+            cached = await response_cache.get_async(repo_name, cache_key)
+            if cached is not None:
+                return json_response(cached, headers=headers)
+
+            document = await async_db.document_of(session, result.id)
+        if not document:
+            return _not_found()
+
+        payload = findings_payload(
+            repo_name, owner, repo, result, document, page, per_page, severity, category
+        )
+        if result.status == 'completed':
+            await response_cache.set_async(repo_name, cache_key, payload)
+        return json_response(payload, headers=headers)
+    except Exception as e:
+        logger.error(f"Error getting findings: {str(e)}")
+        return json_response({
+            'success': False,
+            'error': {
+                'message': 'Failed to fetch findings',
+                'details': str(e)
+            }
+        }, 500)
+
+
+@app.get("/api/v1/users/top-vulnerabilities")
+async def get_user_vulnerabilities(request: Request):
     """
-    Startup event handler that triggers background initialization
+    Get top vulnerabilities for a user by user_id with optional repository filter
+    Query parameters:
+    - user_id: Required - User's unique identifier
+    - repository: Optional - Full repository name (e.g., 'Winmart-Store/backend')
     """
-    asyncio.create_task(background_init())
+    try:
+        user_id = request.query_params.get('user_id')
+        repository = request.query_params.get('repository')
+
+        if not user_id:
+            return json_response({
+                'success': False,
+                'error': {
+                    'message': 'Missing user_id parameter',
+                    'code': 'MISSING_USER_ID'
+                }
+            }, 400)
+
+        criteria = [
+            AnalysisResult.status == 'completed',
+            AnalysisResult.has_results(),
+            AnalysisResult.user_id == user_id
+        ]
+        if repository:
+            criteria.append(AnalysisResult.repository_name == repository)
+
+        async with async_db.session_scope() as session:
+            history = await async_db.history_version(session, *criteria)
+            etag = make_etag('user_vulnerabilities', user_id, repository, *history)
+            headers = validator_headers(etag, history[2])
+            if validators_match(request.headers, etag, history[2], 'completed'):
+                return Response(status_code=304, headers=headers)
+
+            analyses = await async_db.analysis_headers(session, *criteria)
+            if not analyses:
+                error_message = 'No analyses found for this user'
+                if repository:
+                    error_message += f' in repository {repository}'
+                return _not_found(error_message, 'NO_ANALYSES_FOUND')
+
+            documents = {}
+            for analysis in analyses:
+                try:
+                    documents[analysis.id] = await async_db.document_of(session, analysis.id)
+                except Exception as e:
+                    logger.error(f"Error processing analysis for {analysis.repository_name}: {str(e)}")
+
+        payload = await asyncio.to_thread(
+            user_vulnerabilities_payload, user_id, repository, analyses, documents
+        )
+        return json_response(payload, headers=headers)
+
+    except Exception as e:
+        logger.error(f"Error processing vulnerabilities: {str(e)}")
+        logger.error(traceback.format_exc())
+        return json_response({
+            'success': False,
+            'error': {
+                'message': 'Failed to process vulnerabilities',
+                'details': str(e)
+            }
+        }, 500)
+
+
+@app.get("/api/v1/analysis/verify/{user_id}")
+async def verify_user_analyses(user_id: str):
+    """Verify analyses for a specific user_id"""
+    try:
+        async with async_db.session_scope() as session:
+            analyses = await async_db.analysis_headers(session, AnalysisResult.user_id == user_id)
+
+        if not analyses:
+            return json_response({
+                'success': True,
+                'data': {
+                    'message': 'No analyses found for this user ID',
+                    'user_id': user_id,
+                    'count': 0
+                }
+            })
+
+        results = [analysis_list_item(analysis) for analysis in analyses]
+        return json_response({
+            'success': True,
+            'data': {
+                'user_id': user_id,
+                'count': len(results),
+                'analyses': results
+            }
+        })
+
+    except Exception as e:
+        logger.error(f"Error verifying analyses: {str(e)}")
+        return json_response({
+            'success': False,
+            'error': {
+                'message': 'Failed to verify analyses',
+                'details': str(e)
+            }
+        }, 500)
+
+
+@app.get("/api/v1/analysis/latest")
+async def get_latest_analyses():
+    """Get the most recent analyses with user IDs"""
+    try:
+        async with async_db.session_scope() as session:
+            analyses = await async_db.analysis_headers(session, limit=10)
+
+        results = [analysis_list_item(analysis) for analysis in analyses]
+        return json_response({
+            'success': True,
+            'data': {
+                'count': len(results),
+                'analyses': results
+            }
+        })
+
+    except Exception as e:
+        logger.error(f"Error getting latest analyses: {str(e)}")
+        return json_response({
+            'success': False,
+            'error': {
+                'message': 'Failed to get latest analyses',
+                'details': str(e)
+            }
+        }, 500)
+
+
+@app.get("/api/v1/analyses/{analysis_id}/status")
+async def get_analysis_status(analysis_id: int):
+    """Current phase and progress counters of an analysis"""
+    async with async_db.session_scope() as session:
+        analysis = await async_db.analysis_header(session, analysis_id)
+    if analysis is None:
+        return json_response({
+            'success': False,
+            'error': {'message': 'Analysis not found', 'code': 'ANALYSIS_NOT_FOUND'}
+        }, 404)
+    snapshot = await scan_status.get_async(analysis_id) or {}
+    return json_response(
+        {'success': True, 'data': status_payload(analysis, snapshot)},
+        headers={'Cache-Control': 'no-store'}
+    )
+
+
+@app.get("/api/v1/analyses/{analysis_id}/events")
+async def stream_analysis_events(analysis_id: int):
+    """
+    Server-sent events for an analysis: a ``progress`` event whenever its
+    snapshot changes and a final ``done`` event once it has finished.
+    Waits between polls on the event loop instead of holding a thread.
+    """
+    async with async_db.session_scope() as session:
+        analysis = await async_db.analysis_header(session, analysis_id)
+    if analysis is None:
+        return json_response({
+            'success': False,
+            'error': {'message': 'Analysis not found', 'code': 'ANALYSIS_NOT_FOUND'}
+        }, 404)
+
+    async def events():
+        stream = StatusEvents()
+        while stream.open:
+            # A new session per poll sees the scan's latest commit and holds
+            # no connection while sleeping
+            async with async_db.session_scope() as session:
+                analysis = await async_db.analysis_header(session, analysis_id)
+            if analysis is None:
+                return
+            snapshot = await scan_status.get_async(analysis_id) or {}
+            event = stream.poll(analysis, snapshot)
+            if event:
+                yield event
+            if stream.open:
+                await asyncio.sleep(EVENTS_POLL_SECONDS)
+
+    return StreamingResponse(events(), media_type='text/event-stream', headers={
+        'Cache-Control': 'no-store',
+        'X-Accel-Buffering': 'no'
+    })
+
 
 @app.post("/api/v1/scan")
 async def scan_repository(
@@ -76,12 +490,12 @@ async def scan_repository(
 ) -> Dict[str, Any]:
     """
     Endpoint to scan a repository
-    
+
     Args:
         repo_url: GitHub repository URL
         installation_token: GitHub installation token
         user_id: User identifier
-        
+
     Returns:
         Dict containing scan results or error details
     """
@@ -90,22 +504,22 @@ async def scan_repository(
             status_code=503,
             detail="Service is starting up. Please try again in a moment."
         )
-        
+
     try:
         result = await scan_repository_handler(
             repo_url=repo_url,
             installation_token=installation_token,
             user_id=user_id
         )
-        
+
         if not result['success']:
             raise HTTPException(
                 status_code=400,
                 detail=result.get('error', {'message': 'Scan failed'})
             )
-            
+
         return result
-        
+
     except Exception as e:
         logger.error(f"Scan error: {str(e)}")
         raise HTTPException(
@@ -114,42 +528,94 @@ async def scan_repository(
         )
 
 @app.get("/api/v1/analysis/{owner}/{repo}/result")
-async def get_analysis_findings(
-    owner: str,
-    repo: str
-) -> Dict[str, Any]:
+async def get_analysis_result(owner: str, repo: str, request: Request) -> JSONResponse:
     """
-    Get analysis findings for a repository
-    
-    Args:
-        owner: Repository owner
-        repo: Repository name
-        
-    Returns:
-        Dict containing analysis findings
+    Findings of the latest analysis of a repository
+    Query parameters:
+    - page, limit: Optional - pagination (limit capped at 100)
+    - severity, category: Optional - exact match filters
+    - file: Optional - substring of the file path
     """
     if not app_state.get('initialized'):
         raise HTTPException(
             status_code=503,
             detail="Service is starting up. Please try again in a moment."
         )
-    
-    # Implement your analysis retrieval logic here
-    raise HTTPException(
-        status_code=501,
-        detail="Not implemented"
-    )
+
+    try:
+        page = max(1, int(request.query_params.get('page', 1)))
+        per_page = min(100, max(1, int(request.query_params.get('limit', 10))))
+    except ValueError as ve:
+        return json_response({
+            'success': False,
+            'error': {
+                'message': str(ve),
+                'code': 'INVALID_PARAMETER'
+            }
+        }, 400)
+    severity = request.query_params.get('severity', '').upper()
+    category = request.query_params.get('category', '')
+    file_path = request.query_params.get('file', '')
+
+    try:
+        repo_name = f"{owner}/{repo}"
+        filters = {
+            'page': page,
+            'limit': per_page,
+            'severity': severity,
+            'category': category,
+            'file': file_path
+        }
+        async with async_db.session_scope() as session:
+            result = await async_db.latest_for(session, repo_name)
+            if not result:
+                return _not_found()
+
+            etag = make_etag('result', result.id, result.status, params=filters)
+            headers = validator_headers(etag, result.timestamp)
+            if validators_match(request.headers, etag, result.timestamp, result.status):
+                return Response(status_code=304, headers=headers)
+
+            cache_key = response_cache.key('result', repo_name, result.id, filters)
+            cached = await response_cache.get_async(repo_name, cache_key)
+            if cached is not None:
+                return json_response(cached, headers=headers)
+
+            document = await async_db.document_of(session, result.id)
+        if not document:
+            return _not_found()
+
+        payload = result_payload(
+            repo_name, owner, repo, result, document, page, per_page, severity, category, file_path
+        )
+        if result.status == 'completed':
+            await response_cache.set_async(repo_name, cache_key, payload)
+        return json_response(payload, headers=headers)
+
+    except Exception as e:
+        logger.error(f"Error getting findings: {str(e)}")
+        return json_response({
+            'success': False,
+            'error': {
+                'message': 'Internal server error',
+                'code': 'INTERNAL_ERROR'
+            }
+        }, 500)
 
 # Health check endpoint
 @app.get("/health")
 async def health_check() -> Dict[str, str]:
     """
     Health check endpoint
-    
+
     Returns:
         Dict containing service status
     """
     return {
         "status": "healthy",
         "initialized": str(app_state.get('initialized', False))
-    }
\ No newline at end of file
+    }
+
+# Everything without a native route above is served by the Flask app in a
+# thread pool; must stay last so the native routes take precedence
+app.mount("/", WSGIMiddleware(flask_app))
@@ -0,0 +1,44 @@
+"""create analysis_results
+
+Revision ID: 0001
+Revises:
+Create Date: 2024-11-22 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Databases created before migrations existed already have this table
+    # (from db.create_all() at startup), so only create it when missing.
+    if sa.inspect(op.get_bind()).has_table('analysis_results'):
+        return
+
+    op.create_table(
+        'analysis_results',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('repository_name', sa.String(length=255), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=True),
+        sa.Column('status', sa.String(length=50), nullable=True),
+        sa.Column('results', postgresql.JSON(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+    )
+    op.create_index(
+        'ix_analysis_results_repository_name',
+        'analysis_results',
+        ['repository_name']
+    )
+
+
+def downgrade():
+    op.drop_index('ix_analysis_results_repository_name', table_name='analysis_results')
+    op.drop_table('analysis_results')
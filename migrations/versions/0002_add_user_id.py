@@ -0,0 +1,30 @@
+"""add analysis_results.user_id
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2024-11-22 00:00:01
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Replaces the information_schema check + ALTER TABLE that app.py used
+    # to run on every import.
+    op.execute("ALTER TABLE analysis_results ADD COLUMN IF NOT EXISTS user_id VARCHAR(255)")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_analysis_results_user_id "
+        "ON analysis_results (user_id)"
+    )
+
+
+def downgrade():
+    op.drop_index('ix_analysis_results_user_id', table_name='analysis_results')
+    op.drop_column('analysis_results', 'user_id')
@@ -0,0 +1,104 @@
+"""compressed results storage and rule metadata catalog
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2024-11-25 00:00:00
+
+"""
+import json
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from db_migrations import (
+    batched_data_migration,
+    decode_payload_v1,
+    insert_rules,
+    load_rule_catalog,
+    pack_results_v1,
+    restore_payload_v1
+)
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'rule_metadata',
+        sa.Column('rule_id', sa.String(length=512), primary_key=True),
+        sa.Column('message', sa.Text(), nullable=True),
+        sa.Column('cwe', postgresql.JSON(), nullable=True),
+        sa.Column('owasp', postgresql.JSON(), nullable=True),
+        sa.Column('references', postgresql.JSON(), nullable=True),
+        sa.Column('fix_recommendations', postgresql.JSON(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+    )
+    op.add_column('analysis_results', sa.Column('results_blob', sa.LargeBinary(), nullable=True))
+
+    catalog = {}
+
+    def compress_batch(connection, rows):
+        if not catalog:
+            catalog.update(load_rule_catalog(connection))
+
+        updates = []
+        for row in rows:
+            results = row.results
+            if isinstance(results, str):
+                results = json.loads(results)
+            blob, new_rules = pack_results_v1(results, catalog)
+            if new_rules:
+                insert_rules(connection, new_rules)
+                catalog.update(new_rules)
+            updates.append({'id': row.id, 'blob': blob})
+
+        connection.execute(
+            sa.text("UPDATE analysis_results SET results_blob = :blob, results = NULL WHERE id = :id"),
+            updates
+        )
+
+    batched_data_migration(
+        """
+        SELECT id, results FROM analysis_results
+        WHERE results IS NOT NULL AND results_blob IS NULL AND id > :last_id
+        ORDER BY id LIMIT :limit
+        """,
+        compress_batch,
+        label='compress analysis results'
+    )
+
+
+def downgrade():
+    catalog = {}
+
+    def decompress_batch(connection, rows):
+        if not catalog:
+            catalog.update(load_rule_catalog(connection))
+
+        updates = [
+            {'id': row.id, 'results': json.dumps(restore_payload_v1(decode_payload_v1(row.results_blob), catalog))}
+            for row in rows
+        ]
+        connection.execute(
+            sa.text("UPDATE analysis_results SET results = CAST(:results AS JSON), results_blob = NULL WHERE id = :id"),
+            updates
+        )
+
+    batched_data_migration(
+        """
+        SELECT id, results_blob FROM analysis_results
+        WHERE results_blob IS NOT NULL AND id > :last_id
+        ORDER BY id LIMIT :limit
+        """,
+        decompress_batch,
+        label='decompress analysis results'
+    )
+
+    op.drop_column('analysis_results', 'results_blob')
+    op.drop_table('rule_metadata')
@@ -0,0 +1,42 @@
+"""retention support: compacted_at and history indexes
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2024-11-27 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('analysis_results', sa.Column('compacted_at', sa.DateTime(), nullable=True))
+
+    # Built concurrently so the deploy does not block writes on a large table
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_analysis_results_repo_timestamp "
+            "ON analysis_results (repository_name, timestamp DESC)"
+        )
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_analysis_results_timestamp "
+            "ON analysis_results (timestamp DESC)"
+        )
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_analysis_results_status_timestamp "
+            "ON analysis_results (status, timestamp)"
+        )
+
+
+def downgrade():
+    op.drop_index('ix_analysis_results_status_timestamp', table_name='analysis_results')
+    op.drop_index('ix_analysis_results_timestamp', table_name='analysis_results')
+    op.drop_index('ix_analysis_results_repo_timestamp', table_name='analysis_results')
+    op.drop_column('analysis_results', 'compacted_at')
@@ -0,0 +1,71 @@
+"""canonical findings schema: schema_version and backfill
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2024-11-29 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from db_migrations import (
+    batched_data_migration,
+    canonicalize_v2,
+    insert_rules,
+    load_rule_catalog,
+    pack_results_v1,
+    stored_results
+)
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+SCHEMA_VERSION = 2
+
+
+def upgrade():
+    op.add_column('analysis_results', sa.Column('schema_version', sa.SmallInteger(), nullable=True))
+
+    catalog = {}
+
+    def canonicalize_batch(connection, rows):
+        if not catalog:
+            catalog.update(load_rule_catalog(connection))
+
+        updates = []
+        for row in rows:
+            blob, new_rules = pack_results_v1(canonicalize_v2(stored_results(row, catalog)), catalog)
+            if new_rules:
+                insert_rules(connection, new_rules)
+                catalog.update(new_rules)
+            updates.append({'id': row.id, 'blob': blob, 'version': SCHEMA_VERSION})
+
+        connection.execute(
+            sa.text(
+                "UPDATE analysis_results "
+                "SET results_blob = :blob, results = NULL, schema_version = :version "
+                "WHERE id = :id"
+            ),
+            updates
+        )
+
+    batched_data_migration(
+        f"""
+        SELECT id, results_blob, results FROM analysis_results
+        WHERE (schema_version IS NULL OR schema_version < {SCHEMA_VERSION})
+          AND (results_blob IS NOT NULL OR results IS NOT NULL)
+          AND id > :last_id
+        ORDER BY id LIMIT :limit
+        """,
+        canonicalize_batch,
+        label='canonicalize analysis results'
+    )
+
+
+def downgrade():
+    # Converted documents are not reshaped back to their original form
+    op.drop_column('analysis_results', 'schema_version')
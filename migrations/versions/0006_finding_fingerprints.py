@@ -0,0 +1,103 @@
+"""finding fingerprints table and backfill
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2024-12-02 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from db_migrations import (
+    batched_data_migration,
+    canonicalize_v3,
+    finding_fingerprints_table,
+    fingerprint_rows_v3,
+    insert_rules,
+    load_rule_catalog,
+    pack_results_v1,
+    stored_results
+)
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+SCHEMA_VERSION = 3
+
+
+def upgrade():
+    op.create_table(
+        'finding_fingerprints',
+        sa.Column('analysis_id', sa.Integer(), nullable=False),
+        sa.Column('fingerprint', sa.String(length=64), nullable=False),
+        sa.Column('rule_id', sa.String(length=512), nullable=False),
+        sa.Column('file', sa.Text(), nullable=False),
+        sa.Column('line_start', sa.Integer(), nullable=True),
+        sa.Column('line_end', sa.Integer(), nullable=True),
+        sa.Column('severity', sa.String(length=20), nullable=True),
+        sa.Column('category', sa.String(length=100), nullable=True),
+        sa.ForeignKeyConstraint(['analysis_id'], ['analysis_results.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('analysis_id', 'fingerprint'),
+    )
+    op.create_index('ix_finding_fingerprints_fingerprint', 'finding_fingerprints', ['fingerprint'])
+
+    catalog = {}
+
+    def fingerprint_batch(connection, rows):
+        if not catalog:
+            catalog.update(load_rule_catalog(connection))
+
+        updates = []
+        for row in rows:
+            document = canonicalize_v3(stored_results(row, catalog))
+            if row.schema_version != SCHEMA_VERSION:
+                blob, new_rules = pack_results_v1(document, catalog)
+                if new_rules:
+                    insert_rules(connection, new_rules)
+                    catalog.update(new_rules)
+                updates.append({'id': row.id, 'blob': blob, 'version': SCHEMA_VERSION})
+
+            # Only completed analyses are compared by fingerprint
+            fingerprints = fingerprint_rows_v3(row.id, document['findings'])
+            if fingerprints and row.status == 'completed':
+                connection.execute(
+                    postgresql.insert(finding_fingerprints_table).values(fingerprints)
+                    .on_conflict_do_nothing(index_elements=['analysis_id', 'fingerprint'])
+                )
+
+        if updates:
+            connection.execute(
+                sa.text(
+                    "UPDATE analysis_results "
+                    "SET results_blob = :blob, results = NULL, schema_version = :version "
+                    "WHERE id = :id"
+                ),
+                updates
+            )
+
+    batched_data_migration(
+        """
+        SELECT a.id, a.status, a.results_blob, a.results, a.schema_version
+        FROM analysis_results a
+        WHERE (a.results_blob IS NOT NULL OR a.results IS NOT NULL)
+          AND (
+            a.schema_version IS DISTINCT FROM 3
+            OR (a.status = 'completed'
+                AND NOT EXISTS (SELECT 1 FROM finding_fingerprints f WHERE f.analysis_id = a.id))
+          )
+          AND a.id > :last_id
+        ORDER BY a.id LIMIT :limit
+        """,
+        fingerprint_batch,
+        label='fingerprint analysis findings'
+    )
+
+
+def downgrade():
+    op.drop_index('ix_finding_fingerprints_fingerprint', table_name='finding_fingerprints')
+    op.drop_table('finding_fingerprints')
@@ -0,0 +1,31 @@
+"""scanned commit sha on analysis results
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2024-12-04 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('analysis_results', sa.Column('commit_sha', sa.String(length=40), nullable=True))
+
+    with op.get_context().autocommit_block():
+        op.execute(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_analysis_results_repo_commit "
+            "ON analysis_results (repository_name, commit_sha)"
+        )
+
+
+def downgrade():
+    op.drop_index('ix_analysis_results_repo_commit', table_name='analysis_results')
+    op.drop_column('analysis_results', 'commit_sha')
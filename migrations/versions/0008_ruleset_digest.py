@@ -0,0 +1,24 @@
+"""ruleset digest on analysis results
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2024-12-06 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('analysis_results', sa.Column('ruleset_digest', sa.String(length=64), nullable=True))
+
+
+def downgrade():
+    op.drop_column('analysis_results', 'ruleset_digest')
@@ -0,0 +1,45 @@
+"""scan queue for the scan worker
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2024-12-09 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'scan_queue',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('analysis_id', sa.Integer(), nullable=False),
+        sa.Column('repository_name', sa.String(length=255), nullable=False),
+        sa.Column('installation_id', sa.String(length=64), nullable=False),
+        sa.Column('user_id', sa.String(length=255), nullable=False),
+        sa.Column('head_sha', sa.String(length=40), nullable=True),
+        sa.Column('batch_id', sa.String(length=32), nullable=True),
+        sa.Column('priority', sa.SmallInteger(), nullable=False),
+        sa.Column('cost_mb', sa.Float(), nullable=False, server_default='0'),
+        sa.Column('status', sa.String(length=20), nullable=False, server_default='queued'),
+        sa.Column('attempts', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('worker_id', sa.String(length=255), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.Column('heartbeat_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['analysis_id'], ['analysis_results.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('analysis_id'),
+    )
+    op.create_index('ix_scan_queue_claim', 'scan_queue', ['status', 'priority', 'cost_mb', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_scan_queue_claim', table_name='scan_queue')
+    op.drop_table('scan_queue')
@@ -0,0 +1,454 @@
+# normalize.py
+"""
+Single-pass normalization of semgrep output.
+
+Each raw finding is read once into a compact ``Finding`` record while
+severity/category counts are accumulated on the fly. Response dicts and
+severity/category groupings are only built when an endpoint asks for them.
+
+Results are stored in one canonical, versioned document (see
+``canonicalize``) so read endpoints can serve them without reshaping:
+
+    {
+        'schema_version': 3,
+        'summary': {'total_findings', 'files_scanned', 'severity_counts',
+                    'category_counts', 'semgrep_version', 'scan_status'},
+        'findings': [{'id', 'fingerprint', 'file', 'file_name', 'line_start',
+                      'line_end', 'code_snippet', 'message', 'severity',
+                      'category', 'cwe', 'owasp', 'fix_recommendations'}],
+        'errors': [...],
+        'metadata': {...}
+    }
+
+A finding's ``fingerprint`` identifies it across scans of the same
+repository: it hashes the rule id, the repository-relative path and the
+whitespace-normalized code snippet, so it survives unrelated edits that
+shift line numbers. Identical matches within one file get an ordinal in
+line order to keep fingerprints unique per analysis.
+"""
+import gc
+import re
+import json
+import hashlib
+import posixpath
+import logging
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Severity buckets always present in responses, even when empty
+DEFAULT_SEVERITIES = ('HIGH', 'MEDIUM', 'LOW', 'WARNING', 'INFO')
+
+SCHEMA_VERSION = 3
+
+# Directory the scanner clones into, e.g. /tmp/scanner_x/repo_20241122_101500/
+CLONE_DIR_PATTERN = re.compile(r'^repo_\d{8}_\d{6}$')
+
+_WHITESPACE = re.compile(r'\s+')
+
+_EMPTY = {}
+
+# Below this many findings the cyclic GC pause is not worth it
+GC_PAUSE_THRESHOLD = 1000
+
+
+@contextmanager
+def _gc_paused(size: int):
+    """
+    Pause the cyclic garbage collector while building many small objects.
+    None of them form cycles, so collections triggered mid-build would only
+    re-traverse the (large) input document for nothing.
+    """
+    if size < GC_PAUSE_THRESHOLD or not gc.isenabled():
+        yield
+        return
+    gc.disable()
+    try:
+        yield
+    finally:
+        gc.enable()
+
+
+def relative_path(path: str) -> str:
+    """Path of a finding relative to the repository root"""
+    if not path:
+        return path
+    parts = path.replace('\\', '/').split('/')
+    for index, part in enumerate(parts):
+        if CLONE_DIR_PATTERN.match(part) and index + 1 < len(parts):
+            return '/'.join(parts[index + 1:])
+    return path[2:] if path.startswith('./') else path
+
+
+def normalize_path(path: str) -> str:
+    """Repository-relative POSIX path used in fingerprints"""
+    path = relative_path(path or '').replace('\\', '/')
+    return posixpath.normpath(path).lstrip('/') if path else ''
+
+
+def snippet_hash(snippet: str) -> str:
+    """Hash of a code snippet, ignoring indentation and line wrapping"""
+    normalized = _WHITESPACE.sub(' ', snippet or '').strip()
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+
+def fingerprint(rule_id: str, path: str, snippet: str, ordinal: int = 0) -> str:
+    """Stable identity of a finding across scans"""
+    key = '\0'.join((rule_id or '', normalize_path(path), snippet_hash(snippet)))
+    if ordinal:
+        key += f'\0{ordinal}'
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:40]
+
+
+def assign_fingerprints(findings: List[Dict]) -> None:
+    """Set ``fingerprint`` on canonical findings, numbering identical matches"""
+    occurrences = {}
+    for finding in sorted(findings, key=lambda f: (f['line_start'] or 0, f['line_end'] or 0)):
+        # Same key as the hash, so paths that normalize alike share ordinals
+        identity = (finding['id'], normalize_path(finding['file']), snippet_hash(finding['code_snippet']))
+        ordinal = occurrences.get(identity, 0)
+        occurrences[identity] = ordinal + 1
+        finding['fingerprint'] = fingerprint(
+            finding['id'], finding['file'], finding['code_snippet'], ordinal
+        )
+
+
+class Finding:
+    """One normalized finding"""
+    __slots__ = (
+        'rule_id', 'path', 'line_start', 'line_end', 'code_snippet', 'message',
+        'severity', 'category', 'cwe', 'owasp', 'fix_description', 'references'
+    )
+
+    def __init__(self, rule_id, path, line_start, line_end, code_snippet, message,
+                 severity, category, cwe, owasp, fix_description, references):
+        self.rule_id = rule_id
+        self.path = path
+        self.line_start = line_start
+        self.line_end = line_end
+        self.code_snippet = code_snippet
+        self.message = message
+        self.severity = severity
+        self.category = category
+        self.cwe = cwe
+        self.owasp = owasp
+        self.fix_description = fix_description
+        self.references = references
+
+    @classmethod
+    def from_semgrep(cls, raw: Dict) -> 'Finding':
+        """Build from one entry of semgrep's ``results`` list"""
+        extra = raw.get('extra') or _EMPTY
+        metadata = extra.get('metadata') or _EMPTY
+        return cls(
+            raw.get('check_id', 'unknown'),
+            raw.get('path', 'unknown'),
+            (raw.get('start') or _EMPTY).get('line', 0),
+            (raw.get('end') or _EMPTY).get('line', 0),
+            extra.get('lines', ''),
+            extra.get('message', ''),
+            extra.get('severity', 'INFO'),
+            metadata.get('category', 'uncategorized'),
+            metadata.get('cwe', []),
+            metadata.get('owasp', []),
+            metadata.get('message', ''),
+            metadata.get('references', [])
+        )
+
+    @classmethod
+    def from_processed(cls, processed: Dict) -> 'Finding':
+        """Build from a finding produced by ``SecurityScanner._process_scan_results``"""
+        fix = processed.get('fix_recommendations')
+        if isinstance(fix, dict):
+            fix_description = fix.get('description', '')
+            references = fix.get('references', [])
+        else:
+            fix_description = fix or ''
+            references = processed.get('references', [])
+        return cls(
+            processed.get('id') or 'unknown',
+            processed.get('file') or 'unknown',
+            processed.get('line_start') or 0,
+            processed.get('line_end') or 0,
+            processed.get('code_snippet', ''),
+            processed.get('message', ''),
+            (processed.get('severity') or 'INFO').upper(),
+            processed.get('category') or 'security',
+            processed.get('cwe', []),
+            processed.get('owasp', []),
+            fix_description,
+            references
+        )
+
+    def to_canonical(self) -> Dict:
+        """Stored form: response dict with repository-relative paths"""
+        finding = self.to_dict()
+        finding['file'] = finding['file_name'] = relative_path(self.path)
+        return finding
+
+    def to_dict(self) -> Dict:
+        return {
+            'id': self.rule_id,
+            'file': self.path,
+            'line_start': self.line_start,
+            'line_end': self.line_end,
+            'code_snippet': self.code_snippet,
+            'message': self.message,
+            'severity': self.severity,
+            'category': self.category,
+            'cwe': self.cwe,
+            'owasp': self.owasp,
+            'fix_recommendations': {
+                'description': self.fix_description,
+                'references': self.references
+            }
+        }
+
+
+class NormalizedResults:
+    """Normalized findings plus incrementally computed counts"""
+    __slots__ = (
+        'findings', 'severity_counts', 'category_counts', 'errors',
+        'files_scanned', 'files_scanned_count', 'total_findings',
+        'semgrep_version', 'scan_status',
+        '_dicts', '_by_severity', '_by_category'
+    )
+
+    def __init__(self, findings: List[Finding], severity_counts: Dict[str, int],
+                 category_counts: Dict[str, int], errors: List, files_scanned: List,
+                 total_findings: int, semgrep_version: str, scan_status: str,
+                 files_scanned_count: Optional[int] = None):
+        self.findings = findings
+        self.severity_counts = severity_counts
+        self.category_counts = category_counts
+        self.errors = errors
+        self.files_scanned = files_scanned
+        self.files_scanned_count = (
+            len(files_scanned) if files_scanned_count is None else files_scanned_count
+        )
+        self.total_findings = total_findings
+        self.semgrep_version = semgrep_version
+        self.scan_status = scan_status
+        self._dicts = None
+        self._by_severity = None
+        self._by_category = None
+
+    @classmethod
+    def from_semgrep(cls, results: Dict) -> 'NormalizedResults':
+        """Normalize a parsed semgrep JSON document in one pass"""
+        if not isinstance(results, dict):
+            raise ValueError(f"Invalid results format: expected dict, got {type(results)}")
+
+        raw_findings = results.get('results', [])
+        errors = list(results.get('errors', []))
+        severity_counts = dict.fromkeys(DEFAULT_SEVERITIES, 0)
+        category_counts = {}
+        findings = []
+        append = findings.append
+        from_semgrep = Finding.from_semgrep
+
+        with _gc_paused(len(raw_findings)):
+            for raw in raw_findings:
+                try:
+                    finding = from_semgrep(raw)
+                except Exception as e:
+                    logger.error(f"Error processing finding: {str(e)}")
+                    errors.append(f"Error processing finding: {str(e)}")
+                    continue
+                append(finding)
+                severity_counts[finding.severity] = severity_counts.get(finding.severity, 0) + 1
+                category_counts[finding.category] = category_counts.get(finding.category, 0) + 1
+
+        scanned = results.get('paths', {}).get('scanned', [])
+        return cls(
+            findings,
+            severity_counts,
+            category_counts,
+            errors,
+            scanned,
+            len(raw_findings),
+            results.get('version', 'unknown'),
+            'success' if not results.get('errors') else 'completed_with_errors'
+        )
+
+    @classmethod
+    def from_processed(cls, data: Dict) -> 'NormalizedResults':
+        """Normalize the ``data`` dict returned by ``SecurityScanner.scan_repository``"""
+        processed = data.get('findings') or []
+        errors = list(data.get('errors', []))
+        severity_counts = dict.fromkeys(DEFAULT_SEVERITIES, 0)
+        category_counts = {}
+        findings = []
+
+        with _gc_paused(len(processed)):
+            for item in processed:
+                try:
+                    finding = Finding.from_processed(item)
+                except Exception as e:
+                    logger.error(f"Error processing finding: {str(e)}")
+                    errors.append(f"Error processing finding: {str(e)}")
+                    continue
+                findings.append(finding)
+                severity_counts[finding.severity] = severity_counts.get(finding.severity, 0) + 1
+                category_counts[finding.category] = category_counts.get(finding.category, 0) + 1
+
+        summary = data.get('summary') or {}
+        files_scanned = summary.get('files_scanned', 0)
+        if isinstance(files_scanned, list):
+            files_scanned = len(files_scanned)
+        return cls(
+            findings,
+            severity_counts,
+            category_counts,
+            errors,
+            [],
+            len(findings),
+            summary.get('semgrep_version', 'unknown'),
+            'success' if not errors else 'completed_with_errors',
+            files_scanned_count=files_scanned
+        )
+
+    @classmethod
+    def failed(cls, message: str) -> 'NormalizedResults':
+        """Empty result set for output that could not be parsed"""
+        return cls([], {}, {}, [message], [], 0, 'unknown', 'failed')
+
+    @property
+    def summary(self) -> Dict:
+        return {
+            'total_files_scanned': self.files_scanned_count,
+            'total_findings': self.total_findings,
+            'files_scanned': self.files_scanned,
+            'semgrep_version': self.semgrep_version,
+            'scan_status': self.scan_status
+        }
+
+    def to_canonical(self, metadata: Optional[Dict] = None) -> Dict:
+        """Canonical stored document"""
+        with _gc_paused(len(self.findings)):
+            findings = [finding.to_canonical() for finding in self.findings]
+            assign_fingerprints(findings)
+        return {
+            'schema_version': SCHEMA_VERSION,
+            'summary': {
+                'total_findings': self.total_findings,
+                'files_scanned': self.files_scanned_count,
+                'severity_counts': self.severity_counts,
+                'category_counts': self.category_counts,
+                'semgrep_version': self.semgrep_version,
+                'scan_status': self.scan_status
+            },
+            'findings': findings,
+            'errors': self.errors,
+            'metadata': metadata or {}
+        }
+
+    def finding_dicts(self) -> List[Dict]:
+        """All findings as response dicts, built once"""
+        if self._dicts is None:
+            with _gc_paused(len(self.findings)):
+                self._dicts = [finding.to_dict() for finding in self.findings]
+        return self._dicts
+
+    def filter(self, severity: Optional[str] = None,
+               category: Optional[str] = None) -> List[Finding]:
+        """Findings matching the given severity/category, without building dicts"""
+        findings = self.findings
+        if severity:
+            findings = [f for f in findings if f.severity == severity]
+        if category:
+            findings = [f for f in findings if f.category == category]
+        return findings
+
+    def _materialize_groups(self) -> None:
+        """Build both groupings in one pass over the findings"""
+        by_severity = {key: [] for key in DEFAULT_SEVERITIES}
+        by_category = {}
+        dicts = self.finding_dicts()
+        for finding, as_dict in zip(self.findings, dicts):
+            severity_group = by_severity.get(finding.severity)
+            if severity_group is None:
+                severity_group = by_severity[finding.severity] = []
+            severity_group.append(as_dict)
+            category_group = by_category.get(finding.category)
+            if category_group is None:
+                category_group = by_category[finding.category] = []
+            category_group.append(as_dict)
+        self._by_severity = by_severity
+        self._by_category = by_category
+
+    def findings_by_severity(self) -> Dict[str, List[Dict]]:
+        if self._by_severity is None:
+            self._materialize_groups()
+        return self._by_severity
+
+    def findings_by_category(self) -> Dict[str, List[Dict]]:
+        if self._by_category is None:
+            self._materialize_groups()
+        return self._by_category
+
+    def to_response(self) -> Dict:
+        """Full response shape, including groupings"""
+        return {
+            'summary': self.summary,
+            'findings': self.finding_dicts(),
+            'findings_by_severity': self.findings_by_severity(),
+            'findings_by_category': self.findings_by_category(),
+            'errors': self.errors,
+            'severity_counts': self.severity_counts,
+            'category_counts': self.category_counts
+        }
+
+
+def normalize_semgrep_results(raw_results) -> NormalizedResults:
+    """Normalize semgrep output given as a JSON string or parsed dict"""
+    if isinstance(raw_results, str):
+        try:
+            raw_results = json.loads(raw_results)
+        except json.JSONDecodeError as e:
+            logger.error(f"Failed to parse JSON results: {str(e)}")
+            return NormalizedResults.failed(f"Failed to parse results: {str(e)}")
+
+    try:
+        return NormalizedResults.from_semgrep(raw_results)
+    except Exception as e:
+        logger.error(f"Error formatting results: {str(e)}")
+        return NormalizedResults.failed(f"Failed to format results: {str(e)}")
+
+
+def is_canonical(results) -> bool:
+    return isinstance(results, dict) and results.get('schema_version') == SCHEMA_VERSION
+
+
+def canonicalize(results) -> Optional[Dict]:
+    """
+    Convert any stored results shape into the canonical document.
+
+    Accepts raw semgrep JSON (``results`` list), the scanner's processed
+    ``data`` dict (``findings`` list) and canonical documents, which are
+    returned unchanged.
+    """
+    if results is None or is_canonical(results):
+        return results
+    if isinstance(results, str):
+        results = json.loads(results)
+    if not isinstance(results, dict):
+        raise ValueError(f"Invalid results format: expected dict, got {type(results)}")
+
+    if 'results' in results:
+        return NormalizedResults.from_semgrep(results).to_canonical()
+
+    metadata = dict(results.get('metadata') or {})
+    for key in ('repository', 'user_id', 'timestamp', 'commit_sha', 'ruleset_digest',
+                'repository_info'):
+        if key in results:
+            metadata[key] = results[key]
+    document = NormalizedResults.from_processed(results).to_canonical(metadata)
+    if results.get('compacted'):
+        document['summary'].update({
+            key: value for key, value in (results.get('summary') or {}).items()
+            if key in document['summary']
+        })
+        document['compacted'] = True
+    return document
@@ -0,0 +1,226 @@
+# retention.py
+"""
+Retention and compaction for historical analyses.
+
+Keeps the latest ``keep_full_per_repo`` completed analyses of every
+repository intact, replaces older ones with a summary rollup (findings
+dropped) and deletes failed analyses older than ``failed_ttl_days``. Work
+is done in small batches, each committed on its own, so the job can be
+interrupted and re-run at any time.
+
+Compacted analyses keep their ``finding_fingerprints`` rows on purpose:
+they are all that is left of the findings, and ``/diff`` compares
+analyses by them. The report counts them as ``fingerprints_retained``;
+they are not part of ``bytes_reclaimed``.
+
+Usage:
+    python retention.py [--keep N] [--failed-days D] [--batch-size B] [--dry-run]
+"""
+import os
+import argparse
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import text
+
+from models import db, AnalysisResult
+from storage import compress_json
+
+logger = logging.getLogger(__name__)
+
+# Top-level keys that hold per-finding or per-file data and are dropped
+# when a result is compacted
+BULKY_KEYS = ('findings', 'results', 'paths')
+
+ROW_SIZE_SQL = (
+    "COALESCE(pg_column_size(results), 0) + COALESCE(octet_length(results_blob), 0)"
+)
+
+
+@dataclass
+class RetentionPolicy:
+    """How much analysis history to keep"""
+    keep_full_per_repo: int = int(os.getenv('RETENTION_KEEP_FULL', '5'))
+    failed_ttl_days: int = int(os.getenv('RETENTION_FAILED_DAYS', '14'))
+    batch_size: int = int(os.getenv('RETENTION_BATCH_SIZE', '50'))
+    dry_run: bool = False
+
+
+@dataclass
+class RetentionReport:
+    """Outcome of a retention run"""
+    compacted: int = 0
+    deleted_failed: int = 0
+    bytes_reclaimed: int = 0
+    # Fingerprint rows of compacted analyses, kept for /diff
+    fingerprints_retained: int = 0
+    started_at: datetime = field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+
+    def to_dict(self) -> Dict:
+        return {
+            'compacted': self.compacted,
+            'deleted_failed': self.deleted_failed,
+            'bytes_reclaimed': self.bytes_reclaimed,
+            'fingerprints_retained': self.fingerprints_retained,
+            'started_at': self.started_at.isoformat(),
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+
+
+def summary_rollup(results) -> Optional[Dict]:
+    """Reduce stored results to their summary, dropping per-finding data"""
+    if not isinstance(results, dict):
+        return results
+
+    rollup = {key: value for key, value in results.items() if key not in BULKY_KEYS}
+    if 'summary' not in rollup:
+        raw_findings = results.get('findings') or results.get('results') or []
+        rollup['summary'] = {'total_findings': len(raw_findings)}
+    rollup['findings'] = []
+    rollup['compacted'] = True
+    return rollup
+
+
+def _compaction_candidates(policy: RetentionPolicy):
+    """(id, size) of every analysis to compact, ranked in a single pass"""
+    return db.session.execute(text(f"""
+        SELECT id, {ROW_SIZE_SQL} AS size FROM (
+            SELECT id, results, results_blob, compacted_at,
+                   row_number() OVER (
+                       PARTITION BY repository_name
+                       ORDER BY timestamp DESC, id DESC
+                   ) AS rn
+            FROM analysis_results
+            WHERE status = 'completed'
+        ) ranked
+        WHERE rn > :keep AND compacted_at IS NULL
+        ORDER BY id
+    """), {'keep': policy.keep_full_per_repo}).fetchall()
+
+
+def compact_old_results(policy: RetentionPolicy, report: RetentionReport) -> None:
+    """Replace findings of analyses beyond the newest N per repository with rollups"""
+    # Ranked once; analyses completed meanwhile wait for the next run
+    candidates = _compaction_candidates(policy)
+    for start in range(0, len(candidates), policy.batch_size):
+        rows = candidates[start:start + policy.batch_size]
+        last_id = rows[-1].id
+        sizes = {row.id: row.size for row in rows}
+
+        analyses = AnalysisResult.query.filter(AnalysisResult.id.in_(sizes)).all()
+        for analysis in analyses:
+            rollup = summary_rollup(analysis.results)
+            if policy.dry_run:
+                new_size = len(compress_json(rollup))
+            else:
+                analysis.results = rollup
+                analysis.compacted_at = datetime.utcnow()
+                new_size = len(analysis.results_blob or b'')
+            report.bytes_reclaimed += max(0, sizes[analysis.id] - new_size)
+            report.compacted += 1
+        report.fingerprints_retained += db.session.execute(
+            text("SELECT count(*) FROM finding_fingerprints WHERE analysis_id = ANY(:ids)"),
+            {'ids': list(sizes)}
+        ).scalar()
+
+        if policy.dry_run:
+            db.session.rollback()
+        else:
+            db.session.commit()
+        logger.info(f"Compacted {report.compacted} analyses so far (last id {last_id})")
+
+
+def delete_failed_results(policy: RetentionPolicy, report: RetentionReport) -> None:
+    """Delete failed and cancelled analyses older than the policy's TTL"""
+    cutoff = datetime.utcnow() - timedelta(days=policy.failed_ttl_days)
+    last_id = 0
+    while True:
+        rows = db.session.execute(text(f"""
+            SELECT id, {ROW_SIZE_SQL} + COALESCE(octet_length(error), 0) AS size
+            FROM analysis_results
+            WHERE status IN ('failed', 'cancelled') AND timestamp < :cutoff AND id > :last_id
+            ORDER BY id
+            LIMIT :limit
+        """), {
+            'cutoff': cutoff,
+            'last_id': last_id,
+            'limit': policy.batch_size
+        }).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1].id
+
+        if not policy.dry_run:
+            db.session.execute(
+                text("DELETE FROM analysis_results WHERE id = ANY(:ids)"),
+                {'ids': [row.id for row in rows]}
+            )
+            db.session.commit()
+
+        report.deleted_failed += len(rows)
+        report.bytes_reclaimed += sum(row.size for row in rows)
+        logger.info(f"Deleted {report.deleted_failed} failed analyses so far (last id {last_id})")
+
+
+def run_retention(policy: Optional[RetentionPolicy] = None) -> RetentionReport:
+    """
+    Apply a retention policy. Must run inside an application context.
+
+    ``bytes_reclaimed`` counts result and error payload bytes removed from
+    live rows; disk space is returned to the OS once autovacuum (or a manual
+    VACUUM) processes the table. Fingerprints of compacted analyses are
+    kept for ``/diff`` and only counted.
+    """
+    policy = policy or RetentionPolicy()
+    report = RetentionReport()
+    logger.info(
+        f"Running retention: keep {policy.keep_full_per_repo} full results per repository, "
+        f"drop failed after {policy.failed_ttl_days} days"
+        + (" (dry run)" if policy.dry_run else "")
+    )
+
+    try:
+        compact_old_results(policy, report)
+        delete_failed_results(policy, report)
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        report.finished_at = datetime.utcnow()
+
+    logger.info(f"Retention finished: {report.to_dict()}")
+    return report
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description='Compact and prune historical analyses')
+    defaults = RetentionPolicy()
+    parser.add_argument('--keep', type=int, default=defaults.keep_full_per_repo,
+                        help='full results to keep per repository')
+    parser.add_argument('--failed-days', type=int, default=defaults.failed_ttl_days,
+                        help='delete failed analyses older than this many days')
+    parser.add_argument('--batch-size', type=int, default=defaults.batch_size)
+    parser.add_argument('--dry-run', action='store_true',
+                        help='report what would be reclaimed without changing anything')
+    args = parser.parse_args(argv)
+
+    policy = RetentionPolicy(
+        keep_full_per_repo=max(1, args.keep),
+        failed_ttl_days=max(0, args.failed_days),
+        batch_size=max(1, args.batch_size),
+        dry_run=args.dry_run
+    )
+
+    from app import app
+
+    with app.app_context():
+        report = run_retention(policy)
+    print(report.to_dict())
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,615 @@
+# scan_jobs.py
+"""
+Background scheduling of repository scans.
+
+Scans run on a single asyncio event loop and share one aiohttp session.
+Under the ASGI service (main.py) that is the server's own loop, joined at
+startup, so native routes await scans without crossing threads. Elsewhere
+(the Flask app alone, worker.py) the scheduler runs its loop in a daemon
+thread. Flask routes, which run in threads, always wait on it through
+``run``. Every scan, interactive or queued, is admitted through
+``AdmissionQueue``, which hands out ``SCAN_CONCURRENCY`` slots:
+
+* by priority class: interactive (a user waiting on the request), then
+  webhook-triggered, then scheduled/background scans;
+* within a class, cheapest first, using the repository size as cost;
+* subject to per-user and per-installation caps, so one user or one large
+  org cannot take every slot;
+* with ``SCAN_INTERACTIVE_RESERVED`` slots that only interactive scans may
+  use, so a user never waits behind a full set of long background scans.
+
+Waiting scans are promoted one class every ``SCAN_AGING_SECONDS`` so
+background work is delayed, never starved. Queued and running scans can
+be cancelled by analysis id through ``cancellation.scan_cancellations``.
+
+With ``SCAN_EXECUTION=worker`` the web process runs no scans itself: jobs
+are written to the ``scan_queue`` table and run by ``worker.py``
+processes, each with its own scheduler, concurrency and memory limits.
+"""
+import os
+import enum
+import time
+import uuid
+import asyncio
+import itertools
+import logging
+import threading
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import aiohttp
+
+from cache import response_cache
+from cancellation import ScanCancelled, scan_cancellations
+from models import db, AnalysisResult, QueuedScan
+from scan_status import scan_status
+from scanner import (
+    ScanConfig,
+    fetch_repository,
+    list_installation_repositories,
+    resolve_head_sha,
+    ruleset_digest,
+    scan_repository_handler
+)
+
+logger = logging.getLogger(__name__)
+
+SCAN_CONCURRENCY = int(os.getenv('SCAN_CONCURRENCY', '2'))
+SCAN_PER_INSTALLATION = int(os.getenv('SCAN_PER_INSTALLATION', '1'))
+SCAN_PER_USER = int(os.getenv('SCAN_PER_USER', '1'))
+SCAN_INTERACTIVE_RESERVED = int(os.getenv('SCAN_INTERACTIVE_RESERVED', '1'))
+SCAN_AGING_SECONDS = int(os.getenv('SCAN_AGING_SECONDS', '600'))
+HEAD_LOOKUP_CONCURRENCY = int(os.getenv('HEAD_LOOKUP_CONCURRENCY', '10'))
+SCAN_TIMEOUT_SECONDS = int(os.getenv('SCAN_TIMEOUT_SECONDS', '300'))
+
+# 'inline': scans run on this process's scheduler loop;
+# 'worker': scans are queued in the database for worker.py
+SCAN_EXECUTION = os.getenv('SCAN_EXECUTION', 'inline').lower()
+
+# Configure scanner for Render free tier. Interactive and batch scans use
+# the same settings, so their ruleset digests match and each reuses the
+# other's results.
+INTERACTIVE_SCAN_CONFIG = ScanConfig(
+    max_file_size_mb=25,
+    max_total_size_mb=250,
+    max_memory_mb=450,
+    timeout_seconds=300,
+    file_timeout_seconds=30,
+    max_retries=2,
+    concurrent_processes=1
+)
+
+
+def queued_for_workers() -> bool:
+    return SCAN_EXECUTION == 'worker'
+
+# Installation tokens live for an hour; mint a new one this long before expiry
+TOKEN_REFRESH_MARGIN = timedelta(minutes=5)
+
+
+class InstallationToken:
+    """Installation access token minted once and reused until close to expiry"""
+
+    def __init__(self, mint: Callable[[], object]):
+        self._mint = mint
+        self._lock = threading.Lock()
+        self._token = None
+        self._expires_at = None
+
+    def get(self) -> str:
+        with self._lock:
+            now = datetime.now(timezone.utc)
+            if self._token is None or (
+                self._expires_at is not None and self._expires_at - TOKEN_REFRESH_MARGIN <= now
+            ):
+                access = self._mint()
+                expires_at = getattr(access, 'expires_at', None)
+                if expires_at is not None and expires_at.tzinfo is None:
+                    expires_at = expires_at.replace(tzinfo=timezone.utc)
+                self._token = access.token
+                self._expires_at = expires_at
+            return self._token
+
+
+class Priority(enum.IntEnum):
+    """Scan priority classes, most urgent first"""
+    INTERACTIVE = 0
+    WEBHOOK = 1
+    SCHEDULED = 2
+
+
+@dataclass
+class Ticket:
+    """A request for a scan slot"""
+    priority: Priority
+    user_id: Optional[str]
+    installation_id: Optional[str]
+    cost_mb: float
+    sequence: int
+    enqueued_at: float = field(default_factory=time.monotonic)
+    granted: Optional[asyncio.Future] = None
+
+    def sort_key(self, now: float):
+        promoted = int((now - self.enqueued_at) // SCAN_AGING_SECONDS) if SCAN_AGING_SECONDS > 0 else 0
+        return (max(Priority.INTERACTIVE, self.priority - promoted), self.cost_mb, self.sequence)
+
+
+class AdmissionQueue:
+    """
+    Grants scan slots by priority class and estimated cost within per-user
+    and per-installation caps. Must only be used from one event loop.
+    """
+
+    def __init__(self, slots: int = SCAN_CONCURRENCY, per_user: int = SCAN_PER_USER,
+                 per_installation: int = SCAN_PER_INSTALLATION,
+                 interactive_reserved: int = SCAN_INTERACTIVE_RESERVED):
+        self.slots = max(1, slots)
+        self.per_user = max(1, per_user)
+        self.per_installation = max(1, per_installation)
+        # Always leave at least one slot for background work
+        self.interactive_reserved = min(max(0, interactive_reserved), self.slots - 1)
+        self._waiting: List[Ticket] = []
+        self._running: List[Ticket] = []
+        self._sequence = itertools.count()
+
+    def _count(self, attribute: str, value) -> int:
+        return sum(1 for ticket in self._running if getattr(ticket, attribute) == value)
+
+    def _admissible(self, ticket: Ticket) -> bool:
+        if len(self._running) >= self.slots:
+            return False
+        if ticket.priority != Priority.INTERACTIVE:
+            background = sum(1 for t in self._running if t.priority != Priority.INTERACTIVE)
+            if background >= self.slots - self.interactive_reserved:
+                return False
+        if ticket.user_id is not None and self._count('user_id', ticket.user_id) >= self.per_user:
+            return False
+        if (ticket.installation_id is not None
+                and self._count('installation_id', ticket.installation_id) >= self.per_installation):
+            return False
+        return True
+
+    def _dispatch(self) -> None:
+        now = time.monotonic()
+        self._waiting.sort(key=lambda ticket: ticket.sort_key(now))
+        for ticket in list(self._waiting):
+            if len(self._running) >= self.slots:
+                break
+            if ticket.granted.done():
+                self._waiting.remove(ticket)
+                continue
+            if self._admissible(ticket):
+                self._waiting.remove(ticket)
+                self._running.append(ticket)
+                ticket.granted.set_result(True)
+
+    async def acquire(self, priority: Priority, user_id: Optional[str] = None,
+                      installation_id: Optional[str] = None, cost_mb: float = 0) -> Ticket:
+        ticket = Ticket(
+            priority=Priority(priority),
+            user_id=user_id,
+            installation_id=str(installation_id) if installation_id is not None else None,
+            cost_mb=cost_mb or 0,
+            sequence=next(self._sequence),
+            granted=asyncio.get_running_loop().create_future()
+        )
+        self._waiting.append(ticket)
+        self._dispatch()
+        try:
+            await ticket.granted
+        except BaseException:
+            if ticket in self._waiting:
+                self._waiting.remove(ticket)
+            elif ticket in self._running:
+                self.release(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket: Ticket) -> None:
+        if ticket in self._running:
+            self._running.remove(ticket)
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority, user_id: Optional[str] = None,
+                   installation_id: Optional[str] = None, cost_mb: float = 0):
+        ticket = await self.acquire(priority, user_id, installation_id, cost_mb)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def stats(self) -> Dict:
+        return {
+            'slots': self.slots,
+            'running': len(self._running),
+            'waiting': len(self._waiting),
+            'waiting_by_priority': {
+                priority.name.lower(): sum(1 for t in self._waiting if t.priority == priority)
+                for priority in Priority
+            }
+        }
+
+
+@dataclass
+class RepositoryHead:
+    """Current default-branch head of a repository"""
+    full_name: str
+    default_branch: Optional[str] = None
+    head_sha: Optional[str] = None
+    size_mb: float = 0
+    error: Optional[str] = None
+    # GitHub metadata of the repository, handed to the scan's size check
+    info: Optional[Dict] = None
+
+
+@dataclass
+class ScanJob:
+    """One queued repository scan"""
+    analysis_id: int
+    repository: str
+    installation_id: str
+    user_id: str
+    token: InstallationToken
+    head_sha: Optional[str] = None
+    batch_id: Optional[str] = None
+    priority: Priority = Priority.SCHEDULED
+    cost_mb: float = 0
+    repository_info: Optional[Dict] = None
+
+
+class ScanScheduler:
+    """Runs scans on a background event loop behind an admission queue"""
+
+    def __init__(self):
+        self.app = None
+        self.admission = None
+        self.scan_config: ScanConfig = INTERACTIVE_SCAN_CONFIG
+        self._admission_options: Dict = {}
+        self._loop = None
+        self._thread = None
+        self._session = None
+        self._watcher = None
+        self._start_lock = threading.Lock()
+
+    def init_app(self, app) -> None:
+        self.app = app
+
+    def configure(self, scan_config: Optional[ScanConfig] = None, **admission) -> None:
+        """
+        Scanner settings and ``AdmissionQueue`` options for this process;
+        must be called before the scheduler starts
+        """
+        if self._loop is not None:
+            raise RuntimeError('Scan scheduler already started')
+        if scan_config is not None:
+            self.scan_config = scan_config
+        self._admission_options = admission
+
+    def _open_resources(self) -> None:
+        """Create the loop-bound state; runs on the scheduler loop"""
+        self.admission = AdmissionQueue(**self._admission_options)
+        self._session = aiohttp.ClientSession()
+        self._watcher = asyncio.ensure_future(scan_cancellations.watch())
+
+    async def start(self) -> None:
+        """Run the scheduler on the running loop instead of a thread of its own"""
+        with self._start_lock:
+            if self._loop is not None:
+                raise RuntimeError('Scan scheduler already started')
+            self._open_resources()
+            self._loop = asyncio.get_running_loop()
+        logger.info(f"Scan scheduler started on the running loop: {self.admission.stats()}")
+
+    async def stop(self) -> None:
+        """Release what ``start`` opened; runs on the same loop"""
+        with self._start_lock:
+            watcher, session = self._watcher, self._session
+            self._loop = self._session = self._watcher = None
+        if watcher is not None:
+            watcher.cancel()
+        if session is not None:
+            await session.close()
+
+    def _ensure_started(self) -> None:
+        """Start the scheduler thread on first use (after any worker fork)"""
+        with self._start_lock:
+            if self._loop is not None and (self._thread is None or self._thread.is_alive()):
+                return
+
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            async def open_resources():
+                self._open_resources()
+
+            def run():
+                asyncio.set_event_loop(loop)
+                loop.run_until_complete(open_resources())
+                ready.set()
+                loop.run_forever()
+
+            self._loop = loop
+            self._thread = threading.Thread(target=run, name='scan-scheduler', daemon=True)
+            self._thread.start()
+            ready.wait()
+            logger.info(f"Scan scheduler started: {self.admission.stats()}")
+
+    def run(self, coro, timeout: Optional[float] = None):
+        """Run a coroutine on the scheduler loop and wait for its result; not from that loop"""
+        self._ensure_started()
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            coro.close()
+            raise RuntimeError('Blocking on the scan scheduler from its own loop; use run_async')
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result(timeout)
+
+    async def run_async(self, coro):
+        """
+        Await a coroutine running on the scheduler loop, from it or from
+        another loop. Cancelling the caller does not cancel the coroutine.
+        """
+        self._ensure_started()
+        if asyncio.get_running_loop() is self._loop:
+            return await asyncio.shield(asyncio.ensure_future(coro))
+        future = asyncio.run_coroutine_threadsafe(coro, self._loop)
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+    async def run_in_app_context(self, fn: Callable, *args):
+        """Run a blocking function that uses the database in a worker thread"""
+        def call():
+            with self.app.app_context():
+                return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(None, call)
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """HTTP session shared by all scans; use only on the scheduler loop"""
+        return self._session
+
+    async def admitted(self, coro_fn: Callable[[], Awaitable], priority: Priority,
+                       user_id: Optional[str] = None, installation_id: Optional[str] = None,
+                       cost_mb: float = 0, analysis_id: Optional[int] = None):
+        """
+        Await ``coro_fn()`` once the admission queue grants it a slot. With an
+        ``analysis_id`` the wait and the scan can be cancelled, which raises
+        ``ScanCancelled``.
+        """
+        if analysis_id is None:
+            async with self.admission.slot(priority, user_id, installation_id, cost_mb):
+                return await coro_fn()
+
+        with scan_cancellations.active(analysis_id) as cancel:
+            try:
+                async with self.admission.slot(priority, user_id, installation_id, cost_mb):
+                    return await coro_fn()
+            except asyncio.CancelledError:
+                if not cancel.cancelled:
+                    raise
+                cancel.consume()
+                raise ScanCancelled(cancel.reason) from None
+
+    async def repository_info(self, token: str, full_name: str) -> Optional[Dict]:
+        """GitHub metadata of a repository, or None if it could not be fetched"""
+        try:
+            return await fetch_repository(self._session, token, full_name)
+        except Exception as e:
+            logger.warning(f"Could not estimate size of {full_name}: {str(e)}")
+            return None
+
+    async def repository_size_mb(self, token: str, full_name: str) -> float:
+        """Repository size used as the cost estimate of its scan; 0 if unknown"""
+        info = await self.repository_info(token, full_name)
+        return info.get('size', 0) / 1024 if info else 0
+
+    def submit(self, job: ScanJob):
+        """Queue a scan; returns a concurrent future for its completion"""
+        self._ensure_started()
+        return asyncio.run_coroutine_threadsafe(self._run_job(job), self._loop)
+
+    async def resolve_heads(self, token: str,
+                            repositories: Optional[List[str]] = None) -> List[RepositoryHead]:
+        """Head SHAs of the given repositories, or of every repository of the installation"""
+        if repositories is None:
+            listed = await list_installation_repositories(self._session, token)
+            candidates = [(repo['full_name'], repo) for repo in listed]
+        else:
+            candidates = [(full_name, None) for full_name in repositories]
+
+        lookups = asyncio.Semaphore(HEAD_LOOKUP_CONCURRENCY)
+
+        async def resolve(full_name: str, info: Optional[Dict]) -> RepositoryHead:
+            async with lookups:
+                branch = info.get('default_branch') if info else None
+                size_mb = info.get('size', 0) / 1024 if info else 0
+                try:
+                    if info is None:
+                        info = await fetch_repository(self._session, token, full_name)
+                        branch = info.get('default_branch')
+                        size_mb = info.get('size', 0) / 1024
+                    head_sha = await resolve_head_sha(self._session, token, full_name, branch)
+                    return RepositoryHead(full_name, branch, head_sha, size_mb, info=info)
+                except Exception as e:
+                    logger.warning(f"Could not resolve head of {full_name}: {str(e)}")
+                    return RepositoryHead(full_name, branch, size_mb=size_mb, error=str(e))
+
+        return list(await asyncio.gather(*(resolve(*candidate) for candidate in candidates)))
+
+    def schedule_batch(self, installation_id: str, user_id: str, token: InstallationToken,
+                       repositories: Optional[List[str]] = None,
+                       priority: Priority = Priority.SCHEDULED) -> Dict:
+        """
+        Queue scans for many repositories of one installation. Repositories
+        already analysed (or being analysed) at their current head with the
+        current ruleset are skipped. Must run inside an application context.
+        """
+        if repositories is not None:
+            repositories = list(dict.fromkeys(repositories))
+        heads = self.run(self.resolve_heads(token.get(), repositories))
+
+        digest = ruleset_digest(self.scan_config.ruleset, self.scan_config.engines)
+        resolved = {head.full_name: head.head_sha for head in heads if head.head_sha}
+        current = AnalysisResult.completed_at(resolved, digest)
+        running = AnalysisResult.in_flight_at(resolved, digest)
+
+        batch_id = uuid.uuid4().hex
+        queued, skipped, failed = [], [], []
+        pending = []
+        for head in heads:
+            if head.error:
+                failed.append({'repository': head.full_name, 'error': head.error})
+                continue
+            existing = current.get(head.full_name)
+            reason = 'unchanged'
+            if existing is None:
+                existing = running.get(head.full_name)
+                reason = 'in_progress'
+            if existing is not None:
+                skipped.append({
+                    'repository': head.full_name,
+                    'analysis_id': existing.id,
+                    'commit_sha': existing.commit_sha,
+                    'reason': reason
+                })
+                continue
+            analysis = AnalysisResult(
+                repository_name=head.full_name,
+                user_id=user_id,
+                status='pending',
+                commit_sha=head.head_sha,
+                ruleset_digest=digest
+            )
+            db.session.add(analysis)
+            pending.append((analysis, head))
+
+        if queued_for_workers():
+            db.session.flush()
+            for analysis, head in pending:
+                QueuedScan.enqueue(
+                    analysis.id,
+                    head.full_name,
+                    installation_id,
+                    user_id,
+                    priority,
+                    head_sha=head.head_sha,
+                    cost_mb=head.size_mb,
+                    batch_id=batch_id
+                )
+        db.session.commit()
+
+        for analysis, head in pending:
+            scan_status.update(analysis.id, 'queued', batch_id=batch_id)
+            if not queued_for_workers():
+                self.submit(ScanJob(
+                    analysis_id=analysis.id,
+                    repository=head.full_name,
+                    installation_id=str(installation_id),
+                    user_id=user_id,
+                    token=token,
+                    head_sha=head.head_sha,
+                    batch_id=batch_id,
+                    priority=priority,
+                    cost_mb=head.size_mb,
+                    repository_info=head.info
+                ))
+            queued.append({
+                'repository': head.full_name,
+                'analysis_id': analysis.id,
+                'commit_sha': head.head_sha
+            })
+
+        logger.info(
+            f"Batch {batch_id} for installation {installation_id}: {len(queued)} queued, "
+            f"{len(skipped)} unchanged, {len(failed)} unresolved"
+        )
+        return {'batch_id': batch_id, 'queued': queued, 'skipped': skipped, 'failed': failed}
+
+    async def _run_job(self, job: ScanJob) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            results = await self.admitted(
+                lambda: self._scan(job),
+                job.priority,
+                user_id=job.user_id,
+                installation_id=job.installation_id,
+                cost_mb=job.cost_mb,
+                analysis_id=job.analysis_id
+            )
+        except ScanCancelled as e:
+            logger.info(f"Scan of {job.repository} cancelled: {str(e)}")
+            results = {
+                'success': False,
+                'cancelled': True,
+                'error': {'message': str(e), 'code': 'SCAN_CANCELLED'}
+            }
+        await loop.run_in_executor(None, self._record, job, results)
+
+    async def _scan(self, job: ScanJob) -> Dict:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._mark_in_progress, job)
+        report = scan_status.reporter(job.analysis_id)
+        report('started')
+        try:
+            token = await loop.run_in_executor(None, job.token.get)
+            return await asyncio.wait_for(
+                scan_repository_handler(
+                    repo_url=f"https://github.com/{job.repository}.git",
+                    installation_token=token,
+                    user_id=job.user_id,
+                    http_session=self._session,
+                    progress=report,
+                    config=self.scan_config,
+                    # Fetched while resolving heads; the size check reuses it
+                    repository=job.repository_info
+                ),
+                timeout=SCAN_TIMEOUT_SECONDS
+            )
+        except asyncio.TimeoutError:
+            return {
+                'success': False,
+                'error': {'message': f'Scan timed out after {SCAN_TIMEOUT_SECONDS} seconds'}
+            }
+        except Exception as e:
+            logger.error(f"Scan job error for {job.repository}: {str(e)}")
+            return {'success': False, 'error': {'message': str(e)}}
+
+    def _mark_in_progress(self, job: ScanJob) -> None:
+        with self.app.app_context():
+            analysis = db.session.get(AnalysisResult, job.analysis_id)
+            if analysis is not None:
+                analysis.status = 'in_progress'
+                db.session.commit()
+
+    def _record(self, job: ScanJob, results: Dict) -> None:
+        with self.app.app_context():
+            analysis = db.session.get(AnalysisResult, job.analysis_id)
+            if analysis is None:
+                return
+            try:
+                if results.get('success'):
+                    analysis.mark_completed(results['data'])
+                else:
+                    analysis.status = 'cancelled' if results.get('cancelled') else 'failed'
+                    analysis.error = str(results.get('error', {}).get('message', 'Unknown error'))
+                db.session.commit()
+            except Exception as e:
+                logger.error(f"Failed to store results for {job.repository}: {str(e)}")
+                db.session.rollback()
+                analysis.status = 'failed'
+                analysis.error = str(e)
+                db.session.commit()
+                scan_status.update(analysis.id, 'failed')
+                return
+
+            if analysis.status == 'completed':
+                response_cache.invalidate_repository(job.repository)
+            scan_status.update(analysis.id, analysis.status)
+            logger.info(f"Analysis {analysis.id} of {job.repository} finished: {analysis.status}")
+
+
+scan_scheduler = ScanScheduler()
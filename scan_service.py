@@ -0,0 +1,493 @@
+# scan_service.py
+"""
+The interactive scan flow behind ``POST /api/v1/analysis/scan``.
+
+A request for a repository at a known head commit reuses an identical
+earlier analysis, joins a scan of the same commit already running in this
+or another worker, or runs a new scan through the scheduler's admission
+queue; with ``SCAN_EXECUTION=worker`` the scan is queued for a scan worker
+instead and the request waits for its outcome. The flow exists twice: blocking, for the Flask route, and as
+coroutines for the ASGI service, which waits for the scan without holding
+a thread. Both share the database steps below and run the scan itself on
+the scheduler loop.
+"""
+import time
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+import async_db
+from cache import response_cache
+from cancellation import ScanCancelled
+from models import db, AnalysisResult, QueuedScan
+from scan_jobs import Priority, queued_for_workers, scan_scheduler
+from scan_status import scan_status
+from scanner import scan_repository_handler
+from single_flight import AsyncSingleFlight, SingleFlight, advisory_lock, async_advisory_lock
+
+logger = logging.getLogger(__name__)
+
+# Duplicate scan requests wait at most this long for the scan they joined
+SCAN_WAIT_SECONDS = 330
+
+scan_flights = SingleFlight()
+async_scan_flights = AsyncSingleFlight()
+
+Response = Tuple[Dict, int]
+
+def parse_scan_request(payload) -> Tuple[Optional[Dict], Optional[Response]]:
+    """Validated fields of a scan request body; returns (fields, error response)"""
+    # Required fields including user_id
+    required_fields = ['owner', 'repo', 'installation_id', 'user_id']
+    missing_fields = [field for field in required_fields if field not in payload]
+
+    if missing_fields:
+        return None, ({
+            'success': False,
+            'error': {
+                'message': f'Missing required fields: {", ".join(missing_fields)}',
+                'code': 'MISSING_REQUIRED_FIELDS'
+            }
+        }, 400)
+
+    # Validate field values
+    owner = str(payload['owner']).strip()
+    repo = str(payload['repo']).strip()
+    installation_id = str(payload['installation_id']).strip()
+    user_id = str(payload['user_id']).strip()
+
+    if not all([owner, repo, installation_id, user_id]):
+        return None, ({
+            'success': False,
+            'error': {
+                'message': 'All required fields must have non-empty values',
+                'code': 'INVALID_FIELD_VALUES'
+            }
+        }, 400)
+
+    repo_name = f"{owner}/{repo}"
+    return {
+        'repo_name': repo_name,
+        'repo_url': f"https://github.com/{repo_name}.git",
+        'installation_id': installation_id,
+        'user_id': user_id
+    }, None
+
+
+def github_auth_error(error: Exception) -> Response:
+    return {
+        'success': False,
+        'error': {
+            'message': 'Invalid installation ID or GitHub authentication failed',
+            'code': 'GITHUB_AUTH_ERROR',
+            'details': str(error)
+        }
+    }, 401
+
+
+def flight_key(repo_name: str, head_sha: str, digest: str) -> str:
+    """Identical requests (same repository, commit and rules) share one scan"""
+    return f"scan:{repo_name}@{head_sha}:{digest}"
+
+
+def unexpected_error(error: Exception) -> Response:
+    return {
+        'success': False,
+        'error': {
+            'message': 'Unexpected error processing scan request',
+            'code': 'UNEXPECTED_ERROR',
+            'details': str(error)
+        }
+    }, 500
+
+
+def completed_scan_payload(analysis, message, document=None, **extra):
+    """Response body for a completed analysis"""
+    document = document if document is not None else analysis.document
+    summary = document['summary']
+    return {
+        'success': True,
+        'data': {
+            'analysis_id': analysis.id,
+            'repository': analysis.repository_name,
+            'status': 'completed',
+            'message': message,
+            'commit_sha': analysis.commit_sha,
+            **extra,
+            'metadata': {
+                'timestamp': datetime.now().isoformat(),
+                'duration_seconds': document['metadata'].get('scan_duration_seconds', 0)
+            },
+            'summary': {
+                'total_findings': summary['total_findings'],
+                'files_scanned': summary['files_scanned'],
+                'severity_counts': summary['severity_counts'],
+                'category_counts': summary['category_counts']
+            }
+        }
+    }
+
+
+def _in_progress_payload(analysis) -> Response:
+    return {
+        'success': True,
+        'data': {
+            'analysis_id': analysis.id,
+            'repository': analysis.repository_name,
+            'status': analysis.status,
+            'message': 'Analysis is still in progress'
+        }
+    }, 202
+
+
+def _finished_payload(analysis) -> Optional[Response]:
+    """Response for a failed or cancelled analysis; None otherwise"""
+    if analysis is None or analysis.status == 'failed':
+        return {
+            'success': False,
+            'error': {
+                'message': analysis.error if analysis else 'Analysis disappeared',
+                'code': 'SCAN_ERROR'
+            }
+        }, 500
+    if analysis.status == 'cancelled':
+        return {
+            'success': False,
+            'error': {
+                'message': 'Scan was cancelled',
+                'code': 'SCAN_CANCELLED',
+                'details': analysis.error
+            }
+        }, 409
+    return None
+
+
+# Database steps; they run inside an application context
+
+
+def reuse_analysis(previous_id: int, repo_name: str, user_id: str) -> Response:
+    """Record a new analysis completed with the results of an identical earlier one"""
+    previous = db.session.get(AnalysisResult, previous_id)
+    analysis = AnalysisResult(repository_name=repo_name, user_id=user_id, status='in_progress')
+    db.session.add(analysis)
+    analysis.reuse_results_of(previous)
+    db.session.commit()
+    response_cache.invalidate_repository(repo_name)
+    logger.info(f"{repo_name} unchanged at {previous.commit_sha}; reused analysis {previous.id}")
+    return completed_scan_payload(
+        analysis,
+        'Repository unchanged since last analysis; results reused',
+        reused_analysis_id=previous.id
+    ), 200
+
+
+def start_analysis(repo_name: str, user_id: str, head_sha: Optional[str] = None,
+                   digest: Optional[str] = None) -> Tuple[Optional[int], Optional[Response]]:
+    """Create the analysis record of a new scan; returns (analysis id, error response)"""
+    try:
+        analysis = AnalysisResult(
+            repository_name=repo_name,
+            user_id=user_id,
+            status='pending',
+            commit_sha=head_sha,
+            ruleset_digest=digest,
+            results=None,
+            error=None
+        )
+        db.session.add(analysis)
+        db.session.commit()
+        logger.info(f"Created analysis record {analysis.id} for {repo_name}")
+
+        # Update to in_progress after creation
+        analysis.status = 'in_progress'
+        db.session.commit()
+        scan_status.update(analysis.id, 'queued')
+        return analysis.id, None
+
+    except Exception as db_error:
+        logger.error(f"Database error: {str(db_error)}")
+        db.session.rollback()
+        return None, ({
+            'success': False,
+            'error': {
+                'message': 'Failed to create analysis record',
+                'code': 'DATABASE_ERROR',
+                'details': str(db_error)
+            }
+        }, 500)
+
+
+def finish_scan(analysis_id: int, repo_name: str, outcome) -> Response:
+    """Store the outcome of a scan: its results, or the exception it raised"""
+    analysis = db.session.get(AnalysisResult, analysis_id)
+    try:
+        if isinstance(outcome, ScanCancelled):
+            analysis.status = 'cancelled'
+            analysis.error = str(outcome)
+            db.session.commit()
+            scan_status.update(analysis.id, 'cancelled')
+
+            return {
+                'success': False,
+                'error': {
+                    'message': 'Scan was cancelled',
+                    'code': 'SCAN_CANCELLED',
+                    'details': str(outcome)
+                }
+            }, 409
+
+        if isinstance(outcome, asyncio.TimeoutError):
+            analysis.status = 'failed'
+            analysis.error = 'Scan timed out after 300 seconds'
+            db.session.commit()
+            scan_status.update(analysis.id, 'failed', error='timeout')
+
+            return {
+                'success': False,
+                'error': {
+                    'message': 'Scan timed out',
+                    'code': 'SCAN_TIMEOUT',
+                    'details': 'Repository scan exceeded time limit on Render free tier'
+                }
+            }, 504
+
+        if isinstance(outcome, BaseException):
+            raise outcome
+
+        if not outcome['success']:
+            analysis.status = 'failed'
+            analysis.error = str(outcome.get('error', {}).get('message', 'Unknown error'))
+            db.session.commit()
+            scan_status.update(analysis.id, 'failed')
+
+            return {
+                'success': False,
+                'error': outcome.get('error', {
+                    'message': 'Scan failed',
+                    'code': 'SCAN_ERROR'
+                })
+            }, 500
+
+        # Update analysis record with results
+        analysis.mark_completed(outcome.get('data'))
+        db.session.commit()
+        response_cache.invalidate_repository(repo_name)
+        scan_status.update(analysis.id, 'completed')
+
+        logger.info(f"Updated analysis record {analysis.id} with scan results")
+
+        return completed_scan_payload(analysis, 'Analysis completed successfully'), 200
+
+    except Exception as scan_error:
+        db.session.rollback()
+        analysis.status = 'failed'
+        analysis.error = str(scan_error)
+        db.session.commit()
+        scan_status.update(analysis.id, 'failed')
+
+        logger.error(f"Scan execution error: {str(scan_error)}")
+        return {
+            'success': False,
+            'error': {
+                'message': 'Scan execution failed',
+                'code': 'SCAN_EXECUTION_ERROR',
+                'details': str(scan_error)
+            }
+        }, 500
+
+
+def queue_scan(analysis_id: int, repo_name: str, installation_id: str, user_id: str,
+               head_sha: Optional[str], cost_mb: float) -> None:
+    """Hand an interactive scan to the scan workers"""
+    QueuedScan.enqueue(
+        analysis_id, repo_name, installation_id, user_id, Priority.INTERACTIVE,
+        head_sha=head_sha, cost_mb=cost_mb
+    )
+    db.session.commit()
+    logger.info(f"Queued analysis {analysis_id} of {repo_name} for a scan worker")
+
+
+async def execute_scan(analysis_id: int, repo_name: str, repo_url: str, installation_token: str,
+                       installation_id: str, user_id: str) -> Response:
+    """Scan and record the outcome; runs on the scheduler loop"""
+    report = scan_status.reporter(analysis_id)
+    repository = None
+
+    def start_scan():
+        report('started')
+        return asyncio.wait_for(
+            scan_repository_handler(
+                repo_url=repo_url,
+                installation_token=installation_token,
+                user_id=user_id,
+                http_session=scan_scheduler.session,
+                progress=report,
+                config=scan_scheduler.scan_config,
+                # Fetched for admission; the size check reuses it
+                repository=repository
+            ),
+            timeout=300  # 5 minutes total timeout
+        )
+
+    try:
+        # Interactive scans go through the same admission queue as background
+        # ones, ahead of them; the 5 minute limit starts once admitted
+        repository = await scan_scheduler.repository_info(installation_token, repo_name)
+        cost_mb = repository.get('size', 0) / 1024 if repository else 0
+        outcome = await scan_scheduler.admitted(
+            start_scan,
+            Priority.INTERACTIVE,
+            user_id=user_id,
+            installation_id=installation_id,
+            cost_mb=cost_mb,
+            analysis_id=analysis_id
+        )
+    except Exception as e:
+        outcome = e
+    return await scan_scheduler.run_in_app_context(finish_scan, analysis_id, repo_name, outcome)
+
+
+# Blocking flow, for the Flask route
+
+
+def run_scan(repo_name, repo_url, installation_token, installation_id, user_id,
+             head_sha=None, digest=None) -> Response:
+    """Create an analysis record and run the scan; returns (body, status)"""
+    analysis_id, error = start_analysis(repo_name, user_id, head_sha, digest)
+    if error:
+        return error
+    if queued_for_workers():
+        cost_mb = scan_scheduler.run(scan_scheduler.repository_size_mb(installation_token, repo_name))
+        queue_scan(analysis_id, repo_name, installation_id, user_id, head_sha, cost_mb)
+        return wait_for_analysis(analysis_id)
+    return scan_scheduler.run(execute_scan(
+        analysis_id, repo_name, repo_url, installation_token, installation_id, user_id
+    ))
+
+
+def scan_at_head(repo_name, repo_url, installation_token, installation_id, user_id,
+                 head_sha, digest, flight_key) -> Response:
+    """Reuse, join or run the scan of a repository at a known head commit"""
+    previous = AnalysisResult.completed_at({repo_name: head_sha}, digest).get(repo_name)
+    if previous is not None:
+        return reuse_analysis(previous.id, repo_name, user_id)
+
+    # Coalesce with scans running in other worker processes
+    with advisory_lock(db.engine, flight_key) as acquired:
+        in_flight = AnalysisResult.in_flight_at({repo_name: head_sha}, digest).get(repo_name)
+        if in_flight is None and not acquired:
+            in_flight = _wait_for_in_flight(repo_name, head_sha, digest)
+        if in_flight is not None:
+            logger.info(f"Joining in-flight analysis {in_flight.id} of {repo_name}@{head_sha}")
+            return wait_for_analysis(in_flight.id)
+
+        return run_scan(
+            repo_name, repo_url, installation_token, installation_id, user_id,
+            head_sha=head_sha, digest=digest
+        )
+
+
+def _wait_for_in_flight(repo_name, head_sha, digest, attempts=10, interval=0.5):
+    """The lock holder may not have committed its analysis row yet"""
+    for _ in range(attempts):
+        time.sleep(interval)
+        db.session.rollback()
+        in_flight = AnalysisResult.in_flight_at({repo_name: head_sha}, digest).get(repo_name)
+        if in_flight is not None:
+            return in_flight
+    return None
+
+
+def wait_for_analysis(analysis_id, timeout=SCAN_WAIT_SECONDS, interval=2.0) -> Response:
+    """Poll an analysis run by another worker until it finishes"""
+    deadline = time.monotonic() + timeout
+    while True:
+        db.session.rollback()
+        analysis = AnalysisResult.query.options(
+            AnalysisResult.header_only()
+        ).populate_existing().get(analysis_id)
+
+        finished = _finished_payload(analysis)
+        if finished:
+            return finished
+        if analysis.status == 'completed':
+            return completed_scan_payload(analysis, 'Analysis completed successfully'), 200
+        if time.monotonic() >= deadline:
+            return _in_progress_payload(analysis)
+        time.sleep(interval)
+
+
+# Async flow, for the ASGI service
+
+
+async def run_scan_async(repo_name, repo_url, installation_token, installation_id, user_id,
+                         head_sha=None, digest=None) -> Response:
+    """``run_scan`` without blocking a thread while the scan runs"""
+    analysis_id, error = await scan_scheduler.run_in_app_context(
+        start_analysis, repo_name, user_id, head_sha, digest
+    )
+    if error:
+        return error
+    if queued_for_workers():
+        cost_mb = await scan_scheduler.run_async(
+            scan_scheduler.repository_size_mb(installation_token, repo_name)
+        )
+        await scan_scheduler.run_in_app_context(
+            queue_scan, analysis_id, repo_name, installation_id, user_id, head_sha, cost_mb
+        )
+        return await wait_for_analysis_async(analysis_id)
+    return await scan_scheduler.run_async(execute_scan(
+        analysis_id, repo_name, repo_url, installation_token, installation_id, user_id
+    ))
+
+
+async def scan_at_head_async(repo_name, repo_url, installation_token, installation_id, user_id,
+                             head_sha, digest, flight_key) -> Response:
+    """``scan_at_head`` on the async session"""
+    heads = {repo_name: head_sha}
+    async with async_db.session_scope() as session:
+        previous = (await async_db.completed_at(session, heads, digest)).get(repo_name)
+    if previous is not None:
+        return await scan_scheduler.run_in_app_context(
+            reuse_analysis, previous.id, repo_name, user_id
+        )
+
+    async with async_advisory_lock(async_db.init_engine(), flight_key) as acquired:
+        in_flight = None
+        for attempt in range(1 if acquired else 11):
+            # The lock holder may not have committed its analysis row yet
+            if attempt:
+                await asyncio.sleep(0.5)
+            async with async_db.session_scope() as session:
+                in_flight = (await async_db.in_flight_at(session, heads, digest)).get(repo_name)
+            if in_flight is not None:
+                break
+        if in_flight is not None:
+            logger.info(f"Joining in-flight analysis {in_flight.id} of {repo_name}@{head_sha}")
+            return await wait_for_analysis_async(in_flight.id)
+
+        return await run_scan_async(
+            repo_name, repo_url, installation_token, installation_id, user_id,
+            head_sha=head_sha, digest=digest
+        )
+
+
+async def wait_for_analysis_async(analysis_id, timeout=SCAN_WAIT_SECONDS,
+                                  interval=2.0) -> Response:
+    """``wait_for_analysis`` without holding a thread"""
+    deadline = time.monotonic() + timeout
+    while True:
+        async with async_db.session_scope() as session:
+            analysis = await async_db.analysis_header(session, analysis_id)
+            finished = _finished_payload(analysis)
+            if finished:
+                return finished
+            if analysis.status == 'completed':
+                document = await async_db.document_of(session, analysis_id)
+                return completed_scan_payload(
+                    analysis, 'Analysis completed successfully', document=document
+                ), 200
+        if time.monotonic() >= deadline:
+            return _in_progress_payload(analysis)
+        await asyncio.sleep(interval)
@@ -0,0 +1,140 @@
+# scan_status.py
+"""
+Live progress of running scans.
+
+The scanner reports phase changes and progress counters (clone and
+checkout progress, files discovered, engines done, files done by the
+running engine, findings so far) through a reporter bound to an analysis
+id. Snapshots are kept in the response cache backend when one is
+configured, so any worker can serve them, and in process memory
+otherwise. Only the latest snapshot per analysis is kept. Writes to a
+shared backend go through one writer thread, so a reporter on an event
+loop never waits on a network round-trip and updates stay in order.
+"""
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+from cache import LocalBackend, create_backend, is_shared
+
+logger = logging.getLogger(__name__)
+
+# Phases in the order a scan goes through them; a scan fetches its files
+# either by cloning and checking out or by downloading a tarball
+PHASES = (
+    'queued', 'started', 'size_check', 'cloning', 'checkout', 'downloading', 'discovering',
+    'scanning', 'processing', 'completed', 'failed', 'cancelled'
+)
+FINAL_PHASES = ('completed', 'failed', 'cancelled')
+
+STATUS_TTL_SECONDS = int(os.getenv('SCAN_STATUS_TTL', '3600'))
+
+# Reporter signature: reporter(phase, **progress)
+ProgressReporter = Callable[..., None]
+
+
+def _on_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class ScanStatusStore:
+    """Latest progress snapshot per analysis"""
+
+    def __init__(self, backend=None, ttl: int = STATUS_TTL_SECONDS, prefix: str = 'scan-status'):
+        self.backend = backend or LocalBackend()
+        # Without a shared backend, snapshots are only visible in this process
+        self.shared = is_shared(self.backend)
+        self.ttl = ttl
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._writer = (
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix='scan-status')
+            if self.shared else None
+        )
+
+    def _key(self, analysis_id: int) -> str:
+        return f"{self.prefix}:{analysis_id}"
+
+    def get(self, analysis_id: int) -> Optional[Dict]:
+        try:
+            raw = self.backend.get(self._key(analysis_id))
+        except Exception as e:
+            logger.warning(f"Scan status backend get failed: {str(e)}")
+            return None
+        return json.loads(raw) if raw is not None else None
+
+    async def get_async(self, analysis_id: int) -> Optional[Dict]:
+        """``get`` for event loops; a shared backend is read in a thread"""
+        if not self.shared:
+            return self.get(analysis_id)
+        return await asyncio.to_thread(self.get, analysis_id)
+
+    def update(self, analysis_id: int, phase: Optional[str] = None, **progress) -> Dict:
+        """Merge progress counters into the snapshot, optionally moving to a new phase"""
+        if self._writer is None:
+            return self._update(analysis_id, phase, progress)
+        return self._writer.submit(self._update, analysis_id, phase, progress).result()
+
+    def _update(self, analysis_id: int, phase: Optional[str], progress: Dict) -> Dict:
+        with self._lock:
+            snapshot = self.get(analysis_id) or {
+                'analysis_id': analysis_id,
+                'phase': 'queued',
+                'progress': {},
+                'sequence': 0,
+                'started_at': datetime.utcnow().isoformat()
+            }
+            if phase is not None:
+                snapshot['phase'] = phase
+            snapshot['progress'].update(progress)
+            snapshot['sequence'] += 1
+            snapshot['updated_at'] = datetime.utcnow().isoformat()
+            try:
+                self.backend.set(self._key(analysis_id), json.dumps(snapshot, default=str), self.ttl)
+            except Exception as e:
+                logger.warning(f"Scan status backend set failed: {str(e)}")
+            return snapshot
+
+    def reporter(self, analysis_id: int, min_interval: float = 0.5) -> ProgressReporter:
+        """
+        Bind a reporter to an analysis. Updates without a phase change are
+        throttled to one per ``min_interval`` seconds; failures never
+        propagate into the scan. On an event loop, updates to a shared
+        backend are queued to the writer thread instead of awaited.
+        """
+        last = {'at': 0.0, 'pending': {}}
+
+        def send(phase: Optional[str], progress: Dict) -> None:
+            try:
+                self._update(analysis_id, phase, progress)
+            except Exception as e:
+                logger.warning(f"Failed to report scan progress: {str(e)}")
+
+        def report(phase: Optional[str] = None, **progress):
+            last['pending'].update(progress)
+            now = time.monotonic()
+            if phase is None and now - last['at'] < min_interval:
+                return
+            if self._writer is None:
+                send(phase, last['pending'])
+            elif _on_loop():
+                self._writer.submit(send, phase, last['pending'])
+            else:
+                self._writer.submit(send, phase, last['pending']).result()
+            last['at'] = now
+            last['pending'] = {}
+
+        return report
+
+
+scan_status = ScanStatusStore(create_backend())
@@ -1,19 +1,28 @@
 import os
+import re
+import hashlib
+import functools
 import subprocess
 import logging
 import json
 import psutil
-import tempfile
-import shutil
 import asyncio
+import threading
 import aiohttp
 import git
-from typing import Dict, List, Optional, Union
+from typing import Callable, Dict, Iterable, List, Optional, Union
 from dataclasses import dataclass, field
 from datetime import datetime
 from pathlib import Path
 from sqlalchemy.orm import Session
 
+from cancellation import run_process
+from engines import DEFAULT_ENGINES, ENGINES, create_engine
+from semgrep_output import summarize_findings, tally_findings
+from semgrep_rules import ruleset_cache
+from tarball_fetch import fetch_tarball
+from workspace import Workspace, workspaces
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s',
@@ -37,6 +46,20 @@ class ScanConfig:
     max_retries: int = 2
     concurrent_processes: int = 1
 
+    # Semgrep --config value; part of the digest that decides whether a
+    # repository at an already scanned commit needs a rescan
+    ruleset: str = os.getenv('SEMGREP_RULESET', 'auto')
+
+    # Scan engines to run, see engines.py; also part of the digest
+    engines: List[str] = field(default_factory=lambda: [
+        name.strip() for name in os.getenv('SCAN_ENGINES', ','.join(DEFAULT_ENGINES)).split(',')
+        if name.strip()
+    ])
+
+    # 'clone': shallow git clone; 'tarball': stream the GitHub tarball of
+    # the head commit, writing only files the scan will read
+    fetch_mode: str = os.getenv('SCAN_FETCH_MODE', 'clone')
+
     exclude_patterns: List[str] = field(default_factory=lambda: [
         '.git', '.svn', 'node_modules', 'vendor',
         'bower_components', 'packages', 'dist',
@@ -47,6 +70,55 @@ class ScanConfig:
         'coverage', 'test*', 'docs'
     ])
 
+@functools.lru_cache(maxsize=1)
+def semgrep_version() -> str:
+    """Installed semgrep version, looked up once per process"""
+    try:
+        result = subprocess.run(
+            ["semgrep", "--version"], capture_output=True, text=True, timeout=60
+        )
+        return result.stdout.strip() or 'unknown'
+    except Exception as e:
+        logger.warning(f"Could not determine semgrep version: {str(e)}")
+        return 'unknown'
+
+
+def ruleset_digest(ruleset: str, engines: Iterable[str] = DEFAULT_ENGINES,
+                   rules: Optional[str] = None) -> str:
+    """
+    Identity of the rules a scan runs: ruleset name, the content of the
+    rules it resolves to (``rules``, resolved here if not given) and the
+    semgrep version, plus the version of every engine besides semgrep
+    """
+    identity = ruleset
+    if 'semgrep' in engines:
+        if rules is None:
+            rules = ruleset_cache.resolve(ruleset)
+        identity += f"\0{ruleset_cache.rules_identity(rules)}\0{semgrep_version()}"
+    for name in sorted(set(engines) - set(DEFAULT_ENGINES)):
+        identity += f"\0{name}:{ENGINES[name].version if name in ENGINES else ''}"
+    return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+
+async def resolve_remote_head(repo_url: str, token: str, timeout: int = 30) -> str:
+    """Default-branch head SHA with a single ``git ls-remote``, without cloning"""
+    auth_url = repo_url.replace('https://', f'https://x-access-token:{token}@')
+    try:
+        returncode, stdout, stderr = await run_process(
+            "git", "ls-remote", auth_url, "HEAD",
+            timeout=timeout,
+            env={**os.environ, 'GIT_TERMINAL_PROMPT': '0'}
+        )
+    except asyncio.TimeoutError:
+        raise RuntimeError(f"git ls-remote timed out after {timeout}s")
+    if returncode != 0:
+        raise RuntimeError(f"git ls-remote failed: {stderr.decode().replace(token, '***')}")
+    fields = stdout.decode().split()
+    if not fields:
+        raise RuntimeError("git ls-remote returned no HEAD")
+    return fields[0]
+
+
 async def _run_semgrep_scan(self, target_dir: Path) -> Dict:
     """Chunked scanning for large repositories"""
     all_files = []
@@ -121,15 +193,9 @@ async def _scan_chunk(self, files: List[str]) -> List[Dict]:
             
         ] + files
 
-        process = await asyncio.create_subprocess_exec(
-            *cmd,
-            stdout=asyncio.subprocess.PIPE,
-            stderr=asyncio.subprocess.PIPE
-        )
-
-        stdout, stderr = await process.communicate()
+        returncode, stdout, stderr = await run_process(*cmd, timeout=self.config.chunk_timeout)
         
-        if process.returncode != 0:
+        if returncode != 0:
             logger.warning(f"Semgrep error: {stderr.decode()}")
             return []
             
@@ -142,15 +208,59 @@ async def _scan_chunk(self, files: List[str]) -> List[Dict]:
     except Exception as e:
         logger.error(f"Chunk scan error: {e}")
         return []
+_TRANSFER_SIZE = re.compile(r'([\d.]+)\s*(bytes|KiB|MiB|GiB)')
+_TRANSFER_UNITS = {'bytes': 1, 'KiB': 1024, 'MiB': 1024 ** 2, 'GiB': 1024 ** 3}
+
+
+class CloneProgress(git.RemoteProgress):
+    """Forward git clone progress (objects and bytes received) to a reporter"""
+
+    def __init__(self, report: Callable[..., None]):
+        super().__init__()
+        self._report = report
+
+    def update(self, op_code, cur_count, max_count=None, message=''):
+        progress = {
+            'clone_objects': int(cur_count or 0),
+            'clone_objects_total': int(max_count) if max_count else None
+        }
+        match = _TRANSFER_SIZE.search(message or '')
+        if match:
+            progress['clone_bytes'] = int(float(match.group(1)) * _TRANSFER_UNITS[match.group(2)])
+        self._report(**progress)
+
+
+_CHECKOUT_PROGRESS = re.compile(r'Updating files:\s+\d+%\s+\((\d+)/(\d+)\)')
+
+
+def checkout_progress_handler(report: Callable[..., None]) -> Callable[[str], None]:
+    """stderr line handler forwarding ``git checkout --progress`` file counts"""
+    def handle(line: str) -> None:
+        match = _CHECKOUT_PROGRESS.search(line)
+        if match:
+            report(checkout_files=int(match.group(1)), checkout_files_total=int(match.group(2)))
+    return handle
+
+
 class SecurityScanner:
     """Security scanner optimized for resource-constrained environments"""
     
-    def __init__(self, config: ScanConfig = ScanConfig(), db_session: Optional[Session] = None):
+    def __init__(self, config: ScanConfig = ScanConfig(), db_session: Optional[Session] = None,
+                 http_session: Optional[aiohttp.ClientSession] = None,
+                 progress: Optional[Callable[..., None]] = None):
         self.config = config
+        # progress(phase=None, **counters); see scan_status.ScanStatusStore.reporter
+        self._progress = progress
         self.db_session = db_session
+        self.workspace: Optional[Workspace] = None
         self.temp_dir = None
         self.repo_dir = None
-        self._session = None
+        self.commit_sha = None
+        # --config value the semgrep engine ran with; feeds the ruleset digest
+        self.rules: Optional[str] = None
+        # A session passed in by the caller is shared across scans and not closed here
+        self._session = http_session
+        self._owns_session = http_session is None
         self.scan_stats = {
             'start_time': None,
             'end_time': None,
@@ -163,31 +273,34 @@ class SecurityScanner:
             'findings_count': 0
         }
 
+    def _report(self, phase: Optional[str] = None, **progress) -> None:
+        if self._progress is not None:
+            self._progress(phase, **progress)
+
     async def __aenter__(self):
         await self._setup()
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         await self._cleanup()
-        if self._session and not self._session.closed:
-            await self._session.close()
 
     async def _setup(self):
-        """Initialize scanner resources"""
-        self.temp_dir = Path(tempfile.mkdtemp(prefix='scanner_'))
-        self._session = aiohttp.ClientSession()
-        logger.info(f"Created temporary directory: {self.temp_dir}")
+        """Initialize scanner resources; the workspace is chosen once the size is known"""
+        if self._owns_session:
+            self._session = aiohttp.ClientSession()
         self.scan_stats['start_time'] = datetime.now()
 
     async def _cleanup(self):
         """Cleanup scanner resources"""
         try:
-            if self.temp_dir and self.temp_dir.exists():
-                shutil.rmtree(self.temp_dir)
-                logger.info(f"Cleaned up temporary directory: {self.temp_dir}")
+            if self.workspace is not None:
+                # Deleted in the background; large checkouts take seconds
+                workspaces.release(self.workspace)
+                logger.info(f"Released {self.workspace.tier} workspace: {self.workspace.path}")
+                self.workspace = None
                 self.scan_stats['end_time'] = datetime.now()
             
-            if self._session and not self._session.closed:
+            if self._owns_session and self._session and not self._session.closed:
                 await self._session.close()
                 
         except Exception as e:
@@ -196,6 +309,7 @@ class SecurityScanner:
     async def _check_repository_size(self, repo_url: str, token: str) -> Dict:
         """Pre-check repository size using GitHub API"""
         try:
+            self._report('size_check')
             owner, repo = repo_url.split('github.com/')[-1].replace('.git', '').split('/')
             api_url = f"https://api.github.com/repos/{owner}/{repo}"
             headers = {
@@ -208,173 +322,213 @@ class SecurityScanner:
                     error_text = await response.text()
                     raise ValueError(f"Failed to get repository info: {error_text}")
                 
-                data = await response.json()
-                size_kb = data.get('size', 0)
-                size_mb = size_kb / 1024
-
-                return {
-                    'size_mb': size_mb,
-                    'is_compatible': size_mb <= self.config.max_total_size_mb,
-                    'language': data.get('language'),
-                    'default_branch': data.get('default_branch')
-                }
+                return self._size_info(await response.json())
                     
         except Exception as e:
             logger.error(f"Error checking repository size: {str(e)}")
             raise
 
-    async def _clone_repository(self, repo_url: str, token: str) -> Path:
+    def _size_info(self, data: Dict) -> Dict:
+        """Size check result from GitHub repository metadata"""
+        size_mb = data.get('size', 0) / 1024
+        self._report(size_mb=round(size_mb, 2))
+        return {
+            'size_mb': size_mb,
+            'is_compatible': size_mb <= self.config.max_total_size_mb,
+            'language': data.get('language'),
+            'default_branch': data.get('default_branch')
+        }
+
+    async def _clone_repository(self, repo_url: str, token: str,
+                                size_info: Optional[Dict] = None) -> Path:
         """Clone repository with size validation and optimizations"""
         try:
-            # Check repository size first
-            size_info = await self._check_repository_size(repo_url, token)
+            # Check repository size first, unless the caller already has
+            if size_info is None:
+                size_info = await self._check_repository_size(repo_url, token)
             if not size_info['is_compatible']:
                 raise ValueError(
                     f"Repository size ({size_info['size_mb']:.2f}MB) exceeds "
                     f"limit of {self.config.max_total_size_mb}MB"
                 )
 
-            self.repo_dir = self.temp_dir / f"repo_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-            auth_url = repo_url.replace('https://', f'https://x-access-token:{token}@')
-            
-            logger.info(f"Cloning repository to {self.repo_dir}")
-            
-            # Optimized clone options
-            git_options = [
-                '--depth=1',
-                '--single-branch',
-                '--no-tags',
-                f'--branch={size_info["default_branch"]}'
-            ]
-            
-            repo = git.Repo.clone_from(
-                auth_url,
-                self.repo_dir,
-                multi_options=git_options
-            )
+            fetch = self._fetch_tarball if self.config.fetch_mode == 'tarball' else self._fetch_clone
+            self.workspace = workspaces.acquire(size_info['size_mb'])
+            try:
+                await fetch(repo_url, token, size_info['default_branch'])
+            except RuntimeError as e:
+                # The GitHub size is only an estimate of the checkout
+                if not self.workspace.in_memory or 'No space left' not in str(e):
+                    raise
+                logger.warning(f"Memory workspace too small for {repo_url}; retrying on disk")
+                workspaces.release(self.workspace)
+                self.workspace = workspaces.acquire(size_info['size_mb'], in_memory=False)
+                await fetch(repo_url, token, size_info['default_branch'])
+
+            self._report('discovering')
+            self._report(files_discovered=await asyncio.to_thread(self._count_files, self.repo_dir))
 
             logger.info(f"Successfully cloned repository: {size_info['size_mb']:.2f}MB")
             return self.repo_dir
 
         except Exception as e:
-            if self.repo_dir and self.repo_dir.exists():
-                shutil.rmtree(self.repo_dir)
             raise RuntimeError(f"Repository clone failed: {str(e)}") from e
 
-    async def _run_semgrep_scan(self, target_dir: Path) -> Dict:
-        """Execute memory-conscious semgrep scan"""
-        try:
-            # Create .semgrepignore file
-            semgrepignore_path = target_dir / '.semgrepignore'
-            with open(semgrepignore_path, 'w') as f:
-                for pattern in self.config.exclude_patterns:
-                    f.write(f"{pattern}\n")
-
-            cmd = [
-                "semgrep",
-                "scan",
-                "--config", "auto",
-                "--json",
-                "--verbose",
-                "--metrics=on",
-                
-                # Resource limits
-                f"--max-memory={self.config.max_memory_mb}",
-                f"--jobs={self.config.concurrent_processes}",
-                f"--timeout={self.config.file_timeout_seconds}",
-                f"--timeout-threshold={self.config.max_retries}",
-                
-                # Optimization flags
-                "--no-git-ignore",
-                "--skip-unknown-extensions",
-                "--optimizations=all",
-                
-                str(target_dir)
-            ]
-
-            process = await asyncio.create_subprocess_exec(
-                *cmd,
-                stdout=asyncio.subprocess.PIPE,
-                stderr=asyncio.subprocess.PIPE,
-                cwd=str(target_dir)
-            )
+    async def _fetch_clone(self, repo_url: str, token: str, branch: str) -> None:
+        """Clone and check out the head of ``branch`` into the current workspace"""
+        self.temp_dir = self.workspace.path
+        self.repo_dir = self.temp_dir / f"repo_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        auth_url = repo_url.replace('https://', f'https://x-access-token:{token}@')
+
+        logger.info(f"Cloning repository to {self.repo_dir} ({self.workspace.tier} workspace)")
+        self._report('cloning', workspace=self.workspace.tier)
+
+        # Optimized clone options
+        git_options = [
+            '--depth=1',
+            '--single-branch',
+            '--no-tags',
+            f'--branch={branch}'
+        ]
+
+        # Fetch without checking out, then check out as a separate step,
+        # so both report progress and share the clone time limit
+        deadline = asyncio.get_running_loop().time() + self.config.timeout_seconds
+        await self._git(
+            "clone", "--progress", "--no-checkout", *git_options, "--", auth_url, str(self.repo_dir),
+            timeout=self.config.timeout_seconds,
+            on_stderr_line=(
+                CloneProgress(self._report).new_message_handler() if self._progress else None
+            ),
+            secret=token
+        )
 
-            try:
-                stdout, stderr = await asyncio.wait_for(
-                    process.communicate(),
-                    timeout=self.config.timeout_seconds
-                )
-            except asyncio.TimeoutError:
-                process.kill()
-                logger.error(f"Scan timed out after {self.config.timeout_seconds}s")
-                return self._create_empty_result(error="Scan timed out")
+        self._report('checkout')
+        await self._git(
+            "checkout", "--progress", "--force", "HEAD",
+            cwd=self.repo_dir,
+            timeout=max(1, deadline - asyncio.get_running_loop().time()),
+            on_stderr_line=checkout_progress_handler(self._report) if self._progress else None
+        )
+        self.commit_sha = (await self._git("rev-parse", "HEAD", cwd=self.repo_dir, timeout=30)).strip()
 
-            self.scan_stats['memory_usage_mb'] = psutil.Process().memory_info().rss / (1024 * 1024)
-            
-            stderr_output = stderr.decode() if stderr else ""
-            if stderr_output and not stderr_output.lower().startswith('running'):
-                logger.warning(f"Semgrep stderr: {stderr_output}")
+    async def _fetch_tarball(self, repo_url: str, token: str, branch: str) -> None:
+        """Extract the tarball of the head of ``branch`` into the current workspace"""
+        self.temp_dir = self.workspace.path
+        self.repo_dir = self.temp_dir / f"repo_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+        full_name = repo_url.split('github.com/')[-1].removesuffix('.git')
 
-            output = stdout.decode() if stdout else ""
-            if not output.strip():
-                return self._create_empty_result()
+        logger.info(f"Downloading tarball to {self.repo_dir} ({self.workspace.tier} workspace)")
+        self._report('downloading', workspace=self.workspace.tier)
+        # Pin the commit so the reported SHA is the one extracted
+        self.commit_sha = await resolve_head_sha(self._session, token, full_name, branch)
 
-            try:
-                results = json.loads(output)
-                return self._process_scan_results(results)
-            except json.JSONDecodeError as e:
-                logger.error(f"Failed to parse Semgrep JSON output: {str(e)}")
-                return self._create_empty_result(error="Invalid Semgrep output format")
+        loop = asyncio.get_running_loop()
+
+        def progress(**counters):
+            loop.call_soon_threadsafe(functools.partial(self._report, **counters))
 
+        # The extraction thread cannot be cancelled; it stops at its next read
+        stop = threading.Event()
+        try:
+            stats = await asyncio.wait_for(
+                asyncio.to_thread(
+                    fetch_tarball, full_name, self.commit_sha, token, self.repo_dir,
+                    self.config.exclude_patterns, self.config.max_file_size_mb,
+                    self.config.max_total_size_mb, progress if self._progress else None, stop
+                ),
+                timeout=self.config.timeout_seconds
+            )
         except Exception as e:
-            logger.error(f"Error in semgrep scan: {str(e)}")
-            return self._create_empty_result(error=str(e))
-        finally:
-            if semgrepignore_path.exists():
-                semgrepignore_path.unlink()
+            stop.set()
+            raise RuntimeError(f"Tarball download failed: {str(e)}") from e
+        except BaseException:
+            stop.set()
+            raise
+        self.scan_stats['files_skipped'] = stats['files_skipped']
+        self.scan_stats['files_too_large'] = stats['files_too_large']
+
+    async def _git(self, *args: str, cwd: Optional[Path] = None, timeout: Optional[float] = None,
+                   on_stderr_line: Optional[Callable[[str], None]] = None,
+                   secret: Optional[str] = None) -> str:
+        """
+        Run a git command in its own process group, so a cancelled or timed
+        out scan kills git and its helpers; returns its stdout
+        """
+        returncode, stdout, stderr = await run_process(
+            "git", *args,
+            timeout=timeout,
+            on_stderr_line=on_stderr_line,
+            cwd=str(cwd) if cwd else None,
+            env={**os.environ, 'GIT_TERMINAL_PROMPT': '0'}
+        )
+        if returncode != 0:
+            message = stderr.decode('utf-8', errors='replace')
+            if secret:
+                message = message.replace(secret, '***')
+            raise RuntimeError(f"git {args[0]} exited with {returncode}: {message.strip()}")
+        return stdout.decode('utf-8', errors='replace')
+
+    @staticmethod
+    def _count_files(root: Path) -> int:
+        total = 0
+        for _, dirnames, files in os.walk(root):
+            dirnames[:] = [name for name in dirnames if name != '.git']
+            total += len(files)
+        return total
+
+    async def _run_engines(self, target_dir: Path) -> Dict:
+        """Run the configured scan engines over the checkout and merge their findings"""
+        # Engines report files done within their own run; engines_done
+        # counts the engines that have finished
+        engines = [
+            create_engine(name, self.config, functools.partial(self._report, engine=name))
+            for name in self.config.engines
+        ]
+        self._report('scanning', engines_done=0, engines_total=len(engines))
+        findings = []
+        errors = []
+        for done, engine in enumerate(engines, 1):
+            try:
+                async for batch in engine.findings(target_dir):
+                    findings.extend(batch)
+                    self._report(findings=len(findings))
+            except Exception as e:
+                logger.error(f"Error in {engine.name} scan: {str(e)}")
+                errors.append(str(e))
+            if engine.name == 'semgrep':
+                self.rules = getattr(engine, 'rules', None)
+            self._report(engines_done=done)
+
+        self.scan_stats['memory_usage_mb'] = psutil.Process().memory_info().rss / (1024 * 1024)
+        self.scan_stats['engines'] = {engine.name: engine.timing.to_dict() for engine in engines}
+        logger.info(f"Engine timings: {self.scan_stats['engines']}")
+
+        self._report('processing')
+        results = self._build_results({
+            'findings': findings,
+            'total_files': max(engine.timing.files_scanned for engine in engines),
+            **tally_findings(findings)
+        })
+        if errors:
+            results['errors'] = errors
+        return results
 
     def _process_scan_results(self, results: Dict) -> Dict:
         """Process scan results with accurate file counting"""
-        findings = results.get('results', [])
-        stats = results.get('stats', {})
-        
-        processed_findings = []
-        severity_counts = {'CRITICAL': 0, 'HIGH': 0, 'MEDIUM': 0, 'LOW': 0, 'INFO': 0, 'WARNING': 0, 'ERROR': 0}
-        category_counts = {}
-        
-        # Track all files from semgrep stats
-        total_files = stats.get('total_files', 0)
-        files_with_findings = set()
-        
-        for finding in findings:
-            file_path = finding.get('path', '')
-            if file_path:
-                files_with_findings.add(file_path)
+        parsed = summarize_findings(results.get('results', []))
+        parsed['total_files'] = results.get('stats', {}).get('total_files', 0)
+        return self._build_results(parsed)
 
-            severity = finding.get('extra', {}).get('severity', 'INFO').upper()
-            category = finding.get('extra', {}).get('metadata', {}).get('category', 'security')
-            
-            severity_counts[severity] = severity_counts.get(severity, 0) + 1
-            category_counts[category] = category_counts.get(category, 0) + 1
-            
-            processed_findings.append({
-                'id': finding.get('check_id'),
-                'file': file_path,
-                'line_start': finding.get('start', {}).get('line'),
-                'line_end': finding.get('end', {}).get('line'),
-                'code_snippet': finding.get('extra', {}).get('lines', ''),
-                'message': finding.get('extra', {}).get('message', ''),
-                'severity': severity,
-                'category': category,
-                'cwe': finding.get('extra', {}).get('metadata', {}).get('cwe', []),
-                'owasp': finding.get('extra', {}).get('metadata', {}).get('owasp', []),
-                'fix_recommendations': finding.get('extra', {}).get('metadata', {}).get('fix', ''),
-                'references': finding.get('extra', {}).get('metadata', {}).get('references', [])
-            })
+    def _build_results(self, parsed: Dict) -> Dict:
+        """Scan results from ``semgrep_output.parse_output``"""
+        processed_findings = parsed['findings']
+        total_files = parsed['total_files']
+        self._report('processing', findings=len(processed_findings))
 
         self.scan_stats.update({
             'total_files': total_files,
-            'files_processed': len(files_with_findings),
+            'files_processed': parsed['files_with_findings'],
             'findings_count': len(processed_findings)
         })
 
@@ -382,39 +536,26 @@ class SecurityScanner:
             'findings': processed_findings,
             'stats': {
                 'total_findings': len(processed_findings),
-                'severity_counts': severity_counts,
-                'category_counts': category_counts,
+                'severity_counts': parsed['severity_counts'],
+                'category_counts': parsed['category_counts'],
+                'memory_usage_mb': self.scan_stats['memory_usage_mb'],
                 'scan_stats': {
                     **self.scan_stats,
                     'total_files_scanned': total_files,
-                    'files_with_findings': len(files_with_findings)
+                    'files_with_findings': parsed['files_with_findings']
                 }
             }
         }
-    def _create_empty_result(self, error: Optional[str] = None) -> Dict:
-        """Create empty result structure with optional error information"""
-        return {
-            'findings': [],
-            'stats': {
-                'total_findings': 0,
-                'severity_counts': {
-                    'CRITICAL': 0, 'HIGH': 0, 'MEDIUM': 0, 'LOW': 0, 'INFO': 0
-                },
-                'category_counts': {},
-                'scan_stats': self.scan_stats,
-                'memory_usage_mb': self.scan_stats['memory_usage_mb']
-            },
-            'errors': [error] if error else []
-        }
 
-    async def scan_repository(self, repo_url: str, installation_token: str, user_id: str) -> Dict:
+    async def scan_repository(self, repo_url: str, installation_token: str, user_id: str,
+                              size_info: Optional[Dict] = None) -> Dict:
         """Main method to scan a repository with comprehensive error handling"""
         try:
             # Clone the repository
-            repo_dir = await self._clone_repository(repo_url, installation_token)
+            repo_dir = await self._clone_repository(repo_url, installation_token, size_info)
             
-            # Run the semgrep scan
-            scan_results = await self._run_semgrep_scan(repo_dir)
+            # Run the scan engines
+            scan_results = await self._run_engines(repo_dir)
             
             return {
                 'success': True,
@@ -422,18 +563,25 @@ class SecurityScanner:
                     'repository': repo_url,
                     'user_id': user_id,
                     'timestamp': datetime.now().isoformat(),
+                    'commit_sha': self.commit_sha,
+                    'ruleset_digest': ruleset_digest(
+                        self.config.ruleset, self.config.engines, rules=self.rules
+                    ),
                     'findings': scan_results.get('findings', []),
                     'summary': {
                         'total_findings': scan_results.get('stats', {}).get('total_findings', 0),
                         'severity_counts': scan_results.get('stats', {}).get('severity_counts', {}),
                         'category_counts': scan_results.get('stats', {}).get('category_counts', {}),
                         'files_scanned': self.scan_stats['files_processed'],
+                        'semgrep_version': semgrep_version(),
                     },
                     'metadata': {
                         'scan_duration_seconds': (
                             datetime.now() - self.scan_stats['start_time']
                         ).total_seconds() if self.scan_stats['start_time'] else 0,
-                        'memory_usage_mb': scan_results.get('stats', {}).get('memory_usage_mb', 0)
+                        'memory_usage_mb': scan_results.get('stats', {}).get('memory_usage_mb', 0),
+                        # Stored with the analysis, to compare what each engine costs
+                        'engines': self.scan_stats.get('engines', {})
                     }
                 }
             }
@@ -455,9 +603,17 @@ async def scan_repository_handler(
     repo_url: str,
     installation_token: str,
     user_id: str,
-    db_session: Optional[Session] =None
+    db_session: Optional[Session] =None,
+    http_session: Optional[aiohttp.ClientSession] = None,
+    progress: Optional[Callable[..., None]] = None,
+    config: Optional[ScanConfig] = None,
+    repository: Optional[Dict] = None
 ) -> Dict:
-    """Handler function for web routes with input validation"""
+    """
+    Handler function for web routes with input validation. ``repository``
+    is GitHub's metadata of the repository if the caller already fetched
+    it; the size check then uses it instead of asking GitHub again.
+    """
     logger.info(f"Starting scan request for repository: {repo_url}")
     
     if not all([repo_url, installation_token, user_id]):
@@ -480,12 +636,16 @@ async def scan_repository_handler(
         }
 
     try:
-        config = ScanConfig()
+        config = config or ScanConfig()
         
-        async with SecurityScanner(config, db_session) as scanner:
+        async with SecurityScanner(config, db_session, http_session, progress) as scanner:
             try:
                 # Pre-check repository size
-                size_info = await scanner._check_repository_size(repo_url, installation_token)
+                if repository is not None:
+                    scanner._report('size_check')
+                    size_info = scanner._size_info(repository)
+                else:
+                    size_info = await scanner._check_repository_size(repo_url, installation_token)
                 if not size_info['is_compatible']:
                     return {
                         'success': False,
@@ -503,7 +663,8 @@ async def scan_repository_handler(
                 results = await scanner.scan_repository(
                     repo_url,
                     installation_token,
-                    user_id
+                    user_id,
+                    size_info=size_info
                 )
                 
                 if results.get('success'):
@@ -551,6 +712,48 @@ async def scan_repository_handler(
         }
 
 
+GITHUB_API_URL = 'https://api.github.com'
+
+
+def github_headers(token: str, accept: str = 'application/vnd.github.v3+json') -> Dict[str, str]:
+    return {'Authorization': f'Bearer {token}', 'Accept': accept}
+
+
+async def fetch_repository(session: aiohttp.ClientSession, token: str, full_name: str) -> Dict:
+    """Repository metadata (default branch, size, ...) from the GitHub API"""
+    async with session.get(f"{GITHUB_API_URL}/repos/{full_name}", headers=github_headers(token)) as response:
+        if response.status != 200:
+            raise ValueError(f"Failed to get repository info for {full_name}: {response.status}")
+        return await response.json()
+
+
+async def resolve_head_sha(session: aiohttp.ClientSession, token: str,
+                           full_name: str, branch: str) -> str:
+    """Current commit SHA of a branch, fetched as plain text in one request"""
+    url = f"{GITHUB_API_URL}/repos/{full_name}/commits/{branch}"
+    async with session.get(url, headers=github_headers(token, 'application/vnd.github.sha')) as response:
+        if response.status != 200:
+            raise ValueError(f"Failed to resolve {full_name}@{branch}: {response.status}")
+        return (await response.text()).strip()
+
+
+async def list_installation_repositories(session: aiohttp.ClientSession, token: str) -> List[Dict]:
+    """Every repository the installation token can access"""
+    repositories = []
+    page = 1
+    while True:
+        url = f"{GITHUB_API_URL}/installation/repositories?per_page=100&page={page}"
+        async with session.get(url, headers=github_headers(token)) as response:
+            if response.status != 200:
+                raise ValueError(f"Failed to list installation repositories: {response.status}")
+            data = await response.json()
+        batch = data.get('repositories', [])
+        repositories.extend(batch)
+        if len(batch) < 100 or len(repositories) >= data.get('total_count', 0):
+            return repositories
+        page += 1
+
+
 # Optional: Add helper functions for common operations
 def format_file_size(size_bytes: int) -> str:
     """Convert bytes to human readable format"""
@@ -595,133 +798,3 @@ def sort_findings_by_severity(findings: List[Dict]) -> List[Dict]:
         key=lambda x: get_severity_weight(x.get('severity', 'INFO')),
         reverse=True
     )
-
-from flask import Blueprint, request, jsonify
-from datetime import datetime
-from typing import Dict, List, Optional
-from sqlalchemy import desc
-
-analysis_bp = Blueprint('analysis', __name__, url_prefix='/api/v1/analysis')
-
-def format_finding(finding: Dict) -> Dict:
-    """Format a single finding for API response"""
-    return {
-        'id': finding.get('id'),
-        'file': finding.get('file'),
-        'line_start': finding.get('line_start'),
-        'line_end': finding.get('line_end'),
-        'severity': finding.get('severity', 'UNKNOWN'),
-        'category': finding.get('category', 'unknown'),
-        'message': finding.get('message'),
-        'code_snippet': finding.get('code_snippet'),
-        'cwe': finding.get('cwe', []),
-        'owasp': finding.get('owasp', []),
-        'fix_recommendations': finding.get('fix_recommendations'),
-        'references': finding.get('references', [])
-    }
-
-@analysis_bp.route('/<owner>/<repo>/result', methods=['GET'])
-def get_analysis_findings(owner: str, repo: str):
-    """Get detailed findings with filtering and pagination"""
-    try:
-        # Get query parameters
-        page = max(1, int(request.args.get('page', 1)))
-        per_page = min(100, max(1, int(request.args.get('limit', 10))))
-        severity = request.args.get('severity', '').upper()
-        category = request.args.get('category', '')
-        file_path = request.args.get('file', '')
-        
-        repo_name = f"{owner}/{repo}"
-        
-        # Get latest analysis result
-        result = AnalysisResult.query.filter_by(
-            repository_name=repo_name
-        ).order_by(
-            desc(AnalysisResult.timestamp)
-        ).first()
-        
-        if not result:
-            return jsonify({
-                'success': False,
-                'error': {
-                    'message': 'No analysis found',
-                    'code': 'ANALYSIS_NOT_FOUND'
-                }
-            }), 404
-
-        # Extract findings
-        findings = result.results.get('findings', [])
-        
-        # Apply filters
-        if severity:
-            findings = [f for f in findings if f.get('severity', '').upper() == severity]
-        if category:
-            findings = [f for f in findings if f.get('category', '').lower() == category.lower()]
-        if file_path:
-            findings = [f for f in findings if file_path in f.get('file', '')]
-        
-        # Get total count before pagination
-        total_findings = len(findings)
-        
-        # Apply pagination
-        start_idx = (page - 1) * per_page
-        end_idx = start_idx + per_page
-        paginated_findings = findings[start_idx:end_idx]
-        
-        # Get unique values for filters
-        all_severities = sorted(set(f.get('severity', '').upper() for f in findings))
-        all_categories = sorted(set(f.get('category', '').lower() for f in findings))
-        
-        return jsonify({
-            'success': True,
-            'data': {
-                'repository': {
-                    'name': repo_name,
-                    'owner': owner,
-                    'repo': repo
-                },
-                'metadata': {
-                    'analysis_id': result.id,
-                    'timestamp': result.timestamp.isoformat(),
-                    'status': result.status,
-                    'duration_seconds': result.results.get('stats', {}).get('scan_stats', {}).get('scan_duration')
-                },
-                'summary': {
-                    'files_scanned': result.results.get('stats', {}).get('scan_stats', {}).get('total_files_scanned', 0),
-                    'total_findings': total_findings,
-                    'severity_counts': result.results.get('stats', {}).get('severity_counts', {}),
-                    'category_counts': result.results.get('stats', {}).get('category_counts', {})
-                },
-                'findings': [format_finding(f) for f in paginated_findings],
-                'pagination': {
-                    'current_page': page,
-                    'total_pages': (total_findings + per_page - 1) // per_page,
-                    'total_items': total_findings,
-                    'per_page': per_page
-                },
-                'filters': {
-                    'available_severities': all_severities,
-                    'available_categories': all_categories,
-                }
-            }
-        })
-        
-    except ValueError as ve:
-        return jsonify({
-            'success': False,
-            'error': {
-                'message': str(ve),
-                'code': 'INVALID_PARAMETER'
-            }
-        }), 400
-        
-    except Exception as e:
-        logger.error(f"Error getting findings: {str(e)}")
-        return jsonify({
-            'success': False,
-            'error': {
-                'message': 'Internal server error',
-                'code': 'INTERNAL_ERROR'
-            }
-        }), 500
-    
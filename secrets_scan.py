@@ -0,0 +1,314 @@
+# secrets_scan.py
+"""
+Fast scan for credentials committed to a repository.
+
+Each candidate file is memory-mapped and every rule's compiled pattern
+runs over the whole mapping in C. The patterns of known credential
+formats start with a literal (``AKIA``, ``ghp_``, ...), which re skips to
+as fast as a substring search, so Python only sees actual matches. The
+case-insensitive rule for generic assignments (``password = "..."``)
+runs once per keyword the file contains and also requires the
+value's Shannon entropy to reach ``min_entropy``, which drops
+placeholders such as ``changeme``.
+
+Files are scanned in size-balanced batches in a pool of worker processes
+(``SECRETS_SCAN_WORKERS``, default one per CPU); trees under
+``SECRETS_SCAN_INLINE_MAX_BYTES`` are scanned in the calling thread.
+Findings have the processed shape of ``semgrep_output.summarize_findings``.
+"""
+import os
+import re
+import math
+import mmap
+import asyncio
+import logging
+import threading
+import multiprocessing
+from collections import Counter
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Dict, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+SCAN_WORKERS = int(os.getenv('SECRETS_SCAN_WORKERS', str(os.cpu_count() or 1)))
+# Smaller trees scan faster than a round trip to the pool
+INLINE_MAX_BYTES = int(os.getenv('SECRETS_SCAN_INLINE_MAX_BYTES', str(4 * 1024 * 1024)))
+# Upper bounds of one pool task
+BATCH_MAX_BYTES = 16 * 1024 * 1024
+BATCH_MAX_FILES = 500
+# Leading bytes checked for NUL to skip binary files
+BINARY_SNIFF_BYTES = 8192
+MAX_SNIPPET_CHARS = 500
+
+
+@dataclass(frozen=True)
+class SecretRule:
+    """A credential pattern and the metadata of its findings"""
+    id: str
+    # Starts with a literal, so re can skip through the file for it like a
+    # substring search
+    pattern: str
+    message: str
+    # Ignore matches that directly follow a word character
+    word_boundary: bool = True
+    # Lower-case pattern matched against the lower-cased file
+    ignore_case: bool = False
+    # With keywords, ``pattern`` contains KEYWORD and runs once for each
+    # keyword the file contains, with KEYWORD replaced by it
+    keywords: Tuple[str, ...] = ()
+    # Group holding the secret itself, for entropy and redaction
+    secret_group: int = 0
+    min_entropy: float = 0.0
+    # A private key header is not the secret; the key lines below it are
+    redact: bool = True
+    severity: str = 'ERROR'
+    category: str = 'security'
+    cwe: Tuple[str, ...] = ('CWE-798: Use of Hard-coded Credentials',)
+    owasp: Tuple[str, ...] = ('A07:2021 - Identification and Authentication Failures',)
+    fix: str = 'Revoke the credential and load it from the environment or a secret store.'
+    references: Tuple[str, ...] = ('https://cwe.mitre.org/data/definitions/798.html',)
+
+
+SECRET_RULES = (
+    SecretRule('secrets.aws-access-key-id', r'A[KS]IA[0-9A-Z]{16}(?![0-9A-Za-z])',
+               'AWS access key ID committed to the repository'),
+    SecretRule('secrets.github-token', r'gh[pousr]_[A-Za-z0-9]{36,255}|github_pat_[A-Za-z0-9_]{22,255}',
+               'GitHub token committed to the repository'),
+    SecretRule('secrets.slack-token', r'xox[abprs]-[A-Za-z0-9-]{10,}',
+               'Slack token committed to the repository'),
+    SecretRule('secrets.stripe-secret-key', r'sk_live_[0-9A-Za-z]{24,}',
+               'Stripe live secret key committed to the repository'),
+    SecretRule('secrets.stripe-restricted-key', r'rk_live_[0-9A-Za-z]{24,}',
+               'Stripe live restricted key committed to the repository'),
+    SecretRule('secrets.google-api-key', r'AIza[0-9A-Za-z_\-]{35}',
+               'Google API key committed to the repository'),
+    SecretRule('secrets.private-key',
+               r'-----BEGIN (?:RSA |EC |DSA |OPENSSH |PGP |ENCRYPTED )?PRIVATE KEY(?: BLOCK)?-----',
+               'Private key committed to the repository', redact=False),
+    SecretRule('secrets.generic-assignment',
+               r'KEYWORD[\w.-]*["\']?\s*(?::=|=>|[:=])\s*["\']([^"\'\s]{16,200})["\']',
+               'Hard-coded credential assigned in source',
+               word_boundary=False, ignore_case=True,
+               keywords=('passw', 'secret', 'api_key', 'apikey', 'token'),
+               secret_group=1, min_entropy=3.5),
+)
+
+
+def shannon_entropy(data: bytes) -> float:
+    """Bits per byte of ``data``"""
+    if not data:
+        return 0.0
+    total = len(data)
+    return -sum(count / total * math.log2(count / total) for count in Counter(data).values())
+
+
+def _is_word_byte(byte: int) -> bool:
+    return byte == 0x5f or 0x30 <= byte <= 0x39 or 0x41 <= byte <= 0x5a or 0x61 <= byte <= 0x7a
+
+
+class SecretMatcher:
+    """The compiled patterns and keyword prefilters of a set of rules"""
+
+    def __init__(self, rules: Sequence[SecretRule] = SECRET_RULES):
+        self.rules = tuple(rules)
+        # Per rule: (keyword or None, pattern); a keyword alternation in one
+        # pattern would lose re's literal prefix search
+        self.patterns = [
+            [(keyword.encode(), re.compile(rule.pattern.replace('KEYWORD', re.escape(keyword)).encode()))
+             for keyword in rule.keywords]
+            or [(None, re.compile(rule.pattern.encode()))]
+            for rule in self.rules
+        ]
+
+    def scan(self, data, relative: str) -> List[Dict]:
+        """Findings in the file contents ``data`` (bytes or an mmap)"""
+        lowered = None
+        matches = []
+        for index, rule in enumerate(self.rules):
+            haystack = data
+            if rule.ignore_case:
+                if lowered is None:
+                    # ASCII-only lowering keeps every offset
+                    lowered = data[:].lower()
+                haystack = lowered
+            for keyword, pattern in self.patterns[index]:
+                if keyword is not None and keyword not in haystack:
+                    continue
+                for match in pattern.finditer(haystack):
+                    if rule.word_boundary and match.start() and _is_word_byte(haystack[match.start() - 1]):
+                        continue
+                    start, end = match.span(rule.secret_group)
+                    if rule.min_entropy and shannon_entropy(data[start:end]) < rule.min_entropy:
+                        continue
+                    matches.append((start, end, index))
+
+        # A known token assigned to ``token = "..."`` also matches the
+        # entropy-checked generic rule; report it once, as the known token
+        known = [(start, end) for start, end, index in matches if not self.rules[index].min_entropy]
+        findings = []
+        line_number, counted_to = 1, 0
+        for start, end, index in sorted(matches):
+            rule = self.rules[index]
+            if rule.min_entropy and any(s < end and start < e for s, e in known):
+                continue
+            line_start = data.rfind(b'\n', 0, start) + 1
+            line_end = data.find(b'\n', end)
+            if line_end < 0:
+                line_end = len(data)
+            if line_start > counted_to:
+                line_number += data[counted_to:line_start].count(b'\n')
+                counted_to = line_start
+            findings.append(self._finding(
+                rule, relative, line_number, data[line_start:line_end],
+                start - line_start, end - line_start
+            ))
+        return findings
+
+    @staticmethod
+    def _finding(rule: SecretRule, relative: str, line_number: int,
+                 line: bytes, start: int, end: int) -> Dict:
+        snippet = line
+        if rule.redact:
+            # Offsets are in bytes; redact before decoding so they stay valid
+            snippet = line[:start + 4] + b'*' * max(0, end - start - 4) + line[end:]
+        return {
+            'id': rule.id,
+            'file': relative,
+            'line_start': line_number,
+            'line_end': line_number,
+            'code_snippet': snippet.decode('utf-8', errors='replace').rstrip('\r')[:MAX_SNIPPET_CHARS],
+            'message': rule.message,
+            'severity': rule.severity,
+            'category': rule.category,
+            'cwe': list(rule.cwe),
+            'owasp': list(rule.owasp),
+            'fix_recommendations': rule.fix,
+            'references': list(rule.references)
+        }
+
+
+_matcher: Optional[SecretMatcher] = None
+
+
+def matcher() -> SecretMatcher:
+    """The matcher for ``SECRET_RULES``, compiled once per process"""
+    global _matcher
+    if _matcher is None:
+        _matcher = SecretMatcher()
+    return _matcher
+
+
+def scan_file(path: str, relative: str) -> List[Dict]:
+    """Findings in one file; binary and unreadable files have none"""
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data.find(b'\0', 0, BINARY_SNIFF_BYTES) >= 0:
+                    return []
+                return matcher().scan(data, relative)
+    except (OSError, ValueError) as e:
+        logger.debug(f"Skipping {relative}: {str(e)}")
+        return []
+
+
+def scan_files(root: str, relatives: Sequence[str]) -> List[Dict]:
+    """Findings in files under ``root``; runs in the pool"""
+    findings = []
+    for relative in relatives:
+        findings.extend(scan_file(os.path.join(root, relative), relative))
+    return findings
+
+
+def batches(files: Sequence[Tuple[str, int]]) -> List[List[str]]:
+    """Split ``(relative path, size)`` pairs into pool tasks of similar size"""
+    result, current, current_bytes = [], [], 0
+    for relative, size in files:
+        if current and (current_bytes + size > BATCH_MAX_BYTES or len(current) >= BATCH_MAX_FILES):
+            result.append(current)
+            current, current_bytes = [], 0
+        current.append(relative)
+        current_bytes += size
+    if current:
+        result.append(current)
+    return result
+
+
+_executor: Optional[Executor] = None
+_executor_lock = threading.Lock()
+
+
+def executor() -> Executor:
+    """The process-wide scan pool, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # Never fork: the parent runs the scheduler and database threads
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            _executor = ProcessPoolExecutor(max_workers=max(1, SCAN_WORKERS), mp_context=context)
+        return _executor
+
+
+def _discard_executor(broken: Executor) -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            _executor = None
+    broken.shutdown(wait=False)
+
+
+def shutdown() -> None:
+    global _executor
+    with _executor_lock:
+        pool, _executor = _executor, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def scan_tree(root: str, files: Sequence[Tuple[str, int]]) -> List[Dict]:
+    """Findings in ``(relative path, size)`` files under ``root``, blocking"""
+    if sum(size for _, size in files) <= INLINE_MAX_BYTES:
+        return scan_files(root, [relative for relative, _ in files])
+    tasks = batches(files)
+    findings = []
+    for batch in executor().map(scan_files, [root] * len(tasks), tasks):
+        findings.extend(batch)
+    return findings
+
+
+async def scan_tree_async(root: str, files: Sequence[Tuple[str, int]],
+                          on_files: Optional[Callable[[int], None]] = None) -> AsyncIterator[List[Dict]]:
+    """
+    Batches of findings in ``files``, in file order, without blocking the
+    loop. ``on_files`` is called with the number of files in each batch
+    once it is scanned.
+    """
+    on_files = on_files or (lambda count: None)
+    if sum(size for _, size in files) <= INLINE_MAX_BYTES:
+        findings = await asyncio.to_thread(scan_files, root, [relative for relative, _ in files])
+        on_files(len(files))
+        yield findings
+        return
+
+    loop = asyncio.get_running_loop()
+    pool = executor()
+    work = batches(files)
+    tasks = [loop.run_in_executor(pool, scan_files, root, batch) for batch in work]
+    try:
+        for task, batch in zip(tasks, work):
+            try:
+                findings = await task
+            except BrokenProcessPool:
+                # A scan process died (e.g. OOM-killed); scan the batch inline
+                logger.warning("Secrets scan pool broke; restarting it")
+                _discard_executor(pool)
+                findings = await asyncio.to_thread(scan_files, root, batch)
+            on_files(len(batch))
+            yield findings
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,181 @@
+# semgrep_output.py
+"""
+Parsing and summarizing semgrep's JSON output off the event loop.
+
+A large repository produces tens of megabytes of JSON; decoding it and
+building the findings list takes seconds of pure CPU. On the scheduler
+loop that stalls every other scan, progress update and HTTP call, and a
+thread does not help because the work holds the GIL. Output above
+``PARSE_INLINE_MAX_BYTES`` is therefore handled in a small process pool
+(``SEMGREP_PARSE_EXECUTOR=thread`` selects a thread pool instead, e.g.
+where processes cannot be started). orjson is used when installed.
+
+Unpickling one large result would hold the GIL just as long, so the pool
+returns findings as separately pickled chunks that the loop unpickles one
+at a time, yielding in between.
+"""
+import os
+import json
+import pickle
+import asyncio
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional fast path
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+PARSE_EXECUTOR = os.getenv('SEMGREP_PARSE_EXECUTOR', 'process').lower()
+PARSE_WORKERS = int(os.getenv('SEMGREP_PARSE_WORKERS', '2'))
+# Smaller outputs parse faster than a round trip to the pool
+PARSE_INLINE_MAX_BYTES = int(os.getenv('SEMGREP_PARSE_INLINE_MAX_BYTES', str(256 * 1024)))
+# Findings per chunk handed back from the pool; each unpickles in a few ms
+TRANSFER_CHUNK_FINDINGS = 1000
+
+SEVERITY_COUNTS = ('CRITICAL', 'HIGH', 'MEDIUM', 'LOW', 'INFO', 'WARNING', 'ERROR')
+
+
+def loads(data: Union[bytes, str]):
+    """json.loads, through orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def tally_findings(processed_findings: List[Dict]) -> Dict:
+    """Severity, category and file counts of processed findings"""
+    severity_counts = dict.fromkeys(SEVERITY_COUNTS, 0)
+    category_counts = {}
+    files_with_findings = set()
+
+    for finding in processed_findings:
+        if finding['file']:
+            files_with_findings.add(finding['file'])
+        severity_counts[finding['severity']] = severity_counts.get(finding['severity'], 0) + 1
+        category_counts[finding['category']] = category_counts.get(finding['category'], 0) + 1
+
+    return {
+        'severity_counts': severity_counts,
+        'category_counts': category_counts,
+        'files_with_findings': len(files_with_findings)
+    }
+
+
+def summarize_findings(findings: List[Dict]) -> Dict:
+    """Scanner findings and their counts from semgrep ``results`` entries"""
+    processed_findings = []
+
+    for finding in findings:
+        extra = finding.get('extra', {})
+        metadata = extra.get('metadata', {})
+
+        processed_findings.append({
+            'id': finding.get('check_id'),
+            'file': finding.get('path', ''),
+            'line_start': finding.get('start', {}).get('line'),
+            'line_end': finding.get('end', {}).get('line'),
+            'code_snippet': extra.get('lines', ''),
+            'message': extra.get('message', ''),
+            'severity': extra.get('severity', 'INFO').upper(),
+            'category': metadata.get('category', 'security'),
+            'cwe': metadata.get('cwe', []),
+            'owasp': metadata.get('owasp', []),
+            'fix_recommendations': metadata.get('fix', ''),
+            'references': metadata.get('references', [])
+        })
+
+    return {'findings': processed_findings, **tally_findings(processed_findings)}
+
+
+def parse_output(output: Union[bytes, str]) -> Dict:
+    """
+    Decode semgrep --json output and summarize its findings. Raises
+    ValueError if the output is not valid JSON.
+    """
+    results = loads(output)
+    summary = summarize_findings(results.get('results', []))
+    summary['total_files'] = results.get('stats', {}).get('total_files', 0)
+    return summary
+
+
+def _parse_for_transfer(output: bytes) -> Dict:
+    """``parse_output`` with the findings pickled in chunks; runs in the pool"""
+    parsed = parse_output(output)
+    findings = parsed.pop('findings')
+    parsed['findings_chunks'] = [
+        pickle.dumps(findings[i:i + TRANSFER_CHUNK_FINDINGS], protocol=pickle.HIGHEST_PROTOCOL)
+        for i in range(0, len(findings), TRANSFER_CHUNK_FINDINGS)
+    ]
+    return parsed
+
+
+async def _received(parsed: Dict) -> Dict:
+    findings = []
+    for chunk in parsed.pop('findings_chunks'):
+        findings.extend(pickle.loads(chunk))
+        await asyncio.sleep(0)
+    parsed['findings'] = findings
+    return parsed
+
+
+_executor: Optional[Executor] = None
+_executor_lock = threading.Lock()
+
+
+def _create_executor() -> Executor:
+    workers = max(1, PARSE_WORKERS)
+    if PARSE_EXECUTOR == 'process':
+        # Never fork: the parent runs the scheduler and database threads
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        return ProcessPoolExecutor(max_workers=workers, mp_context=context)
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='semgrep-parse')
+
+
+def executor() -> Executor:
+    """The process-wide parse pool, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = _create_executor()
+        return _executor
+
+
+def _discard_executor(broken: Executor) -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            _executor = None
+    broken.shutdown(wait=False)
+
+
+def shutdown() -> None:
+    global _executor
+    with _executor_lock:
+        pool, _executor = _executor, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def parse_output_async(output: bytes) -> Dict:
+    """``parse_output`` without blocking the running event loop on large outputs"""
+    if len(output) <= PARSE_INLINE_MAX_BYTES:
+        return parse_output(output)
+
+    loop = asyncio.get_running_loop()
+    pool = executor()
+    try:
+        parsed = await loop.run_in_executor(pool, _parse_for_transfer, output)
+    except BrokenProcessPool:
+        # A parse process died (e.g. OOM-killed); retry once on a new pool
+        logger.warning("Semgrep output parse pool broke; restarting it")
+        _discard_executor(pool)
+        parsed = await loop.run_in_executor(executor(), _parse_for_transfer, output)
+    return await _received(parsed)
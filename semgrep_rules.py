@@ -0,0 +1,141 @@
+# semgrep_rules.py
+"""
+Local copies of semgrep registry rulesets.
+
+``semgrep scan --config p/python`` downloads the ruleset from the registry
+on every run before it looks at a single file. Registry rulesets (``p/``,
+``r/`` and ``s/`` ids) are therefore downloaded once into
+``SEMGREP_RULES_CACHE_DIR``, shared by every scan and worker process on
+the instance, and refreshed after ``SEMGREP_RULES_TTL_SECONDS``. If a
+refresh fails the previous copy is used; without any copy the registry
+id is passed to semgrep as before. ``auto`` depends on the scanned
+project and is always passed through, so it gets none of this: every
+scan with the default ``SEMGREP_RULESET=auto`` still downloads its rules.
+Deployments should name registry packs instead (render.yaml does).
+
+``rules_identity`` names the rules behind a resolved ``--config`` value
+for the ruleset digest: the content hash of a rules file, or for rules
+semgrep fetches itself the current TTL period, so results scanned with
+them are reused for one TTL at most.
+"""
+import os
+import re
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Tuple
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_URL = 'https://semgrep.dev/c'
+CACHE_DIR = os.getenv('SEMGREP_RULES_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'semgrep_rules'))
+TTL_SECONDS = int(os.getenv('SEMGREP_RULES_TTL_SECONDS', str(24 * 3600)))
+_REGISTRY_ID = re.compile(r'^[prs]/[\w.\-/]+$')
+
+
+def is_registry_ruleset(ruleset: str) -> bool:
+    return bool(_REGISTRY_ID.match(ruleset))
+
+
+class RulesetCache:
+    """Downloads registry rulesets once and hands out the local file"""
+
+    def __init__(self, cache_dir: str = CACHE_DIR, ttl_seconds: int = TTL_SECONDS):
+        self.cache_dir = Path(cache_dir)
+        self.ttl_seconds = ttl_seconds
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        # path -> ((mtime_ns, size), sha256 of the contents)
+        self._hashes: Dict[str, Tuple[Tuple[int, int], str]] = {}
+
+    def path(self, ruleset: str) -> Path:
+        name = hashlib.sha256(ruleset.encode('utf-8')).hexdigest()[:16]
+        return self.cache_dir / f"{name}.yaml"
+
+    def _lock(self, ruleset: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(ruleset, threading.Lock())
+
+    def _fresh(self, path: Path) -> bool:
+        try:
+            return time.time() - path.stat().st_mtime < self.ttl_seconds
+        except FileNotFoundError:
+            return False
+
+    def _download(self, ruleset: str, path: Path) -> None:
+        response = requests.get(f"{REGISTRY_URL}/{ruleset}", timeout=(10, 60))
+        if response.status_code != 200:
+            raise ValueError(f"Failed to download ruleset {ruleset}: {response.status_code}")
+        if b'rules' not in response.content:
+            raise ValueError(f"Registry returned no rules for {ruleset}")
+
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        # Write aside and rename, so other processes never read a partial file
+        partial = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+        try:
+            partial.write_bytes(response.content)
+            os.replace(partial, path)
+        except OSError:
+            partial.unlink(missing_ok=True)
+            raise
+        logger.info(f"Cached ruleset {ruleset} at {path} ({len(response.content) / 1024:.0f}KB)")
+
+    def resolve(self, ruleset: str) -> str:
+        """semgrep --config value for ``ruleset``: a local copy when it can have one"""
+        if not is_registry_ruleset(ruleset):
+            return ruleset
+
+        path = self.path(ruleset)
+        with self._lock(ruleset):
+            if self._fresh(path):
+                return str(path)
+            try:
+                self._download(ruleset, path)
+            except Exception as e:
+                if path.exists():
+                    logger.warning(f"Could not refresh ruleset {ruleset}, using cached copy: {str(e)}")
+                    # Retry after another TTL rather than on every scan
+                    path.touch()
+                else:
+                    logger.warning(f"Could not cache ruleset {ruleset}: {str(e)}")
+                    return ruleset
+        return str(path)
+
+    async def resolve_async(self, ruleset: str) -> str:
+        """``resolve`` without blocking the running event loop on a download"""
+        return await asyncio.to_thread(self.resolve, ruleset)
+
+    def _file_hash(self, path: str) -> str:
+        stat = os.stat(path)
+        version = (stat.st_mtime_ns, stat.st_size)
+        with self._locks_guard:
+            cached = self._hashes.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        with self._locks_guard:
+            self._hashes[path] = (version, digest.hexdigest())
+        return digest.hexdigest()
+
+    def rules_identity(self, rules: str) -> str:
+        """Identity of the rules behind ``rules``, a value returned by ``resolve``"""
+        try:
+            if os.path.isfile(rules):
+                return f"sha256:{self._file_hash(rules)}"
+        except OSError as e:
+            logger.warning(f"Could not hash rules {rules}: {str(e)}")
+        # Semgrep fetches these itself and they change without notice
+        return f"{rules}@{int(time.time() // self.ttl_seconds)}"
+
+
+ruleset_cache = RulesetCache()
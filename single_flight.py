@@ -0,0 +1,165 @@
+# single_flight.py
+"""
+Request coalescing for duplicate scans.
+
+``SingleFlight`` collapses concurrent calls with the same key inside one
+process: the first caller runs the work and every caller that arrives
+while it is running receives the same result. ``advisory_lock`` extends
+that across worker processes with a Postgres session advisory lock.
+``AsyncSingleFlight`` and ``async_advisory_lock`` are the same for code
+running on an event loop.
+"""
+import asyncio
+import hashlib
+import logging
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    __slots__ = ('done', 'result', 'error')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key into one execution"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+
+    def do(self, key: str, fn: Callable[[], Any],
+           timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """
+        Run ``fn`` unless a call with ``key`` is already in flight, in which
+        case wait for it. Returns ``(result, shared)``; followers re-raise the
+        leader's exception.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            if not call.done.wait(timeout):
+                raise TimeoutError(f"Timed out waiting for in-flight call {key}")
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls)
+
+
+def advisory_lock_id(key: str) -> int:
+    """Signed 64-bit lock id for a string key"""
+    return int.from_bytes(hashlib.sha256(key.encode('utf-8')).digest()[:8], 'big', signed=True)
+
+
+@contextmanager
+def advisory_lock(engine, key: str):
+    """
+    Try to take a Postgres session advisory lock for ``key`` on a dedicated
+    connection, held until the block exits. Yields whether it was acquired;
+    never blocks waiting for another holder.
+    """
+    lock_id = advisory_lock_id(key)
+    connection = engine.connect()
+    acquired = False
+    try:
+        acquired = bool(connection.execute(
+            text("SELECT pg_try_advisory_lock(:id)"), {'id': lock_id}
+        ).scalar())
+        connection.commit()
+        yield acquired
+    finally:
+        try:
+            if acquired:
+                connection.execute(text("SELECT pg_advisory_unlock(:id)"), {'id': lock_id})
+                connection.commit()
+        except Exception as e:
+            logger.warning(f"Failed to release advisory lock for {key}: {str(e)}")
+        finally:
+            connection.close()
+
+
+class AsyncSingleFlight:
+    """``SingleFlight`` for coroutines running on one event loop"""
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Future] = {}
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]],
+                 timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """
+        Await ``fn()`` unless a call with ``key`` is already in flight, in
+        which case wait for its result. Returns ``(result, shared)``;
+        followers re-raise the leader's exception.
+        """
+        call = self._calls.get(key)
+        if call is not None:
+            try:
+                return await asyncio.wait_for(asyncio.shield(call), timeout), True
+            except asyncio.TimeoutError:
+                raise TimeoutError(f"Timed out waiting for in-flight call {key}") from None
+
+        call = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+            call.set_result(result)
+            return result, False
+        except BaseException as e:
+            # Followers must not see the leader's own cancellation as theirs
+            if isinstance(e, asyncio.CancelledError):
+                e = RuntimeError(f"In-flight call {key} was cancelled")
+            call.set_exception(e)
+            call.exception()  # retrieved, even when nobody else was waiting
+            raise
+        finally:
+            del self._calls[key]
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+
+@asynccontextmanager
+async def async_advisory_lock(engine, key: str):
+    """``advisory_lock`` on a connection of an ``AsyncEngine``"""
+    lock_id = advisory_lock_id(key)
+    async with engine.connect() as connection:
+        acquired = False
+        try:
+            acquired = bool((await connection.execute(
+                text("SELECT pg_try_advisory_lock(:id)"), {'id': lock_id}
+            )).scalar())
+            await connection.commit()
+            yield acquired
+        finally:
+            if acquired:
+                try:
+                    await connection.execute(text("SELECT pg_advisory_unlock(:id)"), {'id': lock_id})
+                    await connection.commit()
+                except Exception as e:
+                    logger.warning(f"Failed to release advisory lock for {key}: {str(e)}")
@@ -0,0 +1,169 @@
+# storage.py
+"""
+Compact storage format for analysis results.
+
+Findings repeat the same rule metadata (message, CWE/OWASP lists,
+references, fix text) for every match of a rule. ``pack_results`` strips
+those fields whenever they equal the shared per-rule entry and compresses
+the remaining payload; ``unpack_results`` reverses it exactly.
+"""
+import os
+import json
+import gzip
+import logging
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - optional dependency
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Per-finding fields that are a property of the rule, not of the match
+RULE_FIELDS = ('message', 'cwe', 'owasp', 'references', 'fix_recommendations')
+
+# Key holding the bitmask of RULE_FIELDS stripped from a packed finding
+STRIPPED_KEY = '_r'
+
+PAYLOAD_VERSION = 1
+
+CODEC_ZSTD = b'Z'
+CODEC_GZIP = b'G'
+
+COMPRESSION = os.getenv('RESULTS_COMPRESSION', 'zstd' if zstandard else 'gzip').lower()
+ZSTD_LEVEL = int(os.getenv('RESULTS_ZSTD_LEVEL', '3'))
+GZIP_LEVEL = int(os.getenv('RESULTS_GZIP_LEVEL', '6'))
+
+
+def compress_json(data) -> bytes:
+    """Serialize to compact JSON and compress, prefixed with a codec tag"""
+    raw = json.dumps(data, separators=(',', ':'), default=str).encode('utf-8')
+    if COMPRESSION == 'zstd' and zstandard is not None:
+        return CODEC_ZSTD + zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    return CODEC_GZIP + gzip.compress(raw, compresslevel=GZIP_LEVEL)
+
+
+def decompress_json(blob: bytes):
+    """Decode a blob produced by ``compress_json``"""
+    blob = bytes(blob)
+    codec, body = blob[:1], blob[1:]
+    if codec == CODEC_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to decode these results")
+        raw = zstandard.ZstdDecompressor().decompress(body)
+    elif codec == CODEC_GZIP:
+        raw = gzip.decompress(body)
+    else:
+        raise ValueError(f"Unknown results codec: {codec!r}")
+    return json.loads(raw)
+
+
+def _findings(results) -> list:
+    if isinstance(results, dict) and isinstance(results.get('findings'), list):
+        return results['findings']
+    return []
+
+
+def pack_results(results, catalog: Dict[str, Dict]) -> Tuple[bytes, Dict[str, Dict]]:
+    """
+    Compress ``results`` against a rule metadata catalog.
+
+    ``catalog`` maps rule id to its known metadata. Rules not in the catalog
+    are created from their first finding and returned as ``new_rules`` so the
+    caller can persist them. Only findings carrying an ``id`` are deduplicated;
+    any other shape (e.g. raw semgrep output) is just compressed.
+    """
+    new_rules = {}
+    packed = results
+
+    findings = _findings(results)
+    if findings:
+        packed_findings = []
+        for finding in findings:
+            rule_id = finding.get('id') if isinstance(finding, dict) else None
+            if not rule_id:
+                packed_findings.append(finding)
+                continue
+
+            rule = catalog.get(rule_id)
+            if rule is None:
+                rule = new_rules.get(rule_id)
+            if rule is None:
+                rule = {
+                    name: finding[name] for name in RULE_FIELDS
+                    if finding.get(name) is not None
+                }
+                new_rules[rule_id] = rule
+
+            mask = 0
+            compact = {}
+            for key, value in finding.items():
+                if key in rule and rule[key] == value:
+                    mask |= 1 << RULE_FIELDS.index(key)
+                else:
+                    compact[key] = value
+            if mask:
+                compact[STRIPPED_KEY] = mask
+            packed_findings.append(compact)
+
+        packed = {**results, 'findings': packed_findings}
+
+    return compress_json({'v': PAYLOAD_VERSION, 'results': packed}), new_rules
+
+
+def decode_payload(blob: bytes) -> Dict:
+    """Decompress a packed blob without restoring rule metadata"""
+    payload = decompress_json(blob)
+    if not isinstance(payload, dict) or payload.get('v') != PAYLOAD_VERSION:
+        raise ValueError("Unsupported results payload")
+    return payload
+
+
+def payload_rule_ids(payload: Dict) -> Set[str]:
+    """Rule ids whose metadata is needed to restore a decoded payload"""
+    return {
+        finding['id'] for finding in _findings(payload['results'])
+        if isinstance(finding, dict) and finding.get(STRIPPED_KEY)
+    }
+
+
+def restore_payload(payload: Dict, catalog: Dict[str, Dict]):
+    """Re-attach stripped rule metadata to a decoded payload"""
+    results = payload['results']
+    findings = _findings(results)
+    if not findings:
+        return results
+
+    restored = []
+    for finding in findings:
+        mask = finding.pop(STRIPPED_KEY, 0) if isinstance(finding, dict) else 0
+        if mask:
+            rule = catalog.get(finding.get('id'), {})
+            for index, name in enumerate(RULE_FIELDS):
+                if mask & (1 << index) and name in rule:
+                    finding[name] = rule[name]
+        restored.append(finding)
+    results['findings'] = restored
+    return results
+
+
+def unpack_results(blob: Optional[bytes], catalog_loader) -> Optional[Dict]:
+    """
+    Decode a packed blob, loading rule metadata through
+    ``catalog_loader(rule_ids) -> {rule_id: metadata}``.
+    """
+    if blob is None:
+        return None
+    payload = decode_payload(blob)
+    rule_ids = payload_rule_ids(payload)
+    catalog = catalog_loader(rule_ids) if rule_ids else {}
+    return restore_payload(payload, catalog)
+
+
+def rule_ids_in(results) -> Iterable[str]:
+    """Rule ids referenced by unpacked results"""
+    return {
+        finding['id'] for finding in _findings(results)
+        if isinstance(finding, dict) and finding.get('id')
+    }
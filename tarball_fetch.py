@@ -0,0 +1,158 @@
+# tarball_fetch.py
+"""
+Fetching a repository as a GitHub tarball instead of a git clone.
+
+A one-shot scan of the default branch needs neither history nor the git
+protocol negotiation. The tarball of the head commit is streamed and
+extracted member by member: files matching the scan's exclude patterns,
+files over the size limit, links and special files are skipped inside
+the stream and never written to disk. Runs in a worker thread; setting
+the ``stop`` event aborts it at the next read.
+"""
+import os
+import re
+import time
+import shutil
+import tarfile
+import fnmatch
+import logging
+import threading
+from pathlib import PurePosixPath, Path
+from typing import BinaryIO, Callable, Dict, Iterable, List, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+GITHUB_API_URL = 'https://api.github.com'
+READ_TIMEOUT_SECONDS = 60
+PROGRESS_INTERVAL_SECONDS = 0.5
+_BRACES = re.compile(r'\{([^{}]*)\}')
+
+
+class FetchStopped(Exception):
+    """The fetch was stopped through its stop event"""
+
+
+def expand_patterns(patterns: Iterable[str]) -> List[str]:
+    """Expand ``*.{a,b}`` shell braces, which fnmatch does not understand"""
+    expanded = []
+    for pattern in patterns:
+        match = _BRACES.search(pattern)
+        if match is None:
+            expanded.append(pattern)
+            continue
+        for option in match.group(1).split(','):
+            expanded.extend(expand_patterns([pattern[:match.start()] + option + pattern[match.end():]]))
+    return expanded
+
+
+class _CountingReader:
+    """Wraps the response stream: counts compressed bytes and honours ``stop``"""
+
+    def __init__(self, raw: BinaryIO, stop: threading.Event,
+                 on_bytes: Optional[Callable[[int], None]] = None):
+        self._raw = raw
+        self._stop = stop
+        self._on_bytes = on_bytes
+        self.bytes_read = 0
+
+    def read(self, size: int = -1) -> bytes:
+        if self._stop.is_set():
+            raise FetchStopped('Tarball fetch stopped')
+        data = self._raw.read(size)
+        self.bytes_read += len(data)
+        if self._on_bytes is not None:
+            self._on_bytes(self.bytes_read)
+        return data
+
+
+def _throttled(report: Callable[..., None]) -> Callable[..., None]:
+    """Forward at most one progress update per PROGRESS_INTERVAL_SECONDS"""
+    state = {'at': 0.0, 'pending': {}}
+
+    def forward(force: bool = False, **progress):
+        state['pending'].update(progress)
+        now = time.monotonic()
+        if force or now - state['at'] >= PROGRESS_INTERVAL_SECONDS:
+            report(**state['pending'])
+            state['at'] = now
+            state['pending'] = {}
+
+    return forward
+
+
+def extract_stream(stream: BinaryIO, target: Path, exclude_patterns: Iterable[str],
+                   max_file_size_mb: float, max_total_size_mb: float,
+                   progress: Optional[Callable[..., None]] = None,
+                   stop: Optional[threading.Event] = None) -> Dict:
+    """
+    Extract a gzipped tar stream into ``target``, dropping the archive's
+    top-level directory. Returns extraction counters.
+    """
+    stop = stop or threading.Event()
+    report = _throttled(progress or (lambda **_: None))
+    patterns = expand_patterns(exclude_patterns)
+    max_file_bytes = max_file_size_mb * 1024 * 1024
+    max_total_bytes = max_total_size_mb * 1024 * 1024
+    stats = {
+        'files_extracted': 0, 'files_skipped': 0, 'files_too_large': 0,
+        'bytes_written': 0, 'tarball_bytes': 0
+    }
+
+    reader = _CountingReader(stream, stop, lambda count: report(tarball_bytes=count))
+    target.mkdir(parents=True, exist_ok=True)
+    with tarfile.open(fileobj=reader, mode='r|gz') as archive:
+        for member in archive:
+            parts = PurePosixPath(member.name).parts[1:]
+            if not parts or member.isdir():
+                continue
+            if (not member.isreg()
+                    or any(part in ('', '.', '..') for part in parts)
+                    or PurePosixPath(member.name).is_absolute()):
+                stats['files_skipped'] += 1
+                continue
+            if any(fnmatch.fnmatch(part, pattern) for part in parts for pattern in patterns):
+                stats['files_skipped'] += 1
+                continue
+            if member.size > max_file_bytes:
+                stats['files_too_large'] += 1
+                continue
+            if stats['bytes_written'] + member.size > max_total_bytes:
+                raise ValueError(
+                    f"Extracted files exceed limit of {max_total_size_mb}MB"
+                )
+
+            destination = target.joinpath(*parts)
+            destination.parent.mkdir(parents=True, exist_ok=True)
+            source = archive.extractfile(member)
+            with open(destination, 'wb') as output:
+                shutil.copyfileobj(source, output, 1024 * 1024)
+            if member.mode & 0o111:
+                os.chmod(destination, 0o755)
+
+            stats['files_extracted'] += 1
+            stats['bytes_written'] += member.size
+            report(files_extracted=stats['files_extracted'])
+
+    stats['tarball_bytes'] = reader.bytes_read
+    report(force=True, **stats)
+    return stats
+
+
+def fetch_tarball(full_name: str, ref: str, token: str, target: Path,
+                  exclude_patterns: Iterable[str], max_file_size_mb: float,
+                  max_total_size_mb: float, progress: Optional[Callable[..., None]] = None,
+                  stop: Optional[threading.Event] = None) -> Dict:
+    """Stream the GitHub tarball of ``full_name`` at ``ref`` into ``target``"""
+    url = f"{GITHUB_API_URL}/repos/{full_name}/tarball/{ref}"
+    headers = {'Authorization': f'Bearer {token}', 'Accept': 'application/vnd.github+json'}
+    # The API answers with a redirect to a short-lived codeload URL
+    with requests.get(url, headers=headers, stream=True,
+                      timeout=(10, READ_TIMEOUT_SECONDS)) as response:
+        if response.status_code != 200:
+            raise ValueError(f"Failed to download tarball of {full_name}@{ref}: {response.status_code}")
+        return extract_stream(
+            response.raw, target, exclude_patterns, max_file_size_mb, max_total_size_mb,
+            progress=progress, stop=stop
+        )
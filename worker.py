@@ -0,0 +1,262 @@
+# worker.py
+"""
+Scan worker: runs queued scans outside the web tier.
+
+With ``SCAN_EXECUTION=worker`` the web service writes scans to the
+``scan_queue`` table instead of running them. Workers claim jobs with
+FOR UPDATE SKIP LOCKED, most urgent and cheapest first, and run them on
+their own scan scheduler, so scan concurrency and semgrep memory are set
+per worker and workers scale independently of web processes.
+
+Running jobs are heartbeated; jobs of a worker that died are requeued by
+whichever worker notices first. Progress snapshots and cancel requests
+reach the web tier through the shared cache backend
+(``RESPONSE_CACHE_BACKEND=redis``); without one the worker refuses to
+start, since the web tier would never see progress or reach its scans.
+``--allow-local-state`` overrides that for local runs.
+
+Usage:
+    python worker.py [--concurrency N] [--max-memory-mb M] [--poll-interval S] [--once]
+                     [--allow-local-state]
+"""
+import os
+import time
+import signal
+import socket
+import argparse
+import logging
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass, field, replace
+from typing import Dict, Tuple
+
+from flask import Flask
+
+import secrets_scan
+import semgrep_output
+from cancellation import scan_cancellations
+from github_app import git_integration
+from models import db, QueuedScan, get_database_url
+from scan_status import scan_status
+from scan_jobs import (
+    INTERACTIVE_SCAN_CONFIG, SCAN_AGING_SECONDS, SCAN_PER_INSTALLATION, SCAN_PER_USER,
+    SCAN_TIMEOUT_SECONDS, InstallationToken, Priority, ScanJob, scan_scheduler
+)
+from scanner import semgrep_version
+from semgrep_rules import ruleset_cache
+from workspace import workspaces
+
+logger = logging.getLogger(__name__)
+
+# Scans still running when the drain period ends are cancelled; give them
+# this long to kill their processes and record the cancellation
+CANCEL_GRACE_SECONDS = 10
+
+
+@dataclass
+class WorkerSettings:
+    """Capacity and timing of one worker process"""
+    concurrency: int = int(os.getenv('WORKER_CONCURRENCY', '2'))
+    max_memory_mb: int = int(os.getenv('WORKER_MAX_MEMORY_MB', '1500'))
+    poll_interval: float = float(os.getenv('WORKER_POLL_SECONDS', '2'))
+    heartbeat_interval: float = float(os.getenv('WORKER_HEARTBEAT_SECONDS', '30'))
+    # How long a stopping worker waits for its running scans
+    drain_seconds: int = int(os.getenv('WORKER_DRAIN_SECONDS', str(SCAN_TIMEOUT_SECONDS + 30)))
+    worker_id: str = field(default_factory=lambda: f"{socket.gethostname()}:{os.getpid()}")
+
+
+def create_app() -> Flask:
+    """Flask app for database access only; the worker serves no routes"""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = get_database_url()
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+class ScanWorker:
+    """Claims queued scans up to its concurrency and runs them"""
+
+    def __init__(self, app: Flask, settings: WorkerSettings):
+        self.app = app
+        self.settings = settings
+        # scan_queue id -> (analysis id, completion future)
+        self.running: Dict[int, Tuple[int, Future]] = {}
+        self._tokens: Dict[str, InstallationToken] = {}
+        self._stop = threading.Event()
+        self._last_heartbeat = 0.0
+
+        scan_scheduler.init_app(app)
+        scan_scheduler.configure(
+            scan_config=replace(INTERACTIVE_SCAN_CONFIG, max_memory_mb=settings.max_memory_mb),
+            slots=settings.concurrency
+        )
+
+    def stop(self, *_) -> None:
+        """Stop claiming jobs; running scans are drained"""
+        if not self._stop.is_set():
+            logger.info(f"Worker {self.settings.worker_id} stopping")
+        self._stop.set()
+
+    def _token(self, installation_id: str) -> InstallationToken:
+        """One token per installation, shared by its jobs and re-minted near expiry"""
+        token = self._tokens.get(installation_id)
+        if token is None:
+            token = InstallationToken(lambda: git_integration.get_access_token(int(installation_id)))
+            self._tokens[installation_id] = token
+        return token
+
+    def _job(self, queued: QueuedScan) -> ScanJob:
+        return ScanJob(
+            analysis_id=queued.analysis_id,
+            repository=queued.repository_name,
+            installation_id=queued.installation_id,
+            user_id=queued.user_id,
+            token=self._token(queued.installation_id),
+            head_sha=queued.head_sha,
+            batch_id=queued.batch_id,
+            priority=Priority(queued.priority),
+            cost_mb=queued.cost_mb
+        )
+
+    def _reap(self) -> None:
+        """Remove the queue rows of scans that have recorded their outcome"""
+        done = [queue_id for queue_id, (_, future) in self.running.items() if future.done()]
+        QueuedScan.finish(done)
+        for queue_id in done:
+            analysis_id, future = self.running.pop(queue_id)
+            error = future.exception()
+            if error is not None:
+                logger.error(f"Scan job for analysis {analysis_id} failed: {str(error)}")
+
+    def poll(self) -> int:
+        """
+        One round: reap finished scans, heartbeat running ones, requeue
+        jobs of dead workers and claim free capacity. Returns the number
+        of jobs claimed.
+        """
+        with self.app.app_context():
+            self._reap()
+
+            now = time.monotonic()
+            if self.running and now - self._last_heartbeat >= self.settings.heartbeat_interval:
+                QueuedScan.heartbeat(self.running)
+                self._last_heartbeat = now
+
+            if self._stop.is_set():
+                return 0
+
+            QueuedScan.recover_stale()
+            # The same aging and per-user/installation caps as the
+            # admission queue, applied across all workers
+            claimed = QueuedScan.claim(
+                self.settings.worker_id,
+                self.settings.concurrency - len(self.running),
+                aging_seconds=SCAN_AGING_SECONDS,
+                per_user=max(1, SCAN_PER_USER),
+                per_installation=max(1, SCAN_PER_INSTALLATION)
+            )
+            jobs = [(queued.id, self._job(queued)) for queued in claimed]
+
+        for queue_id, job in jobs:
+            logger.info(f"Claimed analysis {job.analysis_id} of {job.repository}")
+            self.running[queue_id] = (job.analysis_id, scan_scheduler.submit(job))
+        return len(jobs)
+
+    def run(self, once: bool = False) -> None:
+        """Poll until stopped; with ``once``, until the queue is empty"""
+        logger.info(
+            f"Worker {self.settings.worker_id} started: concurrency {self.settings.concurrency}, "
+            f"semgrep memory {self.settings.max_memory_mb}MB"
+        )
+        while not self._stop.is_set():
+            try:
+                claimed = self.poll()
+            except Exception as e:
+                logger.error(f"Worker poll failed: {str(e)}")
+                claimed = 0
+            if once and not claimed and not self.running:
+                break
+            if not claimed:
+                self._stop.wait(self.settings.poll_interval)
+        self.drain()
+
+    def drain(self) -> None:
+        """Wait for running scans, cancelling those that outlast the drain period"""
+        deadline = time.monotonic() + self.settings.drain_seconds
+        cancelled = False
+        while self.running:
+            if time.monotonic() >= deadline:
+                if cancelled:
+                    logger.warning(
+                        f"{len(self.running)} scans did not stop; their jobs are requeued "
+                        f"once their heartbeat goes stale"
+                    )
+                    return
+                logger.warning(f"Cancelling {len(self.running)} scans still running at shutdown")
+                for analysis_id, _ in self.running.values():
+                    scan_cancellations.cancel(analysis_id, 'Scan worker shut down')
+                deadline = time.monotonic() + CANCEL_GRACE_SECONDS
+                cancelled = True
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"Worker poll failed: {str(e)}")
+            time.sleep(min(1.0, self.settings.poll_interval))
+        logger.info(f"Worker {self.settings.worker_id} stopped")
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description='Run queued repository scans')
+    defaults = WorkerSettings()
+    parser.add_argument('--concurrency', type=int, default=defaults.concurrency,
+                        help='scans to run at the same time')
+    parser.add_argument('--max-memory-mb', type=int, default=defaults.max_memory_mb,
+                        help='semgrep --max-memory per scan')
+    parser.add_argument('--poll-interval', type=float, default=defaults.poll_interval,
+                        help='seconds between queue polls when idle')
+    parser.add_argument('--drain-seconds', type=int, default=defaults.drain_seconds,
+                        help='how long to wait for running scans on shutdown')
+    parser.add_argument('--once', action='store_true',
+                        help='exit once the queue is empty instead of polling forever')
+    parser.add_argument('--allow-local-state', action='store_true',
+                        help='start without a shared cache backend; progress and cancel '
+                             'requests then stay in this process')
+    args = parser.parse_args(argv)
+
+    if not (scan_status.shared and scan_cancellations.shared):
+        if not args.allow_local_state:
+            logger.error(
+                "No shared cache backend: set RESPONSE_CACHE_BACKEND=redis and REDIS_URL "
+                "so the web tier sees scan progress and can cancel scans"
+            )
+            raise SystemExit(1)
+        logger.warning("Running without a shared cache backend; progress and cancel stay local")
+
+    settings = WorkerSettings(
+        concurrency=max(1, args.concurrency),
+        max_memory_mb=max(256, args.max_memory_mb),
+        poll_interval=max(0.1, args.poll_interval),
+        drain_seconds=max(0, args.drain_seconds)
+    )
+
+    worker = ScanWorker(create_app(), settings)
+    # Before the first claim, so no scan pays for them
+    semgrep_version()
+    ruleset_cache.resolve(scan_scheduler.scan_config.ruleset)
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    try:
+        worker.run(once=args.once)
+    finally:
+        semgrep_output.shutdown()
+        secrets_scan.shutdown()
+        workspaces.shutdown()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    main()
@@ -0,0 +1,170 @@
+# workspace.py
+"""
+Scan workspaces: where repositories are checked out for scanning.
+
+Small repositories go to a memory-backed filesystem (``/dev/shm`` or a
+tmpfs mount), so the clone, semgrep's reads and the final delete never
+touch the instance's slow disk; larger ones go to the regular temporary
+directory. Memory use is capped twice: per repository by
+``SCAN_WORKSPACE_MEMORY_MAX_MB`` (estimated from the GitHub size times
+``SCAN_WORKSPACE_EXPANSION``) and in total by
+``SCAN_WORKSPACE_MEMORY_BUDGET_MB``, besides the free space left on the
+mount itself.
+
+Released workspaces are renamed out of the way and deleted by a
+background thread, so a scan never waits for ``rmtree``; a few empty
+workspace directories are kept ready for the next scans.
+"""
+import os
+import uuid
+import shutil
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+MEMORY_ROOT = os.getenv('SCAN_WORKSPACE_MEMORY_ROOT', '/dev/shm')
+MEMORY_MAX_MB = float(os.getenv('SCAN_WORKSPACE_MEMORY_MAX_MB', '64'))
+MEMORY_BUDGET_MB = float(os.getenv('SCAN_WORKSPACE_MEMORY_BUDGET_MB', '256'))
+# Checked-out size relative to the (packed) size GitHub reports
+EXPANSION = float(os.getenv('SCAN_WORKSPACE_EXPANSION', '3'))
+# Empty workspaces kept ready per tier
+POOL_SIZE = int(os.getenv('SCAN_WORKSPACE_POOL_SIZE', '2'))
+
+MEMORY, DISK = 'memory', 'disk'
+PREFIX = 'scanner_'
+
+
+@dataclass
+class Workspace:
+    """A directory a scan may fill and that is emptied when released"""
+    path: Path
+    tier: str
+    reserved_mb: float = 0
+
+    @property
+    def in_memory(self) -> bool:
+        return self.tier == MEMORY
+
+
+class WorkspaceManager:
+    """Hands out memory or disk workspaces and deletes them in the background"""
+
+    def __init__(self, memory_root: Optional[str] = MEMORY_ROOT,
+                 memory_max_mb: float = MEMORY_MAX_MB,
+                 memory_budget_mb: float = MEMORY_BUDGET_MB,
+                 expansion: float = EXPANSION, pool_size: int = POOL_SIZE,
+                 disk_root: Optional[str] = None):
+        self.roots = {MEMORY: memory_root or None, DISK: disk_root or tempfile.gettempdir()}
+        self.memory_max_mb = memory_max_mb
+        self.memory_budget_mb = memory_budget_mb
+        self.expansion = max(1.0, expansion)
+        self.pool_size = max(0, pool_size)
+        self._pool: Dict[str, List[Path]] = {MEMORY: [], DISK: []}
+        self._memory_reserved = 0.0
+        self._memory_usable: Optional[bool] = None
+        self._lock = threading.Lock()
+        self._deleter = ThreadPoolExecutor(max_workers=1, thread_name_prefix='workspace-cleanup')
+
+    def _memory_root_usable(self) -> bool:
+        if self._memory_usable is None:
+            root = self.roots[MEMORY]
+            self._memory_usable = bool(
+                root and self.memory_max_mb > 0 and os.path.isdir(root) and os.access(root, os.W_OK)
+            )
+            if root and not self._memory_usable:
+                logger.info(f"Memory workspaces disabled: {root} is not a writable directory")
+        return self._memory_usable
+
+    def _fits_in_memory(self, need_mb: float) -> bool:
+        if need_mb > self.memory_max_mb or not self._memory_root_usable():
+            return False
+        if self._memory_reserved + need_mb > self.memory_budget_mb:
+            return False
+        try:
+            free_mb = shutil.disk_usage(self.roots[MEMORY]).free / (1024 * 1024)
+        except OSError:
+            return False
+        return need_mb <= free_mb
+
+    def _directory(self, tier: str) -> Path:
+        pool = self._pool[tier]
+        while pool:
+            path = pool.pop()
+            if path.is_dir():
+                return path
+        return Path(tempfile.mkdtemp(prefix=PREFIX, dir=self.roots[tier]))
+
+    def acquire(self, size_mb: float, in_memory: Optional[bool] = None) -> Workspace:
+        """
+        Workspace for a repository of ``size_mb`` (as reported by GitHub).
+        ``in_memory=False`` forces a disk workspace.
+        """
+        need_mb = max(size_mb or 0, 1) * self.expansion
+        with self._lock:
+            if in_memory is not False and self._fits_in_memory(need_mb):
+                try:
+                    path = self._directory(MEMORY)
+                    self._memory_reserved += need_mb
+                    return Workspace(path, MEMORY, need_mb)
+                except OSError as e:
+                    logger.warning(f"Could not create memory workspace: {str(e)}")
+            return Workspace(self._directory(DISK), DISK)
+
+    def release(self, workspace: Workspace) -> None:
+        """Empty a workspace without waiting for the delete"""
+        path = workspace.path
+        trash = path.with_name(f".trash-{uuid.uuid4().hex}")
+        try:
+            os.rename(path, trash)
+        except FileNotFoundError:
+            self._unreserve(workspace)
+            return
+        except OSError as e:
+            logger.warning(f"Could not move workspace {path} aside: {str(e)}")
+            trash = path
+
+        with self._lock:
+            if trash != path and len(self._pool[workspace.tier]) < self.pool_size:
+                try:
+                    os.mkdir(path, 0o700)
+                    self._pool[workspace.tier].append(path)
+                except OSError:
+                    pass
+
+        future = self._deleter.submit(shutil.rmtree, trash, True)
+        # Memory is only free once the files are gone
+        future.add_done_callback(lambda _: self._unreserve(workspace))
+
+    def _unreserve(self, workspace: Workspace) -> None:
+        if workspace.in_memory:
+            with self._lock:
+                self._memory_reserved = max(0.0, self._memory_reserved - workspace.reserved_mb)
+                workspace.reserved_mb = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'memory_root': self.roots[MEMORY] if self._memory_usable is not False else None,
+                'memory_reserved_mb': round(self._memory_reserved, 1),
+                'memory_budget_mb': self.memory_budget_mb,
+                'pooled': {tier: len(paths) for tier, paths in self._pool.items()}
+            }
+
+    def shutdown(self) -> None:
+        """Remove pooled directories and wait for pending deletes"""
+        with self._lock:
+            pooled = [path for paths in self._pool.values() for path in paths]
+            for paths in self._pool.values():
+                paths.clear()
+        for path in pooled:
+            shutil.rmtree(path, ignore_errors=True)
+        self._deleter.shutdown(wait=True)
+
+
+workspaces = WorkspaceManager()